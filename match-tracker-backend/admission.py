@@ -0,0 +1,263 @@
+# admission.py
+# Admission control in front of the API:
+#   * per-client token buckets for public traffic (reads, comments, auth, and
+#     any other write that isn't privileged): per route, and for writes per
+#     row, so the nine lines of a match don't share one bucket
+#   * a global in-flight limit that sheds public requests with 503 while
+#     keeping a reserved slice of capacity for score/match writes
+#
+# A request is a privileged write only when it is one of WRITE_ROUTES *and*
+# carries a valid admin bearer token (checked by the `is_admin` callback the
+# app passes in; signature and expiry only, no database lookup). Those are
+# never rate limited and may use the reserved slots. Everything else that
+# mutates, including anonymous or non-admin writes and writes to routes that
+# don't exist, is public: rate limited and shed first. POST /batch only
+# reads, so it counts as a public read.
+import math
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+from metrics import metrics
+
+
+def _env_float(name, default):
+    return float(os.getenv(name, str(default)))
+
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1").strip().lower() not in ("0", "false", "no", "off")
+# public GETs, per client per route
+RATE_LIMIT_READ_PER_SEC = _env_float("RATE_LIMIT_READ_PER_SEC", 10)
+RATE_LIMIT_READ_BURST = _env_float("RATE_LIMIT_READ_BURST", 40)
+# writes without an admin token, per client per route
+RATE_LIMIT_WRITE_PER_MIN = _env_float("RATE_LIMIT_WRITE_PER_MIN", 30)
+RATE_LIMIT_WRITE_BURST = _env_float("RATE_LIMIT_WRITE_BURST", 10)
+# POST /scores/{id}/comments, per client per route
+RATE_LIMIT_COMMENT_PER_MIN = _env_float("RATE_LIMIT_COMMENT_PER_MIN", 10)
+RATE_LIMIT_COMMENT_BURST = _env_float("RATE_LIMIT_COMMENT_BURST", 3)
+# /auth/login and /auth/register
+RATE_LIMIT_AUTH_PER_MIN = _env_float("RATE_LIMIT_AUTH_PER_MIN", 10)
+RATE_LIMIT_AUTH_BURST = _env_float("RATE_LIMIT_AUTH_BURST", 5)
+# global concurrency
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "64"))
+RESERVED_WRITE_SLOTS = int(os.getenv("RESERVED_WRITE_SLOTS", "8"))
+# how many (client, route) buckets to remember
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "10000"))
+# Behind Render's proxy every request comes from the proxy's address, so the
+# client is read from X-Forwarded-For instead: on by default on Render (which
+# sets RENDER), off elsewhere. The proxy appends the address it saw, so the
+# client is FORWARDED_FOR_HOPS entries from the right (hops a client can't forge).
+TRUST_FORWARDED_FOR = os.getenv(
+    "TRUST_FORWARDED_FOR", "1" if os.getenv("RENDER") else "0"
+).strip().lower() in ("1", "true", "yes", "on")
+FORWARDED_FOR_HOPS = max(1, int(os.getenv("FORWARDED_FOR_HOPS", "1")))
+
+EXEMPT_PATHS = {"/healthz", "/readyz", "/metrics"}
+# long-polls idle most of their life; rate limited, but they don't hold an
+# in-flight slot (changes.py caps them with CHANGES_MAX_WAITERS)
+LONG_POLL_PATHS = {"/changes"}
+
+# (method, route_key) of the scorer/admin endpoints that may be privileged
+WRITE_ROUTES = {
+    ("POST", "/schedule"),
+    ("POST", "/schedule/{id}/start"),
+    ("PUT", "/schedule/{id}/lineup"),
+    ("POST", "/schedule/{id}/complete"),
+    ("POST", "/schedule/{id}/snapshot"),
+    ("DELETE", "/schedule/{id}"),
+    ("POST", "/players"),
+    ("PUT", "/players/{id}"),
+    ("DELETE", "/players/{id}"),
+    ("POST", "/admin/players"),
+    ("POST", "/scores/{id}/start"),
+    ("POST", "/scores/{id}/complete"),
+    ("POST", "/scores/{id}/point"),
+    ("PUT", "/scores/{id}"),
+    ("DELETE", "/scores/{id}"),
+    ("POST", "/scores/{id}/momentum"),
+    ("DELETE", "/scores/{id}/momentum"),
+    ("PUT", "/scores/match/{id}"),
+    ("POST", "/scores/match/{id}/complete"),
+    ("POST", "/scores/sync"),
+}
+
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+def route_key(path: str) -> str:
+    """/scores/12/comments -> /scores/{id}/comments (cheap, no router lookup)."""
+    return _ID_SEGMENT.sub("/{id}", path.rstrip("/") or "/")
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate  # tokens per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, now: Optional[float] = None) -> Tuple[bool, float]:
+        """Consume one token. Returns (allowed, seconds until a token is available)."""
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True, 0.0
+        return False, (1 - self.tokens) / self.rate if self.rate > 0 else 60.0
+
+
+class RateLimiter:
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_CLIENTS):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[tuple, TokenBucket]" = OrderedDict()
+
+    def check(self, client: str, route: str, rate: float, burst: float) -> Tuple[bool, float]:
+        key = (client, route)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rate, burst)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket.take()
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class ConcurrencyLimiter:
+    """Counts in-flight requests; public traffic may not use the reserved write slots."""
+
+    def __init__(self, total: int = MAX_CONCURRENT_REQUESTS, reserved: int = RESERVED_WRITE_SLOTS):
+        self.total = total
+        self.reserved = min(reserved, total)
+        self.in_flight = 0
+        self.in_flight_public = 0
+
+    def try_acquire(self, public: bool) -> bool:
+        if public:
+            if self.in_flight >= self.total - self.reserved:
+                return False
+            self.in_flight_public += 1
+        elif self.in_flight >= self.total:
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self, public: bool):
+        self.in_flight -= 1
+        if public:
+            self.in_flight_public -= 1
+
+
+def classify(method: str, route: str, admin: bool = False) -> Optional[Tuple[str, float, float]]:
+    """Rate-limit class for a request: (name, tokens/sec, burst), or None for privileged writes."""
+    if route.startswith("/auth/"):
+        return "auth", RATE_LIMIT_AUTH_PER_MIN / 60.0, RATE_LIMIT_AUTH_BURST
+    if method in ("GET", "HEAD") or (method == "POST" and route == "/batch"):
+        return "read", RATE_LIMIT_READ_PER_SEC, RATE_LIMIT_READ_BURST
+    if method == "POST" and route.endswith("/comments"):
+        return "comment", RATE_LIMIT_COMMENT_PER_MIN / 60.0, RATE_LIMIT_COMMENT_BURST
+    if admin and (method, route) in WRITE_ROUTES:
+        return None
+    return "write", RATE_LIMIT_WRITE_PER_MIN / 60.0, RATE_LIMIT_WRITE_BURST
+
+
+def bearer_token(scope) -> Optional[str]:
+    for k, v in scope.get("headers", []):
+        if k == b"authorization":
+            scheme, _, token = v.decode("latin-1").partition(" ")
+            return token.strip() if scheme.lower() == "bearer" and token.strip() else None
+    return None
+
+
+def client_id(scope) -> str:
+    if TRUST_FORWARDED_FOR:
+        for k, v in scope.get("headers", []):
+            if k == b"x-forwarded-for":
+                hops = [h.strip() for h in v.decode("latin-1").split(",") if h.strip()]
+                if hops:
+                    return hops[max(0, len(hops) - FORWARDED_FOR_HOPS)]
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+async def _reject(send, status: int, detail: str, retry_after: float):
+    body = ('{"detail":"%s"}' % detail).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionMiddleware:
+    def __init__(self, app, is_admin: Optional[Callable[[str], bool]] = None,
+                 rate_limiter: Optional[RateLimiter] = None, limiter: Optional[ConcurrencyLimiter] = None):
+        self.app = app
+        self.is_admin = is_admin or (lambda token: False)
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.limiter = limiter or ConcurrencyLimiter()
+        metrics.gauge("admission.in_flight", lambda: self.limiter.in_flight)
+        metrics.gauge("admission.in_flight_public", lambda: self.limiter.in_flight_public)
+        metrics.gauge("admission.tracked_clients", lambda: len(self.rate_limiter))
+        metrics.gauge("admission.limits", lambda: {
+            "max_concurrent": self.limiter.total,
+            "reserved_write_slots": self.limiter.reserved,
+            "read_per_sec": RATE_LIMIT_READ_PER_SEC,
+            "read_burst": RATE_LIMIT_READ_BURST,
+            "comment_per_min": RATE_LIMIT_COMMENT_PER_MIN,
+            "write_per_min": RATE_LIMIT_WRITE_PER_MIN,
+            "comment_burst": RATE_LIMIT_COMMENT_BURST,
+        })
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        route = route_key(scope["path"])
+        method = scope["method"]
+        admin = False
+        if (method, route) in WRITE_ROUTES:
+            token = bearer_token(scope)
+            admin = token is not None and self.is_admin(token)
+        klass = classify(method, route, admin)
+        public = klass is not None
+
+        if public and RATE_LIMIT_ENABLED:
+            name, rate, burst = klass
+            # writes get a bucket per row (each line scored on its own), reads per route
+            bucket = scope["path"] if name == "write" else route
+            allowed, retry_after = self.rate_limiter.check(client_id(scope), bucket, rate, burst)
+            if not allowed:
+                metrics.inc("admission.rate_limited", route=route, kind=name)
+                await _reject(send, 429, "Too many requests", retry_after)
+                return
+
+        if scope["path"] in LONG_POLL_PATHS:
+            metrics.inc("admission.admitted", kind="long_poll")
+            await self.app(scope, receive, send)
+            return
+
+        if not self.limiter.try_acquire(public):
+            metrics.inc("admission.shed", route=route, kind="public" if public else "write")
+            await _reject(send, 503, "Server busy, try again shortly", 1)
+            return
+
+        metrics.inc("admission.admitted", kind="public" if public else "write")
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.limiter.release(public)
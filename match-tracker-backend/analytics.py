@@ -0,0 +1,347 @@
+# analytics.py
+# Column-oriented, in-memory copy of completed matches and lines for coach
+# questions (record vs an opponent, doubles pairings, three-set win rate...).
+#
+# Free-text names and opponents are dictionary-encoded into integer codes,
+# sets are unpacked into a fixed [n, 3, 2] games array, and every query is a
+# vectorized mask + group-by over NumPy arrays instead of a table scan with
+# JSON parsing. The store is built on first use and then refreshed one match
+# at a time as matches complete. Every query is limited to the current
+# request's program.
+import asyncio
+import json
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import func, select
+
+from archive import archives
+from db_setup import database
+from models import matches, players, scores
+from records import normalize_winner
+from tenancy import current_program
+
+MAX_SETS = 3
+_WINNER_CODES = {"team": 1, "opponent": 0}
+
+
+def winner_code(value) -> int:
+    """1 = our team, 0 = opponent, -1 = unknown / unfinished."""
+    return _WINNER_CODES.get(normalize_winner(value), -1)
+
+
+def _completed_queries(matches, scores):
+    """(completed matches, their completed lines) over one set of tables."""
+    done = func.lower(matches.c.status) == "completed"
+    mq = select(matches).where(done)
+    lq = (
+        select(scores, matches.c.date, matches.c.gender, matches.c.opponent)
+        .select_from(scores.join(matches, scores.c.match_id == matches.c.id))
+        .where(done)
+        .where(func.lower(scores.c.status) == "completed")
+    )
+    return mq, lq
+
+
+def season_of(d) -> int:
+    """Academic season, labelled by its spring year (Sep 2025 - May 2026 -> 2026)."""
+    if d is None:
+        return 0
+    return d.year + 1 if d.month >= 8 else d.year
+
+
+def _as_date(value) -> Optional[date]:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str) and value:
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).date()
+        except ValueError:
+            return None
+    return None
+
+
+def _sets_array(raw) -> np.ndarray:
+    out = np.full((MAX_SETS, 2), -1, dtype=np.int8)
+    data = raw
+    if isinstance(data, str):
+        try:
+            data = json.loads(data)
+        except json.JSONDecodeError:
+            data = []
+    if isinstance(data, dict):
+        data = data.get("sets", [])
+    k = 0
+    for item in data or []:
+        if k >= MAX_SETS:
+            break
+        if isinstance(item, dict):
+            t, o = item.get("team", item.get("team_score")), item.get("opp", item.get("opponent_score"))
+        elif isinstance(item, (list, tuple)) and len(item) >= 2:
+            t, o = item[0], item[1]
+        else:
+            continue
+        t, o = int(t or 0), int(o or 0)
+        if t == 0 and o == 0:
+            continue  # unplayed placeholder set
+        out[k] = (t, o)
+        k += 1
+    return out
+
+
+class Dictionary:
+    """String <-> int code, case/whitespace-insensitive, keeps the first spelling seen."""
+
+    def __init__(self):
+        self.codes: Dict[str, int] = {}
+        self.labels: List[str] = []
+
+    @staticmethod
+    def normalize(value) -> str:
+        return " ".join(str(value or "").split()).lower()
+
+    def encode(self, value) -> int:
+        key = self.normalize(value)
+        if not key:
+            return -1
+        code = self.codes.get(key)
+        if code is None:
+            code = self.codes[key] = len(self.labels)
+            self.labels.append(" ".join(str(value).split()))
+        return code
+
+    def lookup(self, value) -> int:
+        return self.codes.get(self.normalize(value), -2)  # -2 never matches anything
+
+    def label(self, code: int) -> Optional[str]:
+        return self.labels[code] if 0 <= code < len(self.labels) else None
+
+
+def _group(keys: np.ndarray, wins: np.ndarray):
+    """Vectorized group-by: unique key rows with win/loss counts."""
+    if len(keys) == 0:
+        return [], np.zeros(0, int), np.zeros(0, int)
+    uniq, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    w = np.bincount(inverse, weights=(wins == 1), minlength=len(uniq)).astype(int)
+    l = np.bincount(inverse, weights=(wins == 0), minlength=len(uniq)).astype(int)
+    return uniq, w, l
+
+
+def _record(w: int, l: int) -> dict:
+    played = w + l
+    return {"wins": int(w), "losses": int(l), "win_pct": round(w / played, 3) if played else None}
+
+
+class AnalyticsStore:
+    LINE_COLUMNS = ("score_id", "match_id", "program", "season", "date", "gender", "opponent", "match_type",
+                    "line_no", "player1", "player2", "player1_id", "player2_id", "n_sets", "winner")
+    MATCH_COLUMNS = ("match_id", "program", "season", "date", "gender", "opponent", "winner")
+
+    def __init__(self):
+        self.names = Dictionary()
+        self.opponents = Dictionary()
+        self.genders = Dictionary()
+        self.programs = Dictionary()
+        self.loaded = False
+        self._lock = asyncio.Lock()
+        self._player_ids: Dict[str, int] = {}
+        self.lines: Dict[str, np.ndarray] = {}
+        self.sets = np.zeros((0, MAX_SETS, 2), dtype=np.int8)
+        self.matches: Dict[str, np.ndarray] = {}
+        self._reset()
+
+    def _reset(self):
+        self.lines = {
+            "score_id": np.zeros(0, np.int64), "match_id": np.zeros(0, np.int64),
+            "program": np.zeros(0, np.int16), "season": np.zeros(0, np.int16), "date": np.zeros(0, "datetime64[D]"),
+            "gender": np.zeros(0, np.int16), "opponent": np.zeros(0, np.int32),
+            "match_type": np.zeros(0, np.int8),  # 0 singles, 1 doubles
+            "line_no": np.zeros(0, np.int16),
+            "player1": np.zeros(0, np.int32), "player2": np.zeros(0, np.int32),
+            "player1_id": np.zeros(0, np.int64), "player2_id": np.zeros(0, np.int64),
+            "n_sets": np.zeros(0, np.int8), "winner": np.zeros(0, np.int8),
+        }
+        self.sets = np.zeros((0, MAX_SETS, 2), dtype=np.int8)
+        self.matches = {
+            "match_id": np.zeros(0, np.int64), "program": np.zeros(0, np.int16),
+            "season": np.zeros(0, np.int16),
+            "date": np.zeros(0, "datetime64[D]"), "gender": np.zeros(0, np.int16),
+            "opponent": np.zeros(0, np.int32), "winner": np.zeros(0, np.int8),
+        }
+
+    # ---------------------------------------------------------- loading
+
+    async def ensure_loaded(self):
+        if self.loaded:
+            return
+        async with self._lock:
+            if not self.loaded:
+                await self._load(None)
+                self.loaded = True
+
+    async def refresh_match(self, match_id: int):
+        """Re-read one match (after it completes or is edited). No-op until first use."""
+        if not self.loaded:
+            return
+        async with self._lock:
+            self._drop(match_id)
+            await self._load(match_id)
+
+    def drop_match(self, match_id: int):
+        if self.loaded:
+            self._drop(match_id)
+
+    async def _load(self, match_id: Optional[int]):
+        prow = await database.fetch_all(select(players.c.id, players.c.program, players.c.name))
+        self._player_ids = {(p["program"], Dictionary.normalize(p["name"])): p["id"] for p in prow}
+
+        if match_id is not None:
+            # a match completing now is always in the hot database
+            mq, lq = _completed_queries(matches, scores)
+            self._append_matches(await database.fetch_all(mq.where(matches.c.id == match_id)))
+            self._append_lines(await database.fetch_all(lq.where(scores.c.match_id == match_id)))
+            return
+        # every season, archived ones included (archive.py)
+        self._append_matches(await archives.fetch_all_seasons(lambda t: _completed_queries(t["matches"], t["scores"])[0]))
+        self._append_lines(await archives.fetch_all_seasons(lambda t: _completed_queries(t["matches"], t["scores"])[1]))
+
+    def _append_matches(self, rows):
+        if not rows:
+            return
+        dates = [_as_date(r["date"]) for r in rows]
+        new = {
+            "match_id": np.array([r["id"] for r in rows], np.int64),
+            "program": np.array([self.programs.encode(r["program"]) for r in rows], np.int16),
+            "season": np.array([season_of(d) for d in dates], np.int16),
+            "date": np.array([d or "NaT" for d in dates], "datetime64[D]"),
+            "gender": np.array([self.genders.encode(r["gender"]) for r in rows], np.int16),
+            "opponent": np.array([self.opponents.encode(r["opponent"]) for r in rows], np.int32),
+            "winner": np.array([winner_code(r["winner"]) for r in rows], np.int8),
+        }
+        for k in self.MATCH_COLUMNS:
+            self.matches[k] = np.concatenate([self.matches[k], new[k]])
+
+    def _append_lines(self, rows):
+        if not rows:
+            return
+        dates = [_as_date(r["date"]) for r in rows]
+        sets = np.stack([_sets_array(r["sets"]) for r in rows])
+        p1 = [r["player1"] for r in rows]
+        p2 = [r["player2"] for r in rows]
+        new = {
+            "score_id": np.array([r["id"] for r in rows], np.int64),
+            "match_id": np.array([r["match_id"] for r in rows], np.int64),
+            "program": np.array([self.programs.encode(r["program"]) for r in rows], np.int16),
+            "season": np.array([season_of(d) for d in dates], np.int16),
+            "date": np.array([d or "NaT" for d in dates], "datetime64[D]"),
+            "gender": np.array([self.genders.encode(r["gender"]) for r in rows], np.int16),
+            "opponent": np.array([self.opponents.encode(r["opponent"]) for r in rows], np.int32),
+            "match_type": np.array([1 if str(r["match_type"] or "").lower() == "doubles" else 0 for r in rows], np.int8),
+            "line_no": np.array([r["line_no"] or 0 for r in rows], np.int16),
+            "player1": np.array([self.names.encode(n) for n in p1], np.int32),
+            "player2": np.array([self.names.encode(n) for n in p2], np.int32),
+            "player1_id": np.array([self._player_id(r["program"], n) for r, n in zip(rows, p1)], np.int64),
+            "player2_id": np.array([self._player_id(r["program"], n) for r, n in zip(rows, p2)], np.int64),
+            "n_sets": (sets[:, :, 0] >= 0).sum(axis=1).astype(np.int8),
+            "winner": np.array([winner_code(r["winner"]) for r in rows], np.int8),
+        }
+        for k in self.LINE_COLUMNS:
+            self.lines[k] = np.concatenate([self.lines[k], new[k]])
+        self.sets = np.concatenate([self.sets, sets])
+
+    def _player_id(self, program, name) -> int:
+        return self._player_ids.get((program, Dictionary.normalize(name)), -1)
+
+    def _drop(self, match_id: int):
+        keep = self.lines["match_id"] != match_id
+        for k in self.LINE_COLUMNS:
+            self.lines[k] = self.lines[k][keep]
+        self.sets = self.sets[keep]
+        keep = self.matches["match_id"] != match_id
+        for k in self.MATCH_COLUMNS:
+            self.matches[k] = self.matches[k][keep]
+
+    # ---------------------------------------------------------- filters
+
+    def _mask(self, cols, gender=None, opponent=None, seasons=None, season=None):
+        mask = cols["program"] == self.programs.lookup(current_program())
+        if season:
+            mask &= cols["season"] == season
+        elif seasons:
+            # "last N seasons" counts back from the program's latest season
+            latest = int(cols["season"][mask].max()) if mask.any() else 0
+            mask &= cols["season"] > latest - seasons
+        if gender:
+            mask &= cols["gender"] == self.genders.lookup(gender)
+        if opponent:
+            mask &= cols["opponent"] == self.opponents.lookup(opponent)
+        return mask
+
+    # ---------------------------------------------------------- queries
+
+    def head_to_head(self, opponent: str, seasons: Optional[int] = None, gender: Optional[str] = None) -> dict:
+        m = self.matches
+        mask = self._mask(m, gender=gender, opponent=opponent, seasons=seasons)
+        by_season, w, l = _group(m["season"][mask].reshape(-1, 1), m["winner"][mask])
+
+        lm = self._mask(self.lines, gender=gender, opponent=opponent, seasons=seasons)
+        line_keys = np.stack([self.lines["match_type"][lm], self.lines["line_no"][lm]], axis=1)
+        by_line, lw, ll = _group(line_keys, self.lines["winner"][lm])
+
+        wins = m["winner"][mask]
+        return {
+            "opponent": self.opponents.label(self.opponents.lookup(opponent)) or opponent,
+            "overall": _record((wins == 1).sum(), (wins == 0).sum()),
+            "by_season": [{"season": int(k[0]), **_record(a, b)} for k, a, b in zip(by_season, w, l)],
+            "by_line": [
+                {"match_type": "doubles" if k[0] else "singles", "line_no": int(k[1]), **_record(a, b)}
+                for k, a, b in zip(by_line, lw, ll)
+            ],
+        }
+
+    def doubles_pairings(self, gender=None, line_no=None, season=None, seasons=None) -> list:
+        c = self.lines
+        mask = self._mask(c, gender=gender, season=season, seasons=seasons) & (c["match_type"] == 1)
+        if line_no:
+            mask &= c["line_no"] == line_no
+        a, b = c["player1"][mask], c["player2"][mask]
+        pairs = np.stack([np.minimum(a, b), np.maximum(a, b)], axis=1)  # order-insensitive pair key
+        uniq, w, l = _group(pairs, c["winner"][mask])
+        out = [
+            {"players": [self.names.label(int(x)) for x in k if x >= 0], **_record(ww, ll)}
+            for k, ww, ll in zip(uniq, w, l)
+        ]
+        return sorted(out, key=lambda r: (-(r["wins"] + r["losses"]), -r["wins"]))
+
+    def three_set_record(self, gender=None, season=None, seasons=None) -> list:
+        c = self.lines
+        mask = (self._mask(c, gender=gender, season=season, seasons=seasons)
+                & (c["match_type"] == 0) & (c["n_sets"] == 3))
+        uniq, w, l = _group(c["player1"][mask].reshape(-1, 1), c["winner"][mask])
+        out = [{"player": self.names.label(int(k[0])), **_record(ww, ll)} for k, ww, ll in zip(uniq, w, l) if k[0] >= 0]
+        return sorted(out, key=lambda r: (-(r["win_pct"] or 0), -r["wins"]))
+
+    def player_record(self, name: str, gender=None, season=None, seasons=None) -> dict:
+        c = self.lines
+        code = self.names.lookup(name)
+        base = self._mask(c, gender=gender, season=season, seasons=seasons)
+        mask = base & ((c["player1"] == code) | (c["player2"] == code))
+        keys = np.stack([c["match_type"][mask], c["season"][mask]], axis=1)
+        uniq, w, l = _group(keys, c["winner"][mask])
+        return {
+            "player": self.names.label(code) or name,
+            "by_season": [
+                {"match_type": "doubles" if k[0] else "singles", "season": int(k[1]), **_record(a, b)}
+                for k, a, b in zip(uniq, w, l)
+            ],
+        }
+
+    def __len__(self):
+        return len(self.lines["score_id"])
+
+
+store = AnalyticsStore()
@@ -0,0 +1,276 @@
+# archive.py
+# Finished seasons live in their own SQLite files, so the hot database only
+# holds the current season (small B-trees, fast backups and checkpoints).
+#
+#   python archive.py rollover               # archive every season before the current one
+#   python archive.py rollover --season 2025 # just one (seasons are labelled by spring year)
+#   python archive.py list
+#
+# rollover copies a season's matches, lines, comments, momentum and snapshots
+# into ARCHIVE_DIR/season_<year>.db and deletes them from the hot database in
+# one transaction, then VACUUMs it. Run it in the off-season with the app
+# stopped (or restart the app afterwards so it picks up the new archive).
+#
+# At runtime the archives are read-only: the queries that span seasons
+# (schedule lists, analytics, search, single archived matches) ATTACH the
+# files they need with mode=ro for the duration of the query and union the
+# rows with the hot database's. SQLite only; on Postgres the command refuses.
+import argparse
+import asyncio
+import glob
+import os
+import re
+import sys
+import weakref
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+from urllib.parse import quote
+
+from sqlalchemy import MetaData, create_engine, func, insert, select
+
+from db_setup import IS_SQLITE, database, get_engine
+from migrations import upgrade
+from models import comments, matches, metadata, momentum, scores
+
+# tables that move with a season; every other table stays in the hot database
+ARCHIVED_TABLES = ("matches", "scores", "comments", "momentum", "momentum_series", "match_snapshots")
+# SQLite attaches at most 10 databases per connection by default
+ATTACH_BATCH = 8
+_FILE = re.compile(r"season_(\d{4})\.db$")
+
+
+def archive_dir() -> str:
+    default = os.path.join(os.path.dirname(os.path.abspath(get_engine().url.database or "matches.db")), "archive")
+    return os.getenv("ARCHIVE_DIR", default)
+
+
+def season_bounds(season: int):
+    """[start, end) of a season; same boundary as analytics.season_of (August)."""
+    return datetime(season - 1, 8, 1), datetime(season, 8, 1)
+
+
+def current_season(now: Optional[datetime] = None) -> int:
+    now = now or datetime.utcnow()
+    return now.year + 1 if now.month >= 8 else now.year
+
+
+_schemas: Dict[str, Dict] = {}
+
+
+def tables(schema: Optional[str] = None) -> Dict:
+    """The archived tables as seen through `ATTACH ... AS schema` (None: the hot database's)."""
+    if schema is None:
+        return {name: metadata.tables[name] for name in ARCHIVED_TABLES}
+    if schema not in _schemas:
+        md = MetaData()
+        _schemas[schema] = {name: metadata.tables[name].to_metadata(md, schema=schema) for name in ARCHIVED_TABLES}
+    return _schemas[schema]
+
+
+class SeasonArchives:
+    def __init__(self):
+        self.files: Dict[int, str] = {}  # season -> path
+        self.match_seasons: Dict[int, int] = {}  # archived match id -> season
+        self.snapshots: Dict[int, str] = {}  # archived match id with a snapshot -> program
+        # one ATTACH set at a time per connection (POST /batch shares one between sub-requests)
+        self._attach_locks: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+    def load(self):
+        """Find the archive files, bring their schema up to date, index their match ids. Sync; startup only."""
+        self.files, self.match_seasons, self.snapshots = {}, {}, {}
+        if not IS_SQLITE:
+            return
+        for path in sorted(glob.glob(os.path.join(archive_dir(), "season_*.db"))):
+            m = _FILE.search(path)
+            if not m:
+                continue
+            season = int(m.group(1))
+            engine = create_engine(f"sqlite:///{path}")
+            try:
+                upgrade(engine, metadata)  # columns added since the file was written
+                with engine.connect() as conn:
+                    for row in conn.execute(select(matches.c.id, matches.c.program)):
+                        self.match_seasons[row.id] = season
+                    snaps = select(matches.c.id, matches.c.program).where(
+                        matches.c.id.in_(select(metadata.tables["match_snapshots"].c.match_id))
+                    )
+                    for row in conn.execute(snaps):
+                        self.snapshots[row.id] = row.program
+            finally:
+                engine.dispose()
+            self.files[season] = path
+        if self.files:
+            print(f"Season archives: {sorted(self.files)} ({len(self.match_seasons)} matches)")
+
+    def season_of_match(self, match_id: int) -> Optional[int]:
+        return self.match_seasons.get(match_id)
+
+    async def fetch_all(self, build: Callable[[Dict], object], seasons: Optional[List[int]] = None) -> list:
+        """Rows of `build(tables)` run against every archived season (or `seasons`)."""
+        seasons = [s for s in (seasons or sorted(self.files)) if s in self.files]
+        rows = []
+        for i in range(0, len(seasons), ATTACH_BATCH):
+            batch = seasons[i:i + ATTACH_BATCH]
+            async with database.connection() as conn, self._attach_lock(conn):
+                for season in batch:
+                    await conn.execute(f"ATTACH DATABASE '{self._uri(season)}' AS season_{season}")
+                try:
+                    for season in batch:
+                        rows.extend(await database.fetch_all(build(tables(f"season_{season}"))))
+                finally:
+                    for season in batch:
+                        await conn.execute(f"DETACH DATABASE season_{season}")
+        return rows
+
+    def _attach_lock(self, conn) -> asyncio.Lock:
+        lock = self._attach_locks.get(conn)
+        if lock is None:
+            lock = self._attach_locks[conn] = asyncio.Lock()
+        return lock
+
+    async def fetch_all_seasons(self, build: Callable[[Dict], object]) -> list:
+        """Rows of `build(tables)` from the hot database and then every archive."""
+        rows = list(await database.fetch_all(build(tables())))
+        if self.files:
+            rows.extend(await self.fetch_all(build))
+        return rows
+
+    async def fetch_one(self, season: int, build: Callable[[Dict], object]):
+        rows = await self.fetch_all(build, [season])
+        return rows[0] if rows else None
+
+    def _uri(self, season: int) -> str:
+        # read-only: nothing the app runs can write to an archive
+        return "file:" + quote(os.path.abspath(self.files[season])).replace("'", "''") + "?mode=ro"
+
+
+archives = SeasonArchives()
+
+
+# ----- rollover (CLI) -----
+
+def _held_back(conn, match_filter) -> set:
+    """Matches of the season that own a table's highest id.
+
+    SQLite hands out max(id) + 1, so moving the newest row of a table would
+    let a new row reuse an archived id. Those matches stay in the hot database
+    until newer rows exist; a later rollover moves them.
+    """
+    owners = [
+        select(matches.c.id).order_by(matches.c.id.desc()).limit(1),
+        select(scores.c.match_id).order_by(scores.c.id.desc()).limit(1),
+        select(scores.c.match_id).select_from(comments.join(scores, comments.c.score_id == scores.c.id))
+        .order_by(comments.c.id.desc()).limit(1),
+        select(scores.c.match_id).select_from(momentum.join(scores, momentum.c.score_id == scores.c.id))
+        .order_by(momentum.c.id.desc()).limit(1),
+    ]
+    season_ids = {r[0] for r in conn.execute(select(matches.c.id).where(*match_filter))}
+    return {conn.execute(q).scalar() for q in owners} & season_ids
+
+
+def roll_over(season: int, dry_run: bool = False) -> dict:
+    engine = get_engine()
+    start, end = season_bounds(season)
+    in_season = [matches.c.date >= start, matches.c.date < end]
+    path = os.path.join(archive_dir(), f"season_{season}.db")
+    with engine.connect() as conn:
+        live = conn.execute(
+            select(func.count()).select_from(matches).where(*in_season, func.lower(matches.c.status) == "live")
+        ).scalar()
+        if live:
+            raise SystemExit(f"Season {season} still has {live} live match(es); complete them first")
+        held = _held_back(conn, in_season)
+        moving = select(matches.c.id).where(*in_season, matches.c.id.notin_(held))
+        count = conn.execute(select(func.count()).select_from(moving.subquery())).scalar()
+        summary = {"season": season, "file": path, "matches": count, "held_back": sorted(held)}
+        if dry_run or not count:
+            return summary
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        arc_engine = create_engine(f"sqlite:///{path}")
+        metadata.create_all(arc_engine, tables=[metadata.tables[n] for n in ARCHIVED_TABLES])
+        upgrade(arc_engine, metadata)
+        arc_engine.dispose()
+
+        arc = tables("arc")
+        lines = select(scores.c.id).where(scores.c.match_id.in_(moving))
+        # table -> rows of the season in the hot database
+        where = {
+            "matches": matches.c.id.in_(moving),
+            "scores": scores.c.match_id.in_(moving),
+            "comments": comments.c.score_id.in_(lines),
+            "momentum": momentum.c.score_id.in_(lines),
+            "momentum_series": metadata.tables["momentum_series"].c.score_id.in_(lines),
+            "match_snapshots": metadata.tables["match_snapshots"].c.match_id.in_(moving),
+        }
+        conn.exec_driver_sql(f"ATTACH DATABASE '{path.replace(chr(39), chr(39) * 2)}' AS arc")
+        try:
+            before = conn.exec_driver_sql("SELECT coalesce(max(seq), 0) FROM change_log").scalar()
+            for name in ARCHIVED_TABLES:
+                table = metadata.tables[name]
+                cols = [c.name for c in table.columns]
+                conn.execute(insert(arc[name]).from_select(cols, select(*table.columns).where(where[name])))
+            # children before parents; lines are read through `moving`, so they go last but one
+            for name in ("comments", "momentum", "momentum_series", "match_snapshots", "scores", "matches"):
+                conn.execute(metadata.tables[name].delete().where(where[name]))
+            # archived, not deleted: keep the moves out of the change feed
+            conn.exec_driver_sql(f"DELETE FROM change_log WHERE seq > {int(before)}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.exec_driver_sql("DETACH DATABASE arc")
+    return summary
+
+
+def compact():
+    """Give the freed pages back to the filesystem and empty the WAL."""
+    with get_engine().connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql("VACUUM")
+        conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def _main(argv=None):
+    parser = argparse.ArgumentParser(description="Move finished seasons into per-season archive databases.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    roll = sub.add_parser("rollover", help="archive finished seasons")
+    roll.add_argument("--season", type=int, help="only this season (spring year, e.g. 2025)")
+    roll.add_argument("--dry-run", action="store_true", help="report what would move")
+    roll.add_argument("--no-vacuum", action="store_true", help="skip VACUUM afterwards")
+    sub.add_parser("list", help="show archive files")
+    args = parser.parse_args(argv)
+
+    if not IS_SQLITE:
+        raise SystemExit("Season archives are SQLite files; this database is not SQLite")
+    from db_setup import init_schema
+    init_schema()
+
+    if args.command == "list":
+        archives.load()
+        for season, path in sorted(archives.files.items()):
+            n = sum(1 for s in archives.match_seasons.values() if s == season)
+            print(f"{season}: {path} ({n} matches)")
+        return
+
+    current = current_season()
+    if args.season is not None:
+        if args.season >= current:
+            raise SystemExit(f"Season {args.season} isn't over (current season is {current})")
+        seasons = [args.season]
+    else:
+        with get_engine().connect() as conn:
+            first = conn.execute(select(func.min(matches.c.date))).scalar()
+        seasons = list(range(current_season(first), current)) if first else []
+    moved = 0
+    for season in seasons:
+        summary = roll_over(season, dry_run=args.dry_run)
+        moved += summary["matches"]
+        held = f", held back {summary['held_back']}" if summary["held_back"] else ""
+        print(f"Season {season}: {summary['matches']} match(es) -> {summary['file']}{held}")
+    if moved and not args.dry_run and not args.no_vacuum:
+        compact()
+
+
+if __name__ == "__main__":
+    sys.exit(_main())
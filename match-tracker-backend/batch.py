@@ -0,0 +1,165 @@
+# batch.py
+# POST /batch: several reads in one round trip.
+#
+# BoxScorePage.js and LineScorePage.js each open with 3-10 GETs (the match,
+# its lines, events, every line's comments, momentum). Over a phone
+# connection the round trips cost more than the reads. A batch is
+#
+#   {"requests": [{"id": "match", "path": "/schedule/12"},
+#                 {"id": "lines", "path": "/scores/match/12", "fields": ["id", "line_no", "sets", "status"]},
+#                 {"path": "/scores/40/comments?x=1"}]}
+#
+# and the answer is {"responses": [{"id", "status", "body"}, ...]} in the same
+# order. Each sub-request goes through the normal route (same response cache,
+# projection, tenancy and query stats as the plain GET); they run
+# concurrently, sharing one database connection. Only the read routes in
+# BATCH_ROUTES are allowed, anything else comes back as a 404 entry.
+#
+# `fields` is a sparse fieldset: keys to keep, dotted for nested objects
+# ("scores.sets"); applied to every element of a list. Error bodies are
+# returned whole.
+import json
+import os
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+from fastapi import Request
+from starlette.routing import Match
+
+from db_setup import gather_on_connection
+from metrics import metrics
+
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "20"))
+
+# route templates a batch may call: GETs with no side effects. /changes is a
+# long-poll and stays out.
+BATCH_ROUTES = {
+    "/schedule",
+    "/schedule/upcoming",
+    "/schedule/{id}",
+    "/records",
+    "/players",
+    "/scores/{scores_id}",
+    "/scores/{score_id}/comments",
+    "/scores/{score_id}/momentum",
+    "/scores/match/{match_id}",
+    "/scores/match/{match_id}/all",
+    "/scores/match/{match_id}/momentum",
+    "/matches/{match_id}",
+    "/matches/{match_id}/scores",
+    "/matches/{match_id}/win-probability",
+    "/matches/{match_id}/snapshot",
+    "/events/match/{match_id}",
+    "/search",
+    "/analytics/head-to-head",
+    "/analytics/doubles-pairings",
+    "/analytics/three-set",
+    "/analytics/players/{name}",
+}
+
+# request headers a sub-request must not inherit from the POST
+_DROP_HEADERS = {b"content-type", b"content-length", b"accept-encoding", b"if-none-match", b"if-match"}
+
+
+def _field_tree(fields: List[str]) -> Dict[str, Optional[dict]]:
+    """["id", "scores.sets", "scores.id"] -> {"id": None, "scores": {"sets": None, "id": None}}"""
+    tree: Dict[str, Optional[dict]] = {}
+    for name in fields:
+        node = tree
+        parts = [p for p in name.split(".") if p]
+        for i, part in enumerate(parts):
+            last = i == len(parts) - 1
+            if last:
+                node[part] = None  # whole value; wins over any narrower selection
+            elif node.get(part, {}) is None:
+                break
+            else:
+                node = node.setdefault(part, {})
+    return tree
+
+
+def select_fields(data, tree: Optional[dict]):
+    if tree is None:
+        return data
+    if isinstance(data, list):
+        return [select_fields(item, tree) for item in data]
+    if isinstance(data, dict):
+        return {k: select_fields(data[k], sub) for k, sub in tree.items() if k in data}
+    return data
+
+
+def _match_route(routes, scope) -> Optional[tuple]:
+    for route in routes:
+        match, child = route.matches(scope)
+        if match == Match.FULL:
+            return route, child
+    return None
+
+
+async def _dispatch(request: Request, routes, item) -> dict:
+    out = {"id": item.id, "status": 404, "body": {"detail": "Not Found"}}
+    url = urlsplit(item.path)
+    if not url.path.startswith("/") or url.scheme or url.netloc:
+        out.update(status=400, body={"detail": "path must be a path on this API, e.g. /schedule/12"})
+        return out
+
+    parent = request.scope
+    scope = {
+        **parent,
+        "method": "GET",
+        "path": url.path,
+        "raw_path": url.path.encode("utf-8"),
+        "query_string": url.query.encode("latin-1"),
+        # cached_json would otherwise pick a compressed copy for a body we decode
+        "headers": [(k, v) for k, v in parent["headers"] if k not in _DROP_HEADERS]
+        + [(b"accept-encoding", b"identity")],
+    }
+    scope.pop("route", None)
+    scope.pop("endpoint", None)
+    scope.pop("path_params", None)
+
+    found = _match_route(routes, scope)
+    if found is None or found[0].path not in BATCH_ROUTES:
+        metrics.inc("batch.rejected")
+        return out
+    route, child = found
+    scope.update(child)
+
+    status = 500
+    chunks = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    try:
+        await route.handle(scope, receive, send)
+    except Exception as e:
+        # the app's own exception handlers already turned HTTPExceptions into
+        # responses; this is a genuine 500, reported in place
+        metrics.inc("batch.errors", route=route.path)
+        print(f"Batch sub-request {item.path} failed: {e!r}")
+        out.update(status=500, body={"detail": "Internal Server Error"})
+        return out
+
+    raw = b"".join(chunks)
+    try:
+        body = json.loads(raw) if raw else None
+    except ValueError:
+        body = raw.decode("utf-8", "replace")
+    if 200 <= status < 300 and item.fields:
+        body = select_fields(body, _field_tree(item.fields))
+    out.update(status=status, body=body)
+    metrics.inc("batch.subrequests", route=route.path)
+    return out
+
+
+async def run_batch(request: Request, routes, items) -> List[dict]:
+    """`routes`: the API router's routes (main.router.routes)."""
+    return list(await gather_on_connection(*(_dispatch(request, routes, item) for item in items)))
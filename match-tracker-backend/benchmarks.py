@@ -0,0 +1,123 @@
+# benchmarks.py
+# Small, dependency-free benchmarks for the backend.
+#
+#   python benchmarks.py                 # run everything
+#   python benchmarks.py cold_start      # run one benchmark
+#
+# Each benchmark runs against a throwaway SQLite file so it never touches
+# matches.db.
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _run_python(code: str, env: dict) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], cwd=HERE, env=env, check=True)
+    return (time.perf_counter() - start) * 1000
+
+
+def _temp_env(tmpdir: str) -> dict:
+    env = dict(os.environ)
+    env["DATABASE_URL"] = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    return env
+
+
+def bench_cold_start(runs: int = 7):
+    """Fresh interpreter: time to `import main`, and time until /readyz passes."""
+    import_code = "import main"
+    ready_code = (
+        "import asyncio, main\n"
+        "async def go():\n"
+        "    async with main.app.router.lifespan_context(main.app):\n"
+        "        assert main.app.state.ready\n"
+        "asyncio.run(go())\n"
+    )
+    baseline_code = "pass"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = _temp_env(tmp)
+        _run_python(ready_code, env)  # create schema / warm the OS file cache once
+        baseline = [_run_python(baseline_code, env) for _ in range(runs)]
+        imports = [_run_python(import_code, env) for _ in range(runs)]
+        ready = [_run_python(ready_code, env) for _ in range(runs)]
+
+    base = statistics.median(baseline)
+    print("cold_start")
+    print(f"  interpreter only     : {base:8.1f} ms (median of {runs})")
+    print(f"  import main          : {statistics.median(imports) - base:8.1f} ms")
+    print(f"  import + lifespan    : {statistics.median(ready) - base:8.1f} ms")
+
+
+def bench_compression(rounds: int = 200):
+    """Per-request compression vs. serving precompressed bytes from the response cache."""
+    from compression import compress, supported_encodings
+    from response_cache import CachedBody, dump_json
+
+    rows = [
+        {
+            "id": i, "gender": "men", "date": "2026-03-01T18:00:00Z",
+            "opponent": "Rollins College", "location": "Saint Leo, FL",
+            "status": "completed", "team_score": {"team": 4, "opponent": 3},
+            "box_score": None, "match_number": i, "winner": "team",
+        }
+        for i in range(60)
+    ]
+    body = dump_json(rows)
+    print("compression")
+    for enc in supported_encodings():
+        start = time.perf_counter()
+        for _ in range(rounds):
+            out = compress(body, enc)
+        per_request = (time.perf_counter() - start) * 1000 / rounds
+
+        entry = CachedBody(body)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            entry.body_for(enc)
+        cached = (time.perf_counter() - start) * 1000 / rounds
+        print(f"  {enc:5s} {len(body)} -> {len(out)} bytes | per request {per_request:.3f} ms | cached {cached:.4f} ms")
+
+
+def bench_winprob(lines: int = 900, rounds: int = 50):
+    """Batch win-probability evaluation for many live lines (tables prebuilt)."""
+    import random
+    import winprob
+
+    start = time.perf_counter()
+    winprob.tables(winprob.SINGLES)
+    winprob.tables(winprob.DOUBLES)
+    build = (time.perf_counter() - start) * 1000
+
+    rnd = random.Random(7)
+    states = [
+        winprob.line_state(winprob.SINGLES, [[rnd.randint(0, 6), rnd.randint(0, 5)]], rnd.random() < 0.5,
+                           (rnd.randint(0, 3), rnd.randint(0, 3)))
+        for _ in range(lines)
+    ]
+    states = [s for s in states if isinstance(s, winprob.LineState)]
+    start = time.perf_counter()
+    for _ in range(rounds):
+        winprob.batch_line_probs(winprob.SINGLES, states)
+    per_batch = (time.perf_counter() - start) * 1000 / rounds
+    print("winprob")
+    print(f"  table build          : {build:8.2f} ms (once per process)")
+    print(f"  batch of {len(states):4d} lines   : {per_batch:8.3f} ms")
+
+
+BENCHMARKS = {
+    "winprob": bench_winprob,
+    "cold_start": bench_cold_start,
+    "compression": bench_compression,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
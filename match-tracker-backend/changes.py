@@ -0,0 +1,178 @@
+# changes.py
+# "What changed since I last looked?" for clients and downstream consumers.
+#
+# Every write to matches, scores, players, comments and momentum_series
+# appends a change_log row (entity, id, op, match, version) from a database
+# trigger, under one global monotonic `seq` (migrations.ensure_change_log_triggers).
+# GET /changes?since=<seq> returns the program's changes after that cursor
+# and the cursor to send next time; clients then refetch only what changed.
+#
+#   * on Postgres writers don't queue for the log, so seqs commit out of
+#     order: a transaction can take 11 and commit after another's 12. A read
+#     notes max(seq) together with the transactions in flight at that moment
+#     and waits for those to finish (usually milliseconds) before returning
+#     anything up to it; every seq at or below it is then final, and the next
+#     cursor can't skip one. SQLite has one writer, so seq order is commit order.
+#   * wait=N long-polls: with nothing new the request parks for up to N
+#     seconds. One poller per process watches max(seq) while anyone waits,
+#     and change notifications (notify.py) wake the waiters straight away.
+#   * rows older than CHANGES_RETENTION_HOURS are purged by the scheduler; a
+#     cursor from before the oldest kept row gets {"resync": true} plus a
+#     fresh cursor, and the client refetches everything once.
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import Text, cast, func, select, text
+
+from db_setup import IS_POSTGRES, database
+from metrics import metrics
+from models import change_log
+from notify import change_feed
+
+CHANGES_RETENTION_HOURS = int(os.getenv("CHANGES_RETENTION_HOURS", "72"))
+CHANGES_PAGE_SIZE = int(os.getenv("CHANGES_PAGE_SIZE", "500"))
+CHANGES_MAX_WAIT = float(os.getenv("CHANGES_MAX_WAIT", "30"))
+CHANGES_POLL_SECONDS = float(os.getenv("CHANGES_POLL_SECONDS", "1"))
+# parked long-polls per process; past this, requests answer immediately
+CHANGES_MAX_WAITERS = int(os.getenv("CHANGES_MAX_WAITERS", "1000"))
+# Postgres: how long a read waits for in-flight writers before answering
+# "nothing yet" (same cursor back)
+CHANGES_SETTLE_SECONDS = float(os.getenv("CHANGES_SETTLE_SECONDS", "5"))
+_SETTLE_POLL_SECONDS = 0.01
+
+# of the given transaction ids, the ones still running
+_IN_PROGRESS = text(
+    "SELECT x FROM unnest(CAST(:xids AS text[])) AS x WHERE pg_xact_status(CAST(x AS xid8)) = 'in progress'"
+)
+
+
+class ChangeStream:
+    def __init__(self):
+        self._changed = asyncio.Event()
+        self._seen = 0  # highest seq any reader or the poller has seen
+        self._waiters = 0
+        self._poller = None
+
+    def wake(self):
+        """Let every parked request re-read; later waiters get a fresh event."""
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _settled_bounds(self):
+        """(oldest, latest) seq with every seq <= latest final; None if writers didn't finish in time."""
+        bounds = select(func.min(change_log.c.seq), func.max(change_log.c.seq))
+        if not IS_POSTGRES:
+            row = await database.fetch_one(bounds)
+            return row[0], row[1] or 0
+        # same statement, same snapshot: a seq <= max that isn't visible yet
+        # belongs to one of the snapshot's in-progress transactions ("xmin:xmax:xip,...")
+        row = await database.fetch_one(bounds.add_columns(cast(func.pg_current_snapshot(), Text)))
+        xids = [x for x in row[2].split(":")[2].split(",") if x]
+        deadline = asyncio.get_running_loop().time() + CHANGES_SETTLE_SECONDS
+        while xids:
+            xids = [r[0] for r in await database.fetch_all(_IN_PROGRESS.bindparams(xids=xids))]
+            if not xids:
+                break
+            if asyncio.get_running_loop().time() >= deadline:
+                return None
+            await asyncio.sleep(_SETTLE_POLL_SECONDS)
+        return row[0], row[1] or 0
+
+    async def read(self, program: str, since: int, limit: int = CHANGES_PAGE_SIZE) -> dict:
+        bounds = await self._settled_bounds()
+        if bounds is None:
+            # a long transaction is still open; ask again with the same cursor
+            metrics.inc("changes.unsettled")
+            return {"changes": [], "next": since, "more": False, "resync": False}
+        oldest, latest = bounds
+        self._seen = max(self._seen, latest)
+        if since > latest or (oldest is not None and since < oldest - 1):
+            # purged past the cursor (or a cursor from another database)
+            metrics.inc("changes.resync")
+            return {"changes": [], "next": latest, "more": False, "resync": True}
+        # everything up to `latest` is final (see _settled_bounds)
+        rows = await database.fetch_all(
+            select(change_log)
+            .where(change_log.c.program == program, change_log.c.seq > since, change_log.c.seq <= latest)
+            .order_by(change_log.c.seq)
+            .limit(limit)
+        )
+        more = len(rows) == limit
+        return {
+            "changes": [
+                {
+                    "seq": r["seq"],
+                    "entity": r["entity"],
+                    "id": r["entity_id"],
+                    "op": r["op"],
+                    "match_id": r["match_id"],
+                    "version": r["version"],
+                    "at": r["created_at"],
+                }
+                for r in rows
+            ],
+            # other programs' changes are skipped over, so idle cursors keep up
+            "next": rows[-1]["seq"] if more else latest,
+            "more": more,
+            "resync": False,
+        }
+
+    async def wait(self, program: str, since: int, limit: int = CHANGES_PAGE_SIZE, timeout: float = 0) -> dict:
+        """read(), but with nothing new, block up to `timeout` seconds for a change."""
+        changed = self._changed  # taken before reading, so a wake in between isn't lost
+        result = await self.read(program, since, limit)
+        if result["changes"] or result["resync"] or timeout <= 0 or self._waiters >= CHANGES_MAX_WAITERS:
+            return result
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        self._waiters += 1
+        if self._poller is None:
+            self._poller = loop.create_task(self._poll(), name="changes:poll")
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(changed.wait(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    return result
+                changed = self._changed
+                result = await self.read(program, result["next"], limit)
+                if result["changes"] or result["resync"] or loop.time() >= deadline:
+                    return result
+        finally:
+            self._waiters -= 1
+
+    async def _poll(self):
+        # catches writes the notification feed doesn't carry (SQLite, players, comments)
+        try:
+            while self._waiters:
+                await asyncio.sleep(CHANGES_POLL_SECONDS)
+                try:
+                    latest = await database.fetch_val(select(func.max(change_log.c.seq))) or 0
+                except Exception as e:
+                    metrics.inc("changes.errors")
+                    print(f"Change log poll failed: {e!r}")
+                    continue
+                if latest > self._seen:
+                    self._seen = latest
+                    self.wake()
+        finally:
+            self._poller = None
+
+    async def purge(self):
+        """Drop rows past retention; the newest row always stays so seq keeps its floor."""
+        cutoff = datetime.utcnow() - timedelta(hours=CHANGES_RETENTION_HOURS)
+        newest = select(func.max(change_log.c.seq)).scalar_subquery()
+        await database.execute(change_log.delete().where(change_log.c.created_at < cutoff, change_log.c.seq < newest))
+
+    def status(self) -> dict:
+        return {"waiters": self._waiters, "seen": self._seen}
+
+
+change_stream = ChangeStream()
+metrics.gauge("changes.stream", change_stream.status)
+
+
+@change_feed.subscribe
+async def wake_on_change(message: dict, remote: bool):
+    change_stream.wake()
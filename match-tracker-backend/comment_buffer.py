@@ -0,0 +1,248 @@
+# comment_buffer.py
+# Write-behind ingestion for fan comments.
+#
+# A burst of comments during a close set used to be a burst of single-row
+# INSERTs, each taking SQLite's write lock ahead of the scorer's taps. Now
+# POST /scores/{id}/comments only appends to a bounded in-memory buffer and
+# answers straight away with a provisional id (a negative integer, unique on
+# the instance that took it, plus "pending": true). A flusher task wakes on
+# the first buffered comment, waits COMMENT_FLUSH_MS for the rest of the
+# burst, and writes up to COMMENT_FLUSH_BATCH of them in one multi-row
+# INSERT (one transaction, one lock acquisition).
+#
+#   * until flushed, buffered comments are merged into GET /scores/{id}/comments
+#     on the instance that took them; afterwards they come back with their
+#     real id from the live projection / the database like any other
+#   * when COMMENT_BUFFER_MAX comments are waiting, posts wait up to
+#     COMMENT_BUFFER_WAIT seconds for a flush and then get 503 + Retry-After
+#   * a batch that fails is retried row by row; a row that still fails on an
+#     integrity error (line deleted meanwhile) is logged and dropped, one that
+#     fails on anything else (database unreachable) goes back to the front of
+#     the queue for the next flush, COMMENT_RETRY_S later
+#   * the lifespan flushes whatever is left on shutdown, giving up (and
+#     logging what is lost) after COMMENT_STOP_ATTEMPTS failed flushes
+#
+# COMMENT_BUFFER_ENABLED=0 writes every comment inline, as before.
+import asyncio
+import itertools
+import logging
+import os
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from db_setup import INTEGRITY_ERRORS, database, supports_returning
+from metrics import metrics
+from models import comments
+from projection import projection
+from search import search_index
+
+COMMENT_BUFFER_ENABLED = os.getenv("COMMENT_BUFFER_ENABLED", "1").strip().lower() not in ("0", "false", "no", "off")
+COMMENT_FLUSH_MS = float(os.getenv("COMMENT_FLUSH_MS", "250"))
+COMMENT_FLUSH_BATCH = int(os.getenv("COMMENT_FLUSH_BATCH", "500"))
+COMMENT_BUFFER_MAX = int(os.getenv("COMMENT_BUFFER_MAX", "5000"))
+COMMENT_BUFFER_WAIT = float(os.getenv("COMMENT_BUFFER_WAIT", "2"))
+COMMENT_RETRY_S = float(os.getenv("COMMENT_RETRY_S", "1"))
+COMMENT_STOP_ATTEMPTS = int(os.getenv("COMMENT_STOP_ATTEMPTS", "3"))
+
+logger = logging.getLogger("match_tracker.comments")
+
+
+# the inserted values that tell a batch's rows apart
+_MATCH_BACK = (comments.c.score_id, comments.c.user_id, comments.c.timestamp, comments.c.text)
+
+
+def _row_key(row) -> tuple:
+    return tuple(row[c.name] for c in _MATCH_BACK)
+
+
+class BufferFull(Exception):
+    pass
+
+
+class CommentBuffer:
+    def __init__(self):
+        self._queue: List[dict] = []
+        self._by_line: Dict[int, List[dict]] = defaultdict(list)  # score_id -> pending, oldest first
+        self._ids = itertools.count(1)
+        self._wake = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+        self._task: Optional[asyncio.Task] = None
+        self._flushing = 0
+        self.flushed = 0
+        self.batches = 0
+
+    def start(self):
+        if COMMENT_BUFFER_ENABLED and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run(), name="comments:flush")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        failures = 0
+        while self._queue and failures < COMMENT_STOP_ATTEMPTS:
+            try:
+                await self.flush()
+            except Exception as e:
+                failures += 1
+                logger.warning("Comment flush on shutdown failed (%d/%d): %r", failures, COMMENT_STOP_ATTEMPTS, e)
+        for entry in self._queue:
+            self._lost(entry, "shutting down")
+        self._queue = []
+        self._by_line.clear()
+
+    @property
+    def enabled(self) -> bool:
+        return COMMENT_BUFFER_ENABLED and self._task is not None
+
+    async def add(self, program: str, score_id: int, match_id: int, user: dict, text: str, ts) -> dict:
+        """Queue one comment; returns it as readers will see it until it's flushed."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + COMMENT_BUFFER_WAIT
+        while len(self._queue) + self._flushing >= COMMENT_BUFFER_MAX:
+            self._space.clear()
+            self._wake.set()
+            try:
+                await asyncio.wait_for(self._space.wait(), max(0.0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                metrics.inc("comments.rejected")
+                raise BufferFull()
+        entry = {
+            "row": dict(program=program, user_id=user["id"], score_id=score_id, text=text, timestamp=ts),
+            "match_id": match_id,
+            "view": {
+                "id": -next(self._ids),  # real ids are positive
+                "user_id": user["id"],
+                "user_first_name": user.get("first_name"),
+                "user_role": user.get("role"),
+                "text": text,
+                "timestamp": ts,
+                "pending": True,
+            },
+        }
+        self._queue.append(entry)
+        self._by_line[score_id].append(entry)
+        self._wake.set()
+        return entry["view"]
+
+    def pending(self, program: str, score_id: int) -> List[dict]:
+        return [e["view"] for e in self._by_line.get(score_id, ()) if e["row"]["program"] == program]
+
+    def drop(self, score_id: Optional[int] = None, match_id: Optional[int] = None):
+        """The line (or the whole match) was deleted: its buffered comments have nowhere to go."""
+        def gone(e):
+            return e["row"]["score_id"] == score_id or e["match_id"] == match_id
+        self._queue = [e for e in self._queue if not gone(e)]
+        for line_id in list(self._by_line):
+            self._by_line[line_id] = [e for e in self._by_line[line_id] if not gone(e)]
+            if not self._by_line[line_id]:
+                del self._by_line[line_id]
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            await asyncio.sleep(COMMENT_FLUSH_MS / 1000)  # let the rest of the burst arrive
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                metrics.inc("comments.errors")
+                logger.warning("Comment flush failed, %d waiting: %r", len(self._queue), e)
+                await asyncio.sleep(COMMENT_RETRY_S)
+            if self._queue:
+                self._wake.set()
+
+    async def flush(self):
+        """Write one batch. Raises, after re-queueing them, if some rows could not be written for now."""
+        batch, self._queue = self._queue[:COMMENT_FLUSH_BATCH], self._queue[COMMENT_FLUSH_BATCH:]
+        if not batch:
+            return
+        self._flushing += len(batch)
+        retry, error = [], None
+        try:
+            try:
+                saved = await self._insert(batch)
+            except Exception as e:
+                metrics.inc("comments.batch_failures")
+                logger.warning("Comment batch of %d failed, retrying one by one: %r", len(batch), e)
+                saved = []
+                for entry in batch:
+                    try:
+                        saved.extend(await self._insert([entry]))
+                    except INTEGRITY_ERRORS as e:
+                        self._lost(entry, repr(e))
+                    except Exception as e:
+                        retry.append(entry)
+                        error = e
+            self.batches += 1
+            self.flushed += len(saved)
+            for entry, comment_id in saved:
+                self._publish(entry, comment_id)
+        finally:
+            self._flushing -= len(batch)
+            if retry:
+                # still acknowledged and still shown as pending; oldest first again
+                self._queue[:0] = retry
+                metrics.inc("comments.requeued", len(retry))
+            done = {id(e) for e in batch} - {id(e) for e in retry}
+            for line_id in {e["row"]["score_id"] for e in batch}:
+                thread = [e for e in self._by_line.get(line_id, ()) if id(e) not in done]
+                if thread:
+                    self._by_line[line_id] = thread
+                else:
+                    self._by_line.pop(line_id, None)
+            self._space.set()
+        if error is not None:
+            raise error
+
+    def _lost(self, entry: dict, why: str):
+        row = entry["row"]
+        metrics.inc("comments.dropped")
+        logger.error(
+            "Dropped comment for line %s by user %s at %s (%s): %r",
+            row["score_id"], row["user_id"], row["timestamp"], why, row["text"],
+        )
+
+    async def _insert(self, batch: List[dict]) -> list:
+        """One transaction; returns [(entry, new id)]."""
+        async with database.transaction():
+            if supports_returning():
+                rows = await database.fetch_all(
+                    comments.insert().values([e["row"] for e in batch]).returning(comments.c.id, *_MATCH_BACK)
+                )
+                # RETURNING order is unspecified (SQLite says so): pair each row
+                # with an entry holding the same values. Entries that are equal
+                # in all of them are interchangeable.
+                waiting = defaultdict(list)
+                for e in batch:
+                    waiting[_row_key(e["row"])].append(e)
+                return [(waiting[_row_key(r)].pop(), r["id"]) for r in rows]
+            return [(e, await database.execute(comments.insert().values(**e["row"]))) for e in batch]
+
+    def _publish(self, entry: dict, comment_id: int):
+        row, view = entry["row"], entry["view"]
+        search_index.add_comment(
+            {"id": comment_id, "score_id": row["score_id"], "text": row["text"]}, entry["match_id"], row["program"],
+        )
+        projection.add_comment(row["score_id"], {
+            "id": comment_id,
+            "text": row["text"],
+            "timestamp": row["timestamp"],
+            "user_first_name": view["user_first_name"],
+            "user_role": view["user_role"],
+        })
+
+    def status(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "buffered": len(self._queue),
+            "flushing": self._flushing,
+            "flushed": self.flushed,
+            "batches": self.batches,
+        }
+
+
+comment_buffer = CommentBuffer()
+metrics.gauge("comments.buffer", comment_buffer.status)
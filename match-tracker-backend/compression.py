@@ -0,0 +1,129 @@
+# compression.py
+# gzip / brotli negotiation for JSON responses.
+#
+# Cached responses (see response_cache.py) keep their compressed bytes, so
+# they only get compressed once per cache entry. Everything else that goes
+# out of a GET (or a POST /batch, which is a bundle of GETs) is compressed on
+# the fly by CompressionMiddleware.
+import gzip
+import os
+from typing import Optional
+
+try:  # brotli is optional; without it we only speak gzip
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+# bodies smaller than this are not worth compressing
+MIN_COMPRESS_BYTES = int(os.getenv("MIN_COMPRESS_BYTES", "512"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+
+
+def supported_encodings():
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def pick_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Choose the best encoding the client accepts (br > gzip), honouring q=0."""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        token, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if token:
+            accepted[token] = q
+    for enc in supported_encodings():
+        q = accepted.get(enc, accepted.get("*", 0.0))
+        if q > 0:
+            return enc
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=GZIP_LEVEL)
+    raise ValueError(f"unsupported encoding {encoding!r}")
+
+
+def _header(headers, name: bytes) -> Optional[bytes]:
+    for k, v in headers:
+        if k.lower() == name:
+            return v
+    return None
+
+
+def add_vary(headers):
+    vary = _header(headers, b"vary")
+    if vary is None:
+        return headers + [(b"vary", b"Accept-Encoding")]
+    if b"accept-encoding" in vary.lower():
+        return headers
+    others = [(k, v) for k, v in headers if k.lower() != b"vary"]
+    return others + [(b"vary", vary + b", Accept-Encoding")]
+
+
+class CompressionMiddleware:
+    """Compress GET/HEAD (and POST /batch) JSON responses the endpoint didn't already encode."""
+
+    def __init__(self, app, minimum_size: int = MIN_COMPRESS_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not (
+            scope["method"] in ("GET", "HEAD") or (scope["method"] == "POST" and scope["path"] == "/batch")
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        accept = _header(scope.get("headers", []), b"accept-encoding")
+        encoding = pick_encoding(accept.decode("latin-1") if accept else None)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+
+        async def send_wrapper(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                # hold the start message until we've seen the body
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            held, start_message = start_message, None
+            headers = list(held.get("headers", []))
+            body = message.get("body", b"")
+            content_type = _header(headers, b"content-type") or b""
+            if (
+                message.get("more_body")
+                or _header(headers, b"content-encoding") is not None
+                or not content_type.startswith(b"application/json")
+                or len(body) < self.minimum_size
+            ):
+                await send(held)
+                await send(message)
+                return
+
+            body = compress(body, encoding)
+            headers = [(k, v) for k, v in headers if k.lower() != b"content-length"]
+            headers.append((b"content-encoding", encoding.encode()))
+            headers.append((b"content-length", str(len(body)).encode()))
+            held["headers"] = add_vary(headers)
+            await send(held)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_wrapper)
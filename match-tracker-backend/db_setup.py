@@ -1,13 +1,18 @@
 # db_setup.py
+import asyncio
 import os
-import sqlalchemy as sa
+import sqlite3
+import uuid
+from collections.abc import MutableMapping
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, literal_column
+from sqlalchemy.exc import IntegrityError
 from databases import Database
-from sqlalchemy import MetaData
 
 # Import the ONE shared metadata from models (where tables are defined)
 from models import metadata
+from migrations import ensure_change_log_triggers, ensure_notify_triggers, upgrade
+from query_stats import instrument_database, instrument_engine
 
 # Read DB URL from env; fallback to local SQLite for development
 RAW_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./matches.db")
@@ -16,23 +21,175 @@ RAW_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./matches.db")
 if RAW_DATABASE_URL.startswith("postgres://"):
     RAW_DATABASE_URL = RAW_DATABASE_URL.replace("postgres://", "postgresql+asyncpg://", 1)
 
-# This is the async URL used by `databases.Database`
-database = Database(RAW_DATABASE_URL)
-
-# Build a sync URL for SQLAlchemy engine (remove +asyncpg if present)
+# Build a sync URL for SQLAlchemy engine (psycopg2 instead of asyncpg; named
+# explicitly since newer SQLAlchemy defaults plain postgresql:// to psycopg 3)
 if "+asyncpg" in RAW_DATABASE_URL:
-    SYNC_DATABASE_URL = RAW_DATABASE_URL.replace("+asyncpg", "")
+    SYNC_DATABASE_URL = RAW_DATABASE_URL.replace("+asyncpg", "+psycopg2")
+elif RAW_DATABASE_URL.startswith("postgresql://"):
+    SYNC_DATABASE_URL = RAW_DATABASE_URL.replace("postgresql://", "postgresql+psycopg2://", 1)
 else:
     SYNC_DATABASE_URL = RAW_DATABASE_URL
 
+IS_SQLITE = SYNC_DATABASE_URL.startswith("sqlite")
+IS_POSTGRES = SYNC_DATABASE_URL.startswith("postgresql")
+# write-ahead log: readers don't block the scorer's writes (and vice versa).
+# The scheduler checkpoints it periodically so the -wal file stays small.
+SQLITE_WAL = os.getenv("SQLITE_WAL", "1").strip().lower() not in ("0", "false", "no", "off")
+
+# single-statement writes (UPDATE/INSERT/DELETE ... RETURNING). Used when the
+# backend supports it (Postgres, SQLite >= 3.35); DB_RETURNING=0 forces the
+# read-then-write fallback.
+DB_RETURNING = os.getenv("DB_RETURNING", "1").strip().lower() not in ("0", "false", "no", "off")
+
+# `databases` raises the driver's own exceptions, not SQLAlchemy's: catch
+# these for a unique/constraint violation on either backend
+INTEGRITY_ERRORS = (IntegrityError, sqlite3.IntegrityError)
+if IS_POSTGRES:
+    import asyncpg
+    INTEGRITY_ERRORS += (asyncpg.IntegrityConstraintViolationError,)
+
+# This app instance, as Postgres sees it (application_name). Change
+# notifications carry it, so an instance can tell its own writes apart.
+INSTANCE_ID = f"match-tracker:{uuid.uuid4().hex[:8]}"
+# LISTEN/NOTIFY channel for score/match changes (see notify.py)
+NOTIFY_CHANNEL = os.getenv("NOTIFY_CHANNEL", "match_changes")
+
+
+def _pool_options():
+    """Options for `databases`: asyncpg pool settings on Postgres."""
+    if IS_SQLITE:
+        # URI filenames, so archive.py can ATTACH season files read-only
+        return {"uri": True}
+    if not IS_POSTGRES:
+        return {}
+    return {
+        "min_size": int(os.getenv("PG_POOL_MIN_SIZE", "2")),
+        "max_size": int(os.getenv("PG_POOL_MAX_SIZE", "10")),
+        # prepared statements per connection; the app has a few hundred distinct
+        # queries. Set 0 behind pgbouncer in transaction mode.
+        "statement_cache_size": int(os.getenv("PG_STATEMENT_CACHE_SIZE", "512")),
+        # recycle idle connections instead of holding server backends forever
+        "max_inactive_connection_lifetime": float(os.getenv("PG_POOL_IDLE_SECONDS", "300")),
+        "command_timeout": float(os.getenv("PG_COMMAND_TIMEOUT", "30")),
+        "server_settings": {
+            "application_name": INSTANCE_ID,
+            # JIT compilation costs more than it saves on short OLTP queries
+            "jit": "off",
+        },
+    }
+
+
+# This is the async URL used by `databases.Database`.
+# Constructing it does not open a connection; that happens in the app lifespan.
+database = instrument_database(Database(RAW_DATABASE_URL, **_pool_options()))
+
 # For SQLite we need connect_args; for Postgres we don't
 connect_args = {}
-if SYNC_DATABASE_URL.startswith("sqlite"):
+if IS_SQLITE:
     connect_args = {"check_same_thread": False}
 
-engine = create_engine(SYNC_DATABASE_URL, connect_args=connect_args)
+# Sessions get bound to the engine the first time get_engine() runs
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
+
+_engine = None
+
+
+def get_engine():
+    """Create the sync engine on first use (not at import time)."""
+    global _engine
+    if _engine is None:
+        _engine = instrument_engine(
+            create_engine(SYNC_DATABASE_URL, connect_args=connect_args, pool_pre_ping=IS_POSTGRES)
+        )
+        SessionLocal.configure(bind=_engine)
+    return _engine
+
+
+def insert_if_absent(table, *key_columns):
+    """INSERT ... ON CONFLICT (key_columns) DO NOTHING, in this backend's dialect."""
+    if IS_POSTGRES:
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table).on_conflict_do_nothing(index_elements=list(key_columns))
+
+
+async def execute_rowcount(query) -> int:
+    """Run an UPDATE/DELETE and return how many rows it changed.
+
+    `databases` doesn't say: on SQLite execute() answers lastrowid when there
+    is one, on Postgres the first column of a (here absent) result. So count
+    the rows a RETURNING hands back (Postgres always has it), or ask SQLite's
+    changes() on the same connection.
+    """
+    if IS_POSTGRES or supports_returning():
+        return len(await database.fetch_all(query.returning(literal_column("1"))))
+    async with database.connection():
+        await database.execute(query)
+        return await database.fetch_val("SELECT changes()")
+
+
+def supports_returning() -> bool:
+    # the dialect learns the server version on the engine's first connect (init_schema)
+    dialect = get_engine().dialect
+    return DB_RETURNING and dialect.update_returning and dialect.delete_returning
+
+
+async def gather_on_connection(*aws):
+    """asyncio.gather(*aws) with every awaitable using one pooled connection.
+
+    `databases` hands out a connection per asyncio task, so gathering N reads
+    normally checks out N connections. Here each child task is bound to the
+    caller's connection instead; its queries take turns on it (the connection
+    serialises them), which is the point: cached and projected reads still run
+    side by side, the database reads cost one checkout. Reads only: a child
+    that opened a transaction would share it with its siblings.
+
+    `databases` has no public way to do this; it keeps the per-task
+    connections in Database._connection_map, which is why requirements.txt
+    pins it. Without that attribute this is a plain gather.
+    """
+    if not isinstance(getattr(database, "_connection_map", None), MutableMapping):
+        return await asyncio.gather(*aws)
+    async with database.connection() as conn:
+        async def bound(aw):
+            task = asyncio.current_task()
+            database._connection_map[task] = conn
+            try:
+                return await aw
+            finally:
+                database._connection_map.pop(task, None)
+
+        return await asyncio.gather(*(bound(aw) for aw in aws))
+
+
+# pg_advisory_lock key held while one instance migrates the schema
+SCHEMA_LOCK_KEY = 72_001
+
+
+def _migrate(engine):
+    metadata.create_all(bind=engine)
+    upgrade(engine, metadata)
+    ensure_change_log_triggers(engine)
+    if IS_POSTGRES:
+        ensure_notify_triggers(engine, NOTIFY_CHANNEL)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-# Ensure the comments table is created
-metadata.create_all(bind=engine)
+def init_schema():
+    """Create missing tables, then add missing columns/indexes. Called once from the app lifespan."""
+    engine = get_engine()
+    if IS_SQLITE and SQLITE_WAL:
+        # persistent: set once on the file, every later connection uses it
+        with engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+    if IS_POSTGRES:
+        # instances starting together would race on CREATE TABLE: one migrates,
+        # the others wait here and then find nothing left to do
+        with engine.connect() as lock:
+            lock.exec_driver_sql(f"SELECT pg_advisory_lock({SCHEMA_LOCK_KEY})")
+            try:
+                _migrate(engine)
+            finally:
+                lock.exec_driver_sql(f"SELECT pg_advisory_unlock({SCHEMA_LOCK_KEY})")
+    else:
+        _migrate(engine)
@@ -1,6 +1,12 @@
 # Stdlib
 import json
+import logging
+import os
 import re
+import sys
+from array import array
+from contextlib import asynccontextmanager
+from functools import lru_cache
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Literal
 from datetime import  timezone
@@ -11,60 +17,186 @@ from fastapi import Query, HTTPException
 from sqlalchemy import func
 
 # FastAPI
-from fastapi import FastAPI, Depends, HTTPException, Request, status, Query
+from fastapi import APIRouter, FastAPI, Depends, Header, HTTPException, Request, status, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 
 # Pydantic
-from pydantic import BaseModel, Field, validator, EmailStr, field_validator
+from pydantic import BaseModel, Field, ValidationError, validator, field_validator
 
 # SQLAlchemy
 import sqlalchemy as sa
-from sqlalchemy import create_engine, delete, insert, select, update, Column, String, and_
+from sqlalchemy import delete, insert, select, update, Column, String, and_
 from sqlalchemy.sql import func
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.exc import IntegrityError
-
-# JWT / password hashing
-from jose import jwt, JWTError
-from passlib.context import CryptContext
 
 # App modules
-from db_setup import engine, SessionLocal, database
-from models import players,metadata, matches, scores as scores_tbl, users, momentum
+from db_setup import (
+    INTEGRITY_ERRORS, IS_SQLITE, execute_rowcount, get_engine, init_schema, insert_if_absent, SessionLocal, database,
+    supports_returning,
+)
+from query_stats import QueryStatsMiddleware
+from compression import CompressionMiddleware
+from response_cache import cached_body_response, cached_entry, cached_json, dump_json, response_cache
+from snapshots import SNAPSHOT_CACHE_CONTROL, snapshot_store
+from admission import AdmissionMiddleware
+from metrics import metrics
+from search import KINDS as SEARCH_KINDS, search_index
+from tenancy import ProgramMiddleware, current_program, program_context
+from scheduler import scheduler
+from notify import change_feed
+from changes import CHANGES_MAX_WAIT, CHANGES_PAGE_SIZE, change_stream
+from projection import PROJECTION_CHECK_SECONDS, projection
+from comment_buffer import BufferFull, comment_buffer
+from archive import archives, tables as archive_tables
+from batch import BATCH_MAX_REQUESTS, run_batch
+from records import (
+    fetch_records, match_outcome, normalize_winner, rebuild_if_empty as rebuild_records_if_empty, refresh_record,
+)
+from momentum_store import (
+    backfill_legacy_momentum, clear_series, extend_series, load_series, save_series, series_to_rows,
+    unpack_starts, unpack_values,
+)
+from models import players,metadata, matches, scores as scores_tbl, users, momentum, momentum_series, match_snapshots, idempotency_keys
+
+# All endpoints hang off this router; create_app() (bottom of the file) builds
+# the FastAPI instance. Nothing here touches the database at import time.
+router = APIRouter()
+
+# the app's own messages; LOG_LEVEL (INFO), see create_app()
+logger = logging.getLogger("match_tracker")
+
+
+def _mine(table):
+    # rows of the program this request is for (X-Program / ?program=, see tenancy.py)
+    return table.c.program == current_program()
+
+
+async def _update_returning(table, where, values, version: Optional[int] = None):
+    """UPDATE `table` SET `values` WHERE `where`, returning the updated row.
+
+    One statement with RETURNING; None when `where` matched nothing (missing
+    row, a status condition that no longer holds, or `version` is stale).
+    Without RETURNING: find the row's id, UPDATE it under the full `where`
+    (it may have stopped holding since), and re-select it only if that
+    UPDATE changed it.
+    """
+    where = list(where)
+    if "version" in table.c:
+        values = {**values, "version": table.c.version + 1}
+        if version is not None:
+            where.append(table.c.version == version)
+    if supports_returning():
+        return await database.fetch_one(update(table).where(*where).values(**values).returning(*table.c))
+    row_id = await database.fetch_val(select(table.c.id).where(*where))
+    if row_id is None:
+        return None
+    if not await execute_rowcount(update(table).where(table.c.id == row_id, *where).values(**values)):
+        return None
+    return await database.fetch_one(select(table).where(table.c.id == row_id))
+
+
+# _update_rows without RETURNING: tries before giving up as if nothing matched
+UPDATE_ROWS_ATTEMPTS = 3
+
+async def _update_rows(table, changes, where):
+    """Several rows, different values, one UPDATE.
+
+    `changes` is [(condition, {column: value})]; every column becomes
+    CASE WHEN condition THEN value ... ELSE column END, and only rows matching
+    `where` and some condition are touched. Returns the updated rows.
 
-# Create tables
-app = FastAPI()
-metadata.create_all(bind=engine)
+    Without RETURNING the ids are selected first and the UPDATE keeps the full
+    condition; if a row stopped matching in between, the attempt is rolled
+    back and retried, so the rows returned are exactly the rows written.
+    """
+    columns = {c for _, v in changes for c in v}
+    values = {
+        c: sa.case(
+            *[(cond, sa.bindparam(None, v[c], type_=table.c[c].type)) for cond, v in changes if c in v],
+            else_=table.c[c],
+        )
+        for c in columns
+    }
+    if "version" in table.c:
+        values["version"] = table.c.version + 1
+    where = [*where, sa.or_(*[cond for cond, _ in changes])]
+    if supports_returning():
+        return await database.fetch_all(update(table).where(*where).values(**values).returning(*table.c))
+    for _ in range(UPDATE_ROWS_ATTEMPTS):
+        ids = [r["id"] for r in await database.fetch_all(select(table.c.id).where(*where))]
+        if not ids:
+            return []
+        # a savepoint when the caller already holds a transaction
+        transaction = await database.transaction()
+        try:
+            changed = await execute_rowcount(update(table).where(table.c.id.in_(ids), *where).values(**values))
+            if changed == len(ids):
+                rows = await database.fetch_all(select(table).where(table.c.id.in_(ids)))
+                await transaction.commit()
+                return rows
+        except Exception:
+            await transaction.rollback()
+            raise
+        await transaction.rollback()
+    return []
+
+
+def _expected_version(body_version: Optional[int], if_match: Optional[str]) -> Optional[int]:
+    # optimistic concurrency: "version" in the body wins over an If-Match header
+    # ("3", W/"3" or 3; "*" means any)
+    if body_version is not None:
+        return body_version
+    if not if_match or if_match.strip() == "*":
+        return None
+    tag = if_match.strip().removeprefix("W/").strip('"')
+    try:
+        return int(tag)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="If-Match must be a row version")
 
 
+def _check_version(row, version: Optional[int], current):
+    # 409 with the row as it is now, so the client can merge and retry
+    if version is not None and row["version"] != version:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "Version conflict", "version": row["version"], "current": current(row)},
+        )
+
 
 SECRET_KEY = "change-me"  # make sure this is the SAME everywhere
 ALGO = "HS256"
 
-pwd = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 oauth2 = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
+# jose / passlib are only needed once someone logs in, so load them lazily
+_pwd = None
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[
-        "http://localhost:3000",  # Local React development server
-        "http://127.0.0.1:3000",  # Alternative localhost
-        "https://saint-leo-live-scores.onrender.com", 
-        "https://saint-leo-live-score.onrender.com",
-    ],
-    allow_credentials=True,  # Correct argument name
-    allow_methods=["*"],  # Allow all HTTP methods
-    allow_headers=["*"],  # Allow all headers
-)
+def get_pwd():
+    global _pwd
+    if _pwd is None:
+        from passlib.context import CryptContext
+        _pwd = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+    return _pwd
 
 
 class RegisterUser(BaseModel):
-  email: EmailStr
+  email: str
   password: str
   first_name: str
   last_name: str
+
+  @field_validator("email")
+  @classmethod
+  def validate_email(cls, v):
+      # same check pydantic's EmailStr does, without importing email_validator at startup
+      from email_validator import validate_email, EmailNotValidError
+      try:
+          return validate_email(v, check_deliverability=False).normalized
+      except EmailNotValidError as e:
+          raise ValueError(f"value is not a valid email address: {e}")
   
 class Match(BaseModel):
     date: str  # or datetime if you use from datetime import datetime
@@ -74,6 +206,7 @@ class Match(BaseModel):
     status: str = "scheduled"  # Optional default
     match_number: int
     winner: Optional[str] = None  # Add winner field
+    conference: Optional[bool] = None  # None: by opponent (records.CONFERENCE_OPPONENTS)
 # Define a new table for comments
 from sqlalchemy import Table, Column, Integer, String, ForeignKey, DateTime
 from datetime import datetime
@@ -174,11 +307,14 @@ class UpdateScore(BaseModel):
     line_no: Optional[int] = None
     sets: Optional[List[List[int]]] = None
     current_game: int | list[int] | None = None 
+    points: Optional[List[int]] = None  # [team, opponent] in the current game
     started: Optional[bool] = None
     current_serve: Optional[str] = None
+    version: Optional[int] = None  # expected row version (or If-Match)
     
 class CompleteScorePayload(BaseModel):
     winner: Literal["team", "opponent", "unfinished"]
+    version: Optional[int] = None
 
 # ----- helper (consistent with your _coerce_* style) -----
 def _coerce_winner(w: Optional[str]):
@@ -200,6 +336,7 @@ class StartScorePayload(BaseModel):
     player2: Optional[str] = None
     opponent2: Optional[str] = None
     current_serve: Optional[str] = "0"  # ✅ INT, not string
+    version: Optional[int] = None
 
     @validator("player1", "opponent1", pre=True)
     def strip_basic(cls, v):
@@ -223,20 +360,61 @@ class MatchOut(BaseModel):
 
 class WinnerBody(BaseModel):
     winner: str 
+    version: Optional[int] = None
 
-@app.on_event("startup")
-async def startup():
-    await database.connect()
+# player assignments for a match's lines; opponents are often only known on the day
+class DoublesLineup(BaseModel):
+    line_no: int = Field(..., ge=1, le=3)
+    player1: Optional[str] = None
+    player2: Optional[str] = None
+    opponent1: Optional[str] = None
+    opponent2: Optional[str] = None
 
-@app.on_event("shutdown")
-async def shutdown():
-    await database.disconnect()
+class SinglesLineup(BaseModel):
+    line_no: int = Field(..., ge=1, le=6)
+    player1: Optional[str] = None
+    opponent1: Optional[str] = None
 
-@app.get("/")
+class Lineup(BaseModel):
+    doubles: List[DoublesLineup] = []
+    singles: List[SinglesLineup] = []
+
+    def assignments(self):
+        """(match_type, line_no) -> the names given for that line."""
+        out = {}
+        for match_type, entries in (("doubles", self.doubles), ("singles", self.singles)):
+            for e in entries:
+                names = e.model_dump(exclude_none=True, exclude={"line_no"})
+                if names:
+                    out[(match_type, e.line_no)] = names
+        return out
+
+@router.get("/")
 async def root():
     return {"message": "Match Tracker API is running!"}
 
+@router.get("/healthz")
+async def healthz():
+    # liveness: the process is up and serving requests
+    return {"status": "ok"}
+
+@router.get("/readyz")
+async def readyz(request: Request):
+    # readiness: lifespan finished and the database answers
+    if not getattr(request.app.state, "ready", False):
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    try:
+        await database.fetch_val("SELECT 1")
+    except Exception as e:
+        return JSONResponse(status_code=503, content={"status": "db_unavailable", "error": str(e)})
+    return {"status": "ready"}
+
+@router.get("/metrics")
+async def get_metrics():
+    return metrics.snapshot()
+
 def create_access_token(sub: int, role: str, hours: int = 12):
+    from jose import jwt
     payload = {
         "sub": str(sub),
         "role": role,
@@ -244,14 +422,30 @@ def create_access_token(sub: int, role: str, hours: int = 12):
     }
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGO)
 
+@lru_cache(maxsize=1024)
+def _admin_token_expiry(token: str) -> Optional[int]:
+    """exp of a well-signed admin token, else None. Cached: the admission check runs on every write."""
+    from jose import jwt, JWTError
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGO])
+    except JWTError:
+        return None
+    return payload.get("exp") if payload.get("role") == "admin" else None
+
+def _is_admin_token(token: str) -> bool:
+    # admission.py: decides which writes may use the reserved write slots
+    exp = _admin_token_expiry(token)
+    return exp is not None and datetime.utcnow() < datetime.utcfromtimestamp(exp)
+
 def get_db():
-    db = SessionLocal()
+    db = SessionLocal(bind=get_engine())
     try:
         yield db
     finally:
         db.close()
 
 def get_current_user(token: str = Depends(oauth2), db=Depends(get_db)):
+    from jose import jwt, JWTError
     cred_exc = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -283,7 +477,7 @@ def get_current_user(token: str = Depends(oauth2), db=Depends(get_db)):
 
     print("Decoded token payload:", payload)  # Log the decoded token payload
 
-    row = db.execute(sa.select(users).where(users.c.id == uid)).mappings().first()
+    row = db.execute(sa.select(users).where(users.c.id == uid, _mine(users))).mappings().first()
     print("USER ROW FROM DB:", row)  # Log the user row fetched from the database
 
     if not row:
@@ -302,11 +496,11 @@ def admin_required(current_user = Depends(get_current_user)):
 
 DEFAULT_ROLE = "user"
 
-@app.post("/auth/register")
+@router.post("/auth/register")
 async def register_user(payload: RegisterUser):
     try:
         # Hash the password
-        password_hash = pwd.hash(payload.password)
+        password_hash = get_pwd().hash(payload.password)
         print("Password during registration:", payload.password)
         print("Hashed password during registration:", password_hash)
 
@@ -318,15 +512,17 @@ async def register_user(payload: RegisterUser):
             first_name=getattr(payload, "first_name", None),
             last_name=getattr(payload, "last_name", None),
             role=DEFAULT_ROLE,   # 👈 hardcoded backend-controlled role
+            program=current_program(),
         )
 
         new_user_id = await database.execute(query)
 
         return {"id": new_user_id, "email": payload.email, "role": DEFAULT_ROLE}
-    except IntegrityError:
+    except INTEGRITY_ERRORS:
+        # emails are unique per program (ix_users_program_email)
         raise HTTPException(status_code=400, detail="User with this email already exists")
 
-@app.post("/auth/login")
+@router.post("/auth/login")
 def login(form: OAuth2PasswordRequestForm = Depends(), db=Depends(get_db)):
     print("Raw username repr:", repr(form.username))
 
@@ -336,7 +532,7 @@ def login(form: OAuth2PasswordRequestForm = Depends(), db=Depends(get_db)):
 
     row = (
         db.execute(
-            sa.select(users).where(func.lower(users.c.email) == clean_username)
+            sa.select(users).where(func.lower(users.c.email) == clean_username, _mine(users))
         )
         .mappings()
         .first()
@@ -346,7 +542,7 @@ def login(form: OAuth2PasswordRequestForm = Depends(), db=Depends(get_db)):
     if not row:
         raise HTTPException(status_code=401, detail="Invalid username or password")
 
-    if not pwd.verify(form.password, row["password_hash"]):
+    if not get_pwd().verify(form.password, row["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid username or password")
 
     token = create_access_token(sub=row["id"], role=row["role"])
@@ -364,12 +560,12 @@ def login(form: OAuth2PasswordRequestForm = Depends(), db=Depends(get_db)):
     }
 
 
-@app.get("/auth/me")
+@router.get("/auth/me")
 def me(user = Depends(get_current_user)):
     return {"id": user["id"], "email": user["email"], "role": user["role"]}
 
 # Example: admin-only endpoint
-@app.post("/admin/players")
+@router.post("/admin/players")
 def create_player(payload: dict, user = Depends(admin_required), db=Depends(get_db)):
     # ...perform insert/update using Core...
     current_user = Depends(admin_required)
@@ -519,19 +715,170 @@ def _coerce_serve(value):
     except (TypeError, ValueError):
         return None
 
+def _winprob():
+    # numpy + the probability tables load on first use, not at startup
+    import winprob
+    return winprob
+
+def _forget_win_probability(match_id: Optional[int] = None, score_id: Optional[int] = None):
+    # drop memoized line probabilities; nothing to drop if winprob never loaded
+    wp = sys.modules.get("winprob")
+    if wp is None:
+        return
+    if score_id is not None:
+        wp.engine.forget(score_id)
+    if match_id is not None:
+        wp.engine.forget_match(match_id)
+
+def _analytics():
+    # same deal as winprob: numpy only when someone asks for analytics
+    import analytics
+    return analytics.store
+
+def _line_views(rows):
+    data = [_score_row_to_dict(r) for r in rows]
+    # adds win_probability to every line (memoized per line state)
+    _winprob().engine.annotate(data)
+    return data
+
 async def _fetch_match_scores(match_id: int):
-    rows = await database.fetch_all(
-        select(scores_tbl)
-        .where(scores_tbl.c.match_id == match_id)
-        .order_by(scores_tbl.c.line_no.asc(), scores_tbl.c.id.asc())
-    )
-    return [_score_row_to_dict(r) for r in rows]
+    def query(t):
+        table = t["scores"]
+        return (
+            select(table)
+            .where(table.c.match_id == match_id, _mine(table))
+            .order_by(table.c.line_no.asc(), table.c.id.asc())
+        )
+    season = archives.season_of_match(match_id)
+    if season is not None:
+        return _line_views(await archives.fetch_all(query, [season]))
+    return _line_views(await database.fetch_all(query(archive_tables())))
+
+# Reads of the live working set come from memory (projection.py); anything
+# outside it, and the snapshots, read the database.
+async def _match_lines(match_id: int):
+    rows = projection.match_lines(current_program(), match_id)
+    return _line_views(rows) if rows is not None else await _fetch_match_scores(match_id)
+
+async def _match_row(match_id: int):
+    row = projection.match(current_program(), match_id)
+    if row is not None:
+        return row
+    season = archives.season_of_match(match_id)
+    if season is not None:
+        return await archives.fetch_one(season, lambda t: (
+            t["matches"].select().where(t["matches"].c.id == match_id, _mine(t["matches"]))
+        ))
+    return await database.fetch_one(matches.select().where(matches.c.id == match_id, _mine(matches)))
+
+def _team_win_probability(scores):
+    return _winprob().team_win_probability((s.get("match_type"), s["win_probability"]) for s in scores)
+
+# ----- response cache helpers -----
+# Cached resources are tagged so writes can drop exactly what they touched:
+#   "schedule"       -> every /schedule list
+#   "players"        -> every /players list
+#   "match:{id}"     -> reads of one match (only stored once it's completed)
+
+def _all_lines_completed(rows):
+    return bool(rows) and all(str(r.get("status") or "").lower() == "completed" for r in rows)
+
+def _match_completed(data):
+    return str((data or {}).get("status") or "").lower() == "completed"
+
+async def _cached_match_scores(request: Request, match_id: int, require_rows: bool = False):
+    snap = await snapshot_store.get(match_id)
+    if snap is not None and not (require_rows and snap["scores"].body == b"[]"):
+        return cached_body_response(request, snap["scores"], headers={"Cache-Control": SNAPSHOT_CACHE_CONTROL})
+
+    async def build():
+        rows = await _match_lines(match_id)
+        if require_rows and not rows:
+            raise HTTPException(status_code=404, detail=f"No scores found for match {match_id}")
+        return rows
+    key = f"match:{match_id}:scores" + (":required" if require_rows else "")
+    return await cached_json(request, key, [f"match:{match_id}"], build, cacheable=_all_lines_completed)
+
+def _invalidate_match(match_id, schedule: bool = False):
+    tags = [f"match:{match_id}"]
+    if schedule:
+        tags.append("schedule")
+    response_cache.invalidate(*tags)
+
+async def _match_changed(match_id: int, row=None, lines=None):
+    """After a committed match write: drop cached reads, update the projection."""
+    _invalidate_match(match_id, schedule=True)
+    if row is not None:
+        await projection.apply_match(row, lines)
+    else:
+        await projection.refresh_matches([match_id])
+
+# ----- completed-match snapshots -----
+
+async def _build_match_snapshot(match_id: int):
+    """The snapshot body, or None if the match isn't completed (any more)."""
+    row = await database.fetch_one(matches.select().where(matches.c.id == match_id, _mine(matches)))
+    if not row:
+        raise HTTPException(status_code=404, detail="Match not found")
+    if str(row["status"] or "").lower() != "completed":
+        return None
+    scores = await _fetch_match_scores(match_id)
+    score_ids = [s["id"] for s in scores]
+
+    series = {sid: [] for sid in score_ids}
+    counts = {sid: 0 for sid in score_ids}
+    if score_ids:
+        for sid, packed in (await load_series(score_ids)).items():
+            series[sid] = series_to_rows(packed["values"], packed["updated_at"], packed["times"])
+        crows = await database.fetch_all(
+            sa.select(comments.c.score_id, func.count().label("n"))
+            .where(comments.c.score_id.in_(score_ids))
+            .group_by(comments.c.score_id)
+        )
+        for c in crows:
+            counts[c["score_id"]] = c["n"]
+
+    return {
+        "match": row_to_iso(row),
+        "scores": scores,
+        # JSON object keys are strings; keep them that way in memory too
+        "momentum": {str(k): v for k, v in series.items()},
+        "comment_counts": {str(k): v for k, v in counts.items()},
+    }
+
+async def _refresh_snapshot(match_id: int) -> bool:
+    # False for a match that isn't completed: nothing to snapshot
+    data = await _build_match_snapshot(match_id)
+    if data is None:
+        return False
+    await snapshot_store.save(match_id, data)
+    await _analytics().refresh_match(match_id)
+    return True
+
+async def _refresh_snapshot_if_any(match_id: int):
+    # admin edits to an already-snapshotted match regenerate it
+    if snapshot_store.has(match_id):
+        await _refresh_snapshot(match_id)
+
+async def _drop_snapshot_on_reopen(match_id: int) -> bool:
+    """Inside the transaction that sets a match live again: a completed match's
+    snapshot (and its analytics) no longer describe it. True if it had one."""
+    if not snapshot_store.has(match_id):
+        return False
+    await snapshot_store.delete(match_id)
+    return True
+
+async def _snapshot_response(request: Request, match_id: int, view: str):
+    views = await snapshot_store.get(match_id)
+    if views is None:
+        return None
+    return cached_body_response(request, views[view], headers={"Cache-Control": SNAPSHOT_CACHE_CONTROL})
 
 
 
 NY = ZoneInfo("America/New_York")
 
-@app.post("/schedule")
+@router.post("/schedule")
 async def create_match(match: Match, ):
     # match.date should be an ISO string like "2026-01-29T13:00:00"
     # Interpret it as New York local time if it has no tzinfo, then convert to UTC.
@@ -543,41 +890,69 @@ async def create_match(match: Match, ):
     dt_utc = dt.astimezone(timezone.utc)  # store UTC in DB
 
     query = matches.insert().values(
-        date=dt_utc,
+        date=dt_utc.replace(tzinfo=None),  # naive UTC: the column has no time zone (asyncpg rejects aware values)
         gender=match.gender,
         opponent=match.opponent,
         location=match.location,
         status=match.status or "scheduled",
         match_number=match.match_number,
         winner=match.winner,
+        conference=None if match.conference is None else int(match.conference),
+        program=current_program(),
     )
 
     try:
-        new_id = await database.execute(query)
+        async with database.transaction():
+            new_id = await database.execute(query)
+            # entering a past result counts toward the season record straight away
+            if (match.status or "").lower() == "completed":
+                await refresh_record({"program": current_program(), "gender": match.gender,
+                                      "date": dt_utc.replace(tzinfo=None)})
     except Exception as e:
         print("ERROR CREATING MATCH:", e)
         raise HTTPException(status_code=400, detail=str(e))
 
+    await _match_changed(new_id)
+    search_index.add_match({"id": new_id, "opponent": match.opponent, "location": match.location,
+                            "date": dt_utc, "gender": match.gender})
     return {"id": new_id, "message": "Match created"}
 
 
 
-@app.get("/schedule")
-async def list_schedule(
-    status: Optional[str] = Query(None),
-    gender: Optional[str] = Query(None),
-):
-    try:
-        q = matches.select().order_by(matches.c.date.desc())
+def _schedule_key(status=None, gender=None):
+    return f"schedule:{(status or '').lower()}:{(gender or '').lower()}"
+
+async def _schedule_rows(status=None, gender=None):
+    if (status or "").lower() == "live":
+        rows = projection.live_matches(current_program(), gender)
+        if rows is not None:
+            return [row_to_iso(r) for r in rows]
+
+    def query(t):
+        table = t["matches"]
+        q = table.select().where(_mine(table)).order_by(table.c.date.desc())
 
         if status:
-            q = q.where(func.lower(matches.c.status) == status.lower())
+            q = q.where(func.lower(table.c.status) == status.lower())
 
         if gender:
-            q = q.where(func.lower(matches.c.gender) == gender.lower())  # ✅ add this
+            q = q.where(func.lower(table.c.gender) == gender.lower())  # ✅ add this
+        return q
 
-        rows = await database.fetch_all(q)
-        return [row_to_iso(r) for r in rows]
+    # current season and archived ones (archive.py), newest first
+    rows = await archives.fetch_all_seasons(query)
+    rows.sort(key=lambda r: r["date"], reverse=True)
+    return [row_to_iso(r) for r in rows]
+
+@router.get("/schedule")
+async def list_schedule(
+    request: Request,
+    status: Optional[str] = Query(None),
+    gender: Optional[str] = Query(None),
+):
+    try:
+        return await cached_json(request, _schedule_key(status, gender), ["schedule"],
+                                 lambda: _schedule_rows(status, gender))
 
     except Exception as e:
         import traceback
@@ -590,72 +965,63 @@ async def list_schedule(
 from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
 
-@app.get("/schedule/upcoming")
+@router.get("/schedule/upcoming")
 async def get_upcoming_match():
-    rows = await database.fetch_all(matches.select())
-    upcoming = []
-
-    now = datetime.now(timezone.utc)
-
-    for row in rows:
-        item = row_to_iso(row)
-        status = str(item.get("status") or "").lower()
-        if status == "completed":
-            continue
-
-        date_str = item.get("date")
-        if not date_str:
-            continue
-
-        try:
-            dt = datetime.fromisoformat(date_str)
-        except ValueError:
-            continue
-
-        # if dt is naive, assume it's UTC (or NY if you prefer)
-        if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=timezone.utc)
-
-        dt_utc = dt.astimezone(timezone.utc)
-
-        if dt_utc >= now:
-            upcoming.append((dt_utc, item))
-
-    if not upcoming:
-        return None
-
-    upcoming.sort(key=lambda pair: pair[0])
-    return upcoming[0][1]
+    # next not-yet-completed match; one indexed lookup instead of scanning the season
+    row = projection.next_upcoming(current_program(), datetime.utcnow())
+    if row is not None:
+        return row_to_iso(row)
+    row = await database.fetch_one(
+        matches.select()
+        .where(_mine(matches))
+        .where(func.lower(matches.c.status) != "completed")
+        .where(matches.c.date >= datetime.utcnow())
+        .order_by(matches.c.date.asc())
+        .limit(1)
+    )
+    return row_to_iso(row) if row else None
 
-@app.get("/schedule/{id}")
-async def get_schedule_by_id(id: int):
-    query = matches.select().where(matches.c.id == id)
-    result = await database.fetch_one(query)
-    if not result:
-        raise HTTPException(status_code=404, detail="Match not found")
-    return row_to_iso(result)
+@router.get("/records")
+async def get_team_records(
+    request: Request,
+    season: Optional[int] = Query(None, description="spring year; default the latest season with a result"),
+    gender: Optional[str] = Query(None),
+):
+    # materialized by records.refresh_record; the "schedule" tag drops it whenever a match changes
+    key = f"records:{season or ''}:{(gender or '').lower()}"
+    return await cached_json(request, key, ["schedule"], lambda: fetch_records(current_program(), season, gender))
+
+@router.get("/schedule/{id}")
+async def get_schedule_by_id(id: int, request: Request):
+    snap = await _snapshot_response(request, id, "match")
+    if snap is not None:
+        return snap
+
+    async def build():
+        result = await _match_row(id)
+        if not result:
+            raise HTTPException(status_code=404, detail="Match not found")
+        return row_to_iso(result)
+    return await cached_json(request, f"match:{id}:row", [f"match:{id}"], build, cacheable=_match_completed)
 live_scores: List[Dict] = []  # in-memory storage
 
-@app.post("/schedule/{match_id}/start")
-async def start_match(match_id: int):
-    # Check if the match exists
-    existing = await database.fetch_one(
-        matches.select().where(matches.c.id == match_id)
-    )
-    if not existing:
+async def _match_write_failed(match_id: int, version: Optional[int]):
+    row = await database.fetch_one(matches.select().where(matches.c.id == match_id, _mine(matches)))
+    if not row:
         raise HTTPException(status_code=404, detail="Match not found")
+    _check_version(row, version, row_to_iso)
+    raise HTTPException(status_code=409, detail="Match changed, retry")
 
-    # Update the match status to "live"
-    await database.execute(
-        matches.update().where(matches.c.id == match_id).values(status="live")
-    )
-
-    scores_to_create = []
+def _new_lines(match_id: int, lineup: Optional[Lineup] = None):
+    # placeholder names, overridden by whatever the lineup already assigns
+    names = lineup.assignments() if lineup else {}
+    lines = []
     for i in range(1, 10):
         if i <= 3:
             # doubles
-            scores_to_create.append({
+            lines.append({
                 "match_id": match_id,
+                "program": current_program(),
                 "line_no": i,
                 "match_type": "doubles",
                 "player1": f"Doubles Player {i}A",
@@ -668,12 +1034,14 @@ async def start_match(match_id: int):
                 "started": 1,
                 "current_serve": "0",    
                 "winner": None,
+                **names.get(("doubles", i), {}),
             })
         else:
             # singles (lines 1–6)
             line_no = i - 3
-            scores_to_create.append({
+            lines.append({
                 "match_id": match_id,
+                "program": current_program(),
                 "line_no": line_no,
                 "match_type": "singles",
                 "player1": f"Singles Player {line_no}",
@@ -686,66 +1054,203 @@ async def start_match(match_id: int):
                 "started": 1,
                 "current_serve": "0",    
                 "winner": None,
+                **names.get(("singles", line_no), {}),
             })
+    return lines
+
+def _line_order(rows):
+    return sorted(rows, key=lambda r: (r["line_no"], r["id"]))
+
+@router.post("/schedule/{match_id}/start")
+async def start_match(match_id: int, lineup: Optional[Lineup] = None, if_match: Optional[str] = Header(None)):
+    """Set the match live and create its nine lines, optionally with the lineup.
+
+    Idempotent: the status flip is a conditional UPDATE that only succeeds for
+    a match that isn't live and has no lines yet, and the lines are inserted
+    in the same transaction. A repeated call (double-click, retry) creates
+    nothing and returns the existing lines, applying `lineup` if one is sent.
+    """
+    version = _expected_version(None, if_match)
+    async with database.transaction():
+        started = await _update_returning(
+            matches,
+            [
+                matches.c.id == match_id,
+                _mine(matches),
+                func.lower(func.coalesce(matches.c.status, "")) != "live",
+                ~sa.exists().where(scores_tbl.c.match_id == match_id),
+            ],
+            {"status": "live", "flag": None},
+            version,
+        )
+        if started:
+            if match_outcome(started) is not None:
+                # a finished match started again leaves the season record
+                await refresh_record(started)
+            reopened = await _drop_snapshot_on_reopen(match_id)
+            # one multi-row INSERT (execute_many would send nine)
+            insert_lines = scores_tbl.insert().values(_new_lines(match_id, lineup))
+            if supports_returning():
+                lines = await database.fetch_all(insert_lines.returning(*scores_tbl.c))
+            else:
+                await database.execute(insert_lines)
+                lines = await database.fetch_all(select(scores_tbl).where(scores_tbl.c.match_id == match_id))
+
+    if not started:
+        return await _restart_match(match_id, lineup, version)
+
+    if reopened:
+        _analytics().drop_match(match_id)
+    await _match_changed(match_id, started, lines)
+    await _after_score_writes(lines)
+    return {
+        "message": f"Match {match_id} started and scores created successfully",
+        "already_started": False,
+        "match": row_to_iso(started),
+        "scores": [_score_row_to_dict(r) for r in _line_order(lines)],
+    }
 
-    await database.execute_many(scores_tbl.insert(), scores_to_create)
+async def _restart_match(match_id: int, lineup: Optional[Lineup], version: Optional[int]):
+    # the claim failed: no such match, a stale If-Match, or the lines already exist
+    match = await database.fetch_one(matches.select().where(matches.c.id == match_id, _mine(matches)))
+    if not match:
+        raise HTTPException(status_code=404, detail="Match not found")
+    _check_version(match, version, row_to_iso)
+    if str(match["status"] or "").lower() != "live":
+        # reopened (e.g. completed by mistake): live again, keep its lines
+        async with database.transaction():
+            match = await _update_returning(
+                matches, [matches.c.id == match_id, _mine(matches)], {"status": "live", "flag": None}
+            )
+            if match_outcome(match) is not None:
+                await refresh_record(match)
+            reopened = await _drop_snapshot_on_reopen(match_id)
+        if reopened:
+            _analytics().drop_match(match_id)
+        await _match_changed(match_id, match)
+    if lineup and lineup.assignments():
+        await _apply_lineup(match_id, lineup)
+    lines = await database.fetch_all(
+        select(scores_tbl).where(scores_tbl.c.match_id == match_id, _mine(scores_tbl))
+    )
+    return {
+        "message": f"Match {match_id} already started",
+        "already_started": True,
+        "match": row_to_iso(match),
+        "scores": [_score_row_to_dict(r) for r in _line_order(lines)],
+    }
 
-    return {"message": f"Match {match_id} started and scores created successfully"}
+async def _apply_lineup(match_id: int, lineup: Lineup):
+    # one UPDATE for every assigned line (CASE per column, see _update_rows)
+    changes = [
+        ((scores_tbl.c.match_type == match_type) & (scores_tbl.c.line_no == line_no), names)
+        for (match_type, line_no), names in lineup.assignments().items()
+    ]
+    rows = await _update_rows(scores_tbl, changes, [scores_tbl.c.match_id == match_id, _mine(scores_tbl)])
+    await _after_score_writes(rows)
+    return rows
 
-@app.post("/schedule/{match_id}/complete")
-async def complete_match(match_id: int, body: WinnerBody):
+@router.put("/schedule/{match_id}/lineup")
+async def set_lineup(match_id: int, lineup: Lineup):
+    if not lineup.assignments():
+        raise HTTPException(status_code=422, detail="Lineup assigns no players")
+    rows = await _apply_lineup(match_id, lineup)
+    if not rows:
+        exists = await database.fetch_val(select(matches.c.id).where(matches.c.id == match_id, _mine(matches)))
+        if exists is None:
+            raise HTTPException(status_code=404, detail="Match not found")
+        raise HTTPException(status_code=409, detail="Match has no lines yet; start it first")
+    return {"message": "Lineup updated", "scores": [_score_row_to_dict(r) for r in _line_order(rows)]}
+
+@router.post("/schedule/{match_id}/complete")
+async def complete_match(match_id: int, body: WinnerBody, if_match: Optional[str] = Header(None)):
+    version = _expected_version(body.version, if_match)
     rows = await database.fetch_all(
-        scores_tbl.select().where(scores_tbl.c.match_id == match_id)
+        scores_tbl.select().where(scores_tbl.c.match_id == match_id, _mine(scores_tbl))
     )
 
     team = 0.0
     opponent = 0.0
 
     for r in rows:
-        w = str(r["winner"] or "").strip().lower()
+        # lines store "1"/"2" (_coerce_winner), older rows "team"/"0"/...
+        w = normalize_winner(r["winner"])
         match_type = str(r["match_type"] or "").strip().lower()
         
         # doubles = 0.5 points, singles = 1 point
         points = 0.5 if match_type == "doubles" else 1.0
         
-        if w == "1" or w == "team":
+        if w == "team":
             team += points
-        elif w == "0" or w == "opponent":
+        elif w == "opponent":
             opponent += points
 
-    team_score_json = {"team": int(team), "opponent": int(opponent)} if (team + opponent) > 0 else None
-    winner_val = str(body.winner) if body.winner is not None else None
+    def _points(x: float):
+        # 4.0 -> 4, 4.5 stays 4.5
+        return int(x) if x.is_integer() else x
 
-    query = (
-        matches.update()
-        .where(matches.c.id == match_id)
-        .values(
-            status="completed",
-            winner=winner_val,
-            team_score=team_score_json,
-        )
-    )
-    await database.execute(query)
+    team_score_json = {"team": _points(team), "opponent": _points(opponent)} if (team + opponent) > 0 else None
+    # "team" | "opponent", None for "unfinished" or anything unrecognised
+    winner_val = normalize_winner(body.winner)
 
-    updated_match = await database.fetch_one(matches.select().where(matches.c.id == match_id))
+    async with database.transaction():
+        updated_match = await _update_returning(
+            matches,
+            [matches.c.id == match_id, _mine(matches)],
+            {"status": "completed", "winner": winner_val, "team_score": team_score_json},
+            version,
+        )
+        # same transaction: the season record never disagrees with the result
+        await refresh_record(updated_match)
     if not updated_match:
-        raise HTTPException(status_code=404, detail="Match not found")
+        await _match_write_failed(match_id, version)
+    await _match_changed(match_id, updated_match)
+    _forget_win_probability(match_id=match_id)
+
+    # freeze the finished match for archive reads
+    await _refresh_snapshot(match_id)
 
     return {"message": "Match completed", "match": dict(updated_match)}
 
 
 
-@app.delete("/schedule/{match_id}")
+async def _delete_line_children(line_ids):
+    # rows that reference scores.id
+    for table in (comments, momentum, momentum_series):
+        await database.execute(table.delete().where(table.c.score_id.in_(line_ids)))
+
+@router.delete("/schedule/{match_id}")
 async def delete_match_and_scores(match_id: int):
     current_user = Depends(admin_required)
-    existing = await database.fetch_one(matches.select().where(matches.c.id == match_id))
-    if not existing:
+    owned = matches.c.id == match_id, _mine(matches)
+    owned_ids = select(matches.c.id).where(*owned)
+    async with database.transaction():
+        # referencing rows first (Postgres enforces the foreign keys);
+        # a match we don't own deletes nothing
+        await _delete_line_children(select(scores_tbl.c.id).where(scores_tbl.c.match_id.in_(owned_ids)))
+        await database.execute(scores_tbl.delete().where(scores_tbl.c.match_id.in_(owned_ids)))
+        await database.execute(match_snapshots.delete().where(match_snapshots.c.match_id.in_(owned_ids)))
+        record_key = (matches.c.id, matches.c.program, matches.c.gender, matches.c.date, matches.c.winner,
+                      matches.c.team_score)
+        if supports_returning():
+            deleted = await database.fetch_one(matches.delete().where(*owned).returning(*record_key))
+        else:
+            deleted = await database.fetch_one(select(*record_key).where(*owned))
+            if deleted is not None:
+                await database.execute(matches.delete().where(matches.c.id == match_id))
+        if deleted is not None and match_outcome(deleted) is not None:
+            # a deleted result leaves the season record
+            await refresh_record(deleted)
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Match not found")
-
-    await database.execute(
-        scores_tbl.delete().where(scores_tbl.c.match_id == match_id)
-    )
-    await database.execute(matches.delete().where(matches.c.id == match_id))
+    await snapshot_store.delete(match_id)
+    _analytics().drop_match(match_id)
+    search_index.remove("match", match_id)
+    search_index.remove_where(match_id=match_id)
+    projection.drop_match(match_id)
+    comment_buffer.drop(match_id=match_id)
+    _forget_win_probability(match_id=match_id)
+    _invalidate_match(match_id, schedule=True)
 
     return {"message": f"Match {match_id} and its scores deleted successfully"}
 
@@ -755,19 +1260,21 @@ PLAYER_COLUMNS = {
     "singles_season", "singles_all_time",
 }
 
-@app.post("/players")
+@router.post("/players")
 async def create_player(
     payload: Players,
     current_user: str = Depends(admin_required),
 ):
     values = payload.model_dump()
-    query = players.insert().values(**values)
+    query = players.insert().values(**values, program=current_program())
     new_id = await database.execute(query)
+    response_cache.invalidate("players")
+    search_index.add_player({"id": new_id, **values})
     return {"id": new_id, **values}
 
 
 
-@app.put("/players/{player_id}")
+@router.put("/players/{player_id}")
 async def update_player(
     player_id: int,
     payload: PlayerUpdate,
@@ -778,16 +1285,22 @@ async def update_player(
     if not clean_payload:
         return {"message": "No fields to update"}
 
-    query = players.update().where(players.c.id == player_id).values(**clean_payload)
+    query = players.update().where(players.c.id == player_id, _mine(players)).values(**clean_payload)
     await database.execute(query)
+    response_cache.invalidate("players")
+    row = await database.fetch_one(players.select().where(players.c.id == player_id, _mine(players)))
+    if row:
+        search_index.add_player(row)
     return {"message": "Player updated", "updated": clean_payload}
 
 
-@app.delete("/players/{player_id}")
+@router.delete("/players/{player_id}")
 async def delete_player(player_id: int):
     current_user = Depends(admin_required)
-    query = players.delete().where(players.c.id == player_id)
+    query = players.delete().where(players.c.id == player_id, _mine(players))
     result = await database.execute(query)
+    response_cache.invalidate("players")
+    search_index.remove("player", player_id)
 
     if result:
         return {"message": "Player deleted"}
@@ -797,8 +1310,10 @@ from typing import Optional
 from fastapi import Query
 from sqlalchemy import select, func
 
-@app.get("/players")
-async def list_players(gender: Optional[str] = Query(None)):
+def _players_key(gender=None):
+    return f"players:{(gender or '').lower()}"
+
+async def _player_rows(gender=None):
     q = select(
         players.c.id,
         players.c.name,
@@ -812,7 +1327,7 @@ async def list_players(gender: Optional[str] = Query(None)):
         players.c.doubles_season_losses,
         players.c.doubles_all_time_wins,
         players.c.doubles_all_time_losses,
-    ).order_by(players.c.name.asc())
+    ).where(_mine(players)).order_by(players.c.name.asc())
 
     if gender:
         q = q.where(func.lower(players.c.gender) == gender.lower())
@@ -820,58 +1335,90 @@ async def list_players(gender: Optional[str] = Query(None)):
     rows = await database.fetch_all(q)
     return [dict(r) for r in rows]
 
-@app.get("/livescore")
+@router.get("/players")
+async def list_players(request: Request, gender: Optional[str] = Query(None)):
+    return await cached_json(request, _players_key(gender), ["players"], lambda: _player_rows(gender))
+
+@router.get("/livescore")
 def get_livescore():
     return live_scores
 
-@app.post("/scores/{score_id}/start")
-async def start_score(score_id: int, body: StartScorePayload):
-    # fetch the row
-    row = await database.fetch_one(
-        select(scores_tbl).where(scores_tbl.c.id == score_id)
-    )
-    if not row:
-        raise HTTPException(status_code=404, detail="Score row not found")
+# ----- score writes -----
+# Each _*_score helper applies one mutation and returns the updated row; the
+# endpoints below and POST /scores/sync (which runs several inside one
+# transaction) share them. Cache/search/snapshot upkeep is _after_score_write.
 
-    match_type = row["match_type"]  # "doubles" | "singles"
-    if row["status"] in ("finished", "cancelled"):
-        raise HTTPException(status_code=409, detail=f"Cannot start a {row['status']} score")
+async def _after_score_write(row):
+    await _after_score_writes([row])
 
-    # require partner/opponent2 for doubles
-    if match_type == "doubles":
-        if not body.player2 or not body.opponent2:
-            raise HTTPException(
-                status_code=422,
-                detail="player2 and opponent2 are required for doubles"
-            )
+async def _after_score_writes(rows):
+    projection.apply_lines(rows)
+    for row in rows:
+        search_index.add_line(row)
+    for match_id in {row["match_id"] for row in rows}:
+        _invalidate_match(match_id)
+        await _refresh_snapshot_if_any(match_id)
+
+async def _start_score(score_id: int, body: StartScorePayload):
+    doubles = func.coalesce(scores_tbl.c.match_type, "") == "doubles"
+    where = [
+        scores_tbl.c.id == score_id,
+        _mine(scores_tbl),
+        func.coalesce(scores_tbl.c.status, "").notin_(("finished", "cancelled")),
+    ]
+    # require partner/opponent2 for doubles; singles never keep them
+    if not body.player2 or not body.opponent2:
+        where.append(~doubles)
+
+    # ✅ keep current_serve a "0"/"1" string; fall back to the stored one
+    if body.current_serve is not None:
+        serve_val = str(body.current_serve)
+        if serve_val not in ("0", "1"):
+            raise HTTPException(status_code=422, detail="current_serve must be '0' or '1'")
     else:
-        body.player2 = None
-        body.opponent2 = None
-
-    # ✅ force current_serve to int (works for "0", 0, None, etc.)
-    serve_val = body.current_serve if body.current_serve is not None else row["current_serve"]
-    serve_val = "0" if serve_val is None else str(serve_val)
-
-    if serve_val not in ("0", "1"):
-     raise HTTPException(status_code=422, detail="current_serve must be '0' or '1'")
+        serve_val = func.coalesce(scores_tbl.c.current_serve, "0")
+        where.append(serve_val.in_(("0", "1")))
 
     updates = {
         "player1": body.player1,
         "opponent1": body.opponent1,
-        "player2": body.player2,
-        "opponent2": body.opponent2,
-        "current_serve": serve_val,  # ✅ int
+        "player2": sa.case((doubles, body.player2), else_=None),
+        "opponent2": sa.case((doubles, body.opponent2), else_=None),
+        "current_serve": serve_val,
         "status": "live",
         "started": 1,
     }
+    updated = await _update_returning(scores_tbl, where, updates, body.version)
+    if updated is None:
+        await _start_score_failed(score_id, body.version)
+    return updated
 
-    await database.execute(
-        update(scores_tbl).where(scores_tbl.c.id == score_id).values(**updates)
+async def _score_write_failed(score_id: int, version: Optional[int]):
+    # the conditional UPDATE matched nothing: read the row to say why
+    row = await database.fetch_one(
+        select(scores_tbl).where(scores_tbl.c.id == score_id, _mine(scores_tbl))
     )
+    if not row:
+        raise HTTPException(status_code=404, detail="Score row not found")
+    _check_version(row, version, _score_row_to_dict)
+    return row
 
-    updated = await database.fetch_one(
-        select(scores_tbl).where(scores_tbl.c.id == score_id)
-    )
+async def _start_score_failed(score_id: int, version: Optional[int]):
+    row = await _score_write_failed(score_id, version)
+    if row["status"] in ("finished", "cancelled"):
+        raise HTTPException(status_code=409, detail=f"Cannot start a {row['status']} score")
+    if row["match_type"] == "doubles":
+        raise HTTPException(
+            status_code=422,
+            detail="player2 and opponent2 are required for doubles"
+        )
+    raise HTTPException(status_code=422, detail="current_serve must be '0' or '1'")
+
+@router.post("/scores/{score_id}/start")
+async def start_score(score_id: int, body: StartScorePayload, if_match: Optional[str] = Header(None)):
+    body.version = _expected_version(body.version, if_match)
+    updated = await _start_score(score_id, body)
+    await _after_score_write(updated)
     return {"message": "Score started", "score": _score_row_to_dict(updated)}
 # helper – make sure this returns STR, not int
 def _coerce_winner(winner):
@@ -882,62 +1429,50 @@ def _coerce_winner(winner):
         return "2"          # string
     return None             # unfinished / no winner yet
 
-@app.post("/scores/{score_id}/complete")
-async def complete_score(score_id: int, body: CompleteScorePayload):
-    print("=== COMPLETE SCORE CALLED ===")
-    print("score_id:", score_id)
-    print("raw body.winner:", body.winner, type(body.winner))
-
-    row = await database.fetch_one(
-        select(scores_tbl).where(scores_tbl.c.id == score_id)
-    )
-    if not row:
-        raise HTTPException(status_code=404, detail="Score row not found")
-
-    print("row status before:", row["status"])
-    print("row winner before:", row["winner"])
-
+async def _complete_score(score_id: int, body: CompleteScorePayload):
     winner_val = _coerce_winner(body.winner)
-    print("coerced winner_val:", winner_val, type(winner_val))
-
-    if str(row["status"]).lower() in ("completed", "cancelled"):
+    logger.debug("complete score %s: winner %r -> %r", score_id, body.winner, winner_val)
+
+    updated = await _update_returning(
+        scores_tbl,
+        [
+            scores_tbl.c.id == score_id,
+            _mine(scores_tbl),
+            func.lower(func.coalesce(scores_tbl.c.status, "")).notin_(("completed", "cancelled")),
+        ],
+        {"status": "completed", "winner": winner_val},
+        body.version,
+    )
+    if updated is None:
+        row = await _score_write_failed(score_id, body.version)
         raise HTTPException(
             status_code=409,
             detail=f"Cannot complete a {row['status']} score",
         )
 
-    await database.execute(
-        update(scores_tbl)
-        .where(scores_tbl.c.id == score_id)
-        .values(
-            status="completed",
-            winner=winner_val,
-        )
-    )
-
-    updated = await database.fetch_one(
-        select(scores_tbl).where(scores_tbl.c.id == score_id)
-    )
-
-    print("row status after:", updated["status"])
-    print("row winner after:", updated["winner"])
-    print("=== COMPLETE SCORE END ===")
+    return updated
 
+@router.post("/scores/{score_id}/complete")
+async def complete_score(score_id: int, body: CompleteScorePayload, if_match: Optional[str] = Header(None)):
+    body.version = _expected_version(body.version, if_match)
+    updated = await _complete_score(score_id, body)
+    await _after_score_write(updated)
     return {
         "message": "Score completed",
         "score": _score_row_to_dict(updated),
     }
 
-@app.get("/scores/{scores_id}")
+@router.get("/scores/{scores_id}")
 async def get_scores_by_id(scores_id: int):
-    row = await database.fetch_one(select(scores_tbl).where(scores_tbl.c.id == scores_id))
+    row = projection.line(current_program(), scores_id)
+    if row is None:
+        row = await database.fetch_one(select(scores_tbl).where(scores_tbl.c.id == scores_id, _mine(scores_tbl)))
     if row:
         return _score_row_to_dict(row)
     raise HTTPException(status_code=404, detail="scores not found")
 
-@app.put("/scores/{scores_id}")
-async def update_scores(scores_id: int, payload: UpdateScore):
-    print("Received payload:", payload)
+def _score_values(payload: UpdateScore) -> dict:
+    # column values for the fields a PUT /scores payload sets
     values = {}
 
     # --- allow editing meta fields (names, type, line, etc.) ---
@@ -976,6 +1511,14 @@ async def update_scores(scores_id: int, payload: UpdateScore):
     if payload.current_game is not None:
         values["current_game"] = int(payload.current_game)
 
+    # new games/sets start the point score over unless it's sent too
+    if payload.points is not None:
+        if len(payload.points) != 2 or min(payload.points) < 0:
+            raise HTTPException(status_code=422, detail="points must be [team, opponent]")
+        values["points"] = payload.points
+    elif payload.sets is not None:
+        values["points"] = [0, 0]
+
     # --- status / serve / winner ---
     if payload.status is not None:
         values["status"] = payload.status
@@ -988,51 +1531,198 @@ async def update_scores(scores_id: int, payload: UpdateScore):
 
     if not values:
         raise HTTPException(status_code=400, detail="No updatable fields provided")
+    return values
 
-    stmt = (
-        update(scores_tbl)
-        .where(scores_tbl.c.id == scores_id)
-        .values(**values)
-    )
-    await database.execute(stmt)
+async def _update_score(scores_id: int, payload: UpdateScore):
+    logger.debug("update score %s: %s", scores_id, payload)
+    values = _score_values(payload)
 
-    updated_row = await database.fetch_one(
-        select(scores_tbl).where(scores_tbl.c.id == scores_id)
+    updated_row = await _update_returning(
+        scores_tbl, [scores_tbl.c.id == scores_id, _mine(scores_tbl)], values, payload.version
     )
     if not updated_row:
-        raise HTTPException(status_code=404, detail="Score row not found")
+        await _score_write_failed(scores_id, payload.version)
+        raise HTTPException(status_code=409, detail="Score changed, retry")
+    return updated_row
+
+@router.put("/scores/{scores_id}")
+async def update_scores(scores_id: int, payload: UpdateScore, if_match: Optional[str] = Header(None)):
+    payload.version = _expected_version(payload.version, if_match)
+    updated_row = await _update_score(scores_id, payload)
+    await _after_score_write(updated_row)
 
     return {
         "message": "Score updated successfully",
         "score": _score_row_to_dict(updated_row),
     }
 
-@app.delete("/scores/{scores_id}")
+# ----- point-by-point scoring -----
+# The scorer sends only who won the point; scoring.py works out games, sets,
+# tiebreaks, serve and the line's winner. The write is conditional on the row
+# version the new state was computed from, so two taps racing on one line
+# never lose a point: the loser re-reads and scores on top.
+
+POINT_RETRIES = 3
+
+class PointPayload(BaseModel):
+    winner: Literal["team", "opponent"]
+    version: Optional[int] = None
+
+def _scoring():
+    import scoring  # pulls in winprob (numpy) on the first point
+    return scoring
+
+async def _score_point(score_id: int, body: PointPayload):
+    scoring = _scoring()
+    row = projection.line(current_program(), score_id)
+    for _ in range(POINT_RETRIES):
+        if row is None or (body.version is not None and row["version"] != body.version):
+            row = await _score_write_failed(score_id, None)
+        _check_version(row, body.version, _score_row_to_dict)
+        if str(row["status"] or "").lower() in ("completed", "finished", "cancelled"):
+            raise HTTPException(status_code=409, detail=f"Cannot score a {row['status']} line")
+        try:
+            result = scoring.score_point(
+                _winprob().format_for(row["match_type"]),
+                _coerce_sets(row["sets"]),
+                _coerce_current_game(row["points"]),
+                _coerce_serve(row["current_serve"]) != 1,
+                body.winner == "team",
+            )
+        except scoring.LineOver:
+            raise HTTPException(status_code=409, detail="Line already decided; complete it or correct the sets")
+
+        values = {
+            "sets": result.sets,
+            "points": result.points,
+            "current_game": sum(t + o for t, o in result.sets),
+            "current_serve": "0" if result.team_serves else "1",
+            "status": "live",
+            "started": 1,
+        }
+        if result.winner:
+            values.update(status="completed", winner=_coerce_winner(result.winner))
+        updated = await _update_returning(
+            scores_tbl,
+            [
+                scores_tbl.c.id == score_id,
+                _mine(scores_tbl),
+                func.lower(func.coalesce(scores_tbl.c.status, "")).notin_(("completed", "finished", "cancelled")),
+            ],
+            values,
+            row["version"],
+        )
+        if updated is not None:
+            return updated, result.event
+        row = None  # someone else wrote first: score on top of their state
+    raise HTTPException(status_code=409, detail="Score changed, retry")
+
+@router.post("/scores/{score_id}/point")
+async def score_point(score_id: int, body: PointPayload, if_match: Optional[str] = Header(None)):
+    """Record one point; returns the line's new state and what the point won
+    ("point", "game", "set" or "line" — a won line is completed)."""
+    body.version = _expected_version(body.version, if_match)
+    updated, event = await _score_point(score_id, body)
+    await _after_score_write(updated)
+    return {"event": event, "score": _line_views([updated])[0]}
+
+async def _match_lines_failed(match_id: int, lines):
+    # some line didn't match (rolled back): read them all to say which and why
+    current = {
+        r["id"]: r
+        for r in await database.fetch_all(
+            select(scores_tbl).where(
+                scores_tbl.c.id.in_([line.id for line in lines]),
+                scores_tbl.c.match_id == match_id,
+                _mine(scores_tbl),
+            )
+        )
+    }
+    missing = [line.id for line in lines if line.id not in current]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Lines {missing} not found in match {match_id}")
+    stale = [current[line.id] for line in lines if line.version is not None and current[line.id]["version"] != line.version]
+    if stale:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "Version conflict", "current": [_score_row_to_dict(r) for r in stale]},
+        )
+    raise HTTPException(status_code=409, detail="Scores changed, retry")
+
+class LineUpdate(UpdateScore):
+    id: int
+
+class MatchLinesUpdate(BaseModel):
+    lines: List[LineUpdate] = Field(..., min_length=1)
+
+@router.put("/scores/match/{match_id}")
+async def update_match_lines(match_id: int, payload: MatchLinesUpdate):
+    """Update several lines of a match in one UPDATE (e.g. every score at the end of a set).
+
+    All or nothing: if any line is missing or its `version` is stale nothing
+    is written, and the 404/409 names the lines (409 includes their current state).
+    """
+    ids = [line.id for line in payload.lines]
+    if len(set(ids)) != len(ids):
+        raise HTTPException(status_code=422, detail="Each line may appear only once")
+
+    changes = []
+    for line in payload.lines:
+        cond = scores_tbl.c.id == line.id
+        if line.version is not None:
+            cond = cond & (scores_tbl.c.version == line.version)
+        changes.append((cond, _score_values(line)))
+
+    transaction = await database.transaction()
+    try:
+        rows = await _update_rows(
+            scores_tbl, changes, [scores_tbl.c.match_id == match_id, _mine(scores_tbl)]
+        )
+    except Exception:
+        await transaction.rollback()
+        raise
+    if len(rows) != len(ids):
+        await transaction.rollback()
+        await _match_lines_failed(match_id, payload.lines)
+    await transaction.commit()
+
+    await _after_score_writes(rows)
+    return {"message": "Scores updated successfully", "scores": [_score_row_to_dict(r) for r in _line_order(rows)]}
+
+@router.delete("/scores/{scores_id}")
 async def delete_scores(scores_id: int):
     current_user = Depends(admin_required)
-    exists = await database.fetch_one(select(scores_tbl.c.id).where(scores_tbl.c.id == scores_id))
+    exists = await database.fetch_one(
+        select(scores_tbl.c.id, scores_tbl.c.match_id).where(scores_tbl.c.id == scores_id, _mine(scores_tbl))
+    )
     if not exists:
         raise HTTPException(status_code=404, detail="scores not found")
 
-    await database.execute(scores_tbl.delete().where(scores_tbl.c.id == scores_id))
+    async with database.transaction():
+        await _delete_line_children([scores_id])
+        await database.execute(scores_tbl.delete().where(scores_tbl.c.id == scores_id))
+    projection.drop_line(scores_id)
+    comment_buffer.drop(score_id=scores_id)
+    _forget_win_probability(score_id=scores_id)
+    _invalidate_match(exists["match_id"])
+    search_index.remove("line", scores_id)
+    search_index.remove_where(score_id=scores_id)
+    await _refresh_snapshot_if_any(exists["match_id"])
     return {"message": "scores deleted"}
 
-@app.get("/scores/match/{match_id}/all")
-async def get_scores_for_match(match_id: int):
-    return await _fetch_match_scores(match_id)
+@router.get("/scores/match/{match_id}/all")
+async def get_scores_for_match(match_id: int, request: Request):
+    return await _cached_match_scores(request, match_id)
 
-@app.get("/scores/match/{match_id}")
-async def get_scores_by_match(match_id: int):
-    rows = await _fetch_match_scores(match_id)
-    if not rows:
-        raise HTTPException(status_code=404, detail=f"No scores found for match {match_id}")
-    return rows
+@router.get("/scores/match/{match_id}")
+async def get_scores_by_match(match_id: int, request: Request):
+    return await _cached_match_scores(request, match_id, require_rows=True)
 
 
-@app.post("/scores/match/{match_id}/complete")
+@router.post("/scores/match/{match_id}/complete")
 async def complete_scores_match(match_id: int, winner: Literal["team", "opponent"]):
     current_user = Depends(admin_required)
-    scores_query = scores_tbl.select().where(scores_tbl.c.match_id == match_id)
+    scores_query = scores_tbl.select().where(scores_tbl.c.match_id == match_id, _mine(scores_tbl))
     scores_list = await database.fetch_all(scores_query)
 
     if not scores_list:
@@ -1047,36 +1737,135 @@ async def complete_scores_match(match_id: int, winner: Literal["team", "opponent
         )
 
     # Update the match: set status and winner
-    update_match_query = (
-        matches.update()
-        .where(matches.c.id == match_id)
-        .values(status="completed", winner=winner)
-    )
-    await database.execute(update_match_query)
+    async with database.transaction():
+        updated_match = await _update_returning(
+            matches, [matches.c.id == match_id, _mine(matches)], {"status": "completed", "winner": winner}
+        )
+        await refresh_record(updated_match)
+    await _match_changed(match_id)
+    _forget_win_probability(match_id=match_id)
+    await _refresh_snapshot(match_id)
 
     return {"message": f"Match {match_id} completed; winner set to '{winner}'."}
 
-@app.get("/matches/{match_id}")
-async def get_match(match_id: int):
-    row = await database.fetch_one(matches.select().where(matches.c.id == match_id))
-    if not row:
-        raise HTTPException(status_code=404, detail="Match not found")
+@router.get("/matches/{match_id}")
+async def get_match(match_id: int, request: Request):
+    snap = await _snapshot_response(request, match_id, "full")
+    if snap is not None:
+        return snap
 
-    data = row_to_iso(row)
-    scores = await _fetch_match_scores(match_id)
-    if scores:
-        data["scores"] = scores
-    return data
+    async def build():
+        row = await _match_row(match_id)
+        if not row:
+            raise HTTPException(status_code=404, detail="Match not found")
 
+        data = row_to_iso(row)
+        scores = await _match_lines(match_id)
+        if scores:
+            data["scores"] = scores
+            data["team_win_probability"] = _team_win_probability(scores)
+        return data
+    return await cached_json(request, f"match:{match_id}:full", [f"match:{match_id}"], build, cacheable=_match_completed)
 
-@app.get("/matches/{match_id}/scores")
-async def get_match_scores(match_id: int):
-    return await _fetch_match_scores(match_id)
 
+@router.get("/matches/{match_id}/scores")
+async def get_match_scores(match_id: int, request: Request):
+    return await _cached_match_scores(request, match_id)
 
-@app.get("/events/match/{match_id}")
-async def get_events_for_match(match_id: int):
-    return await _fetch_match_scores(match_id)
+
+@router.get("/events/match/{match_id}")
+async def get_events_for_match(match_id: int, request: Request):
+    return await _cached_match_scores(request, match_id)
+
+
+@router.get("/matches/{match_id}/win-probability")
+async def get_win_probability(match_id: int):
+    scores = await _match_lines(match_id)
+    if not scores:
+        raise HTTPException(status_code=404, detail=f"No scores found for match {match_id}")
+    return {
+        "match_id": match_id,
+        "team": _team_win_probability(scores),
+        "lines": [
+            {"id": s["id"], "match_type": s["match_type"], "line_no": s["line_no"], "win_probability": s["win_probability"]}
+            for s in scores
+        ],
+    }
+
+
+@router.get("/search")
+async def search(
+    q: str = Query(..., min_length=2),
+    types: Optional[str] = Query(None, description="Comma-separated: player,match,line,comment"),
+    limit: int = Query(20, ge=1, le=100),
+):
+    kinds = [t.strip() for t in types.split(",") if t.strip()] if types else None
+    if kinds and not set(kinds) <= set(SEARCH_KINDS):
+        raise HTTPException(status_code=422, detail=f"types must be among {', '.join(SEARCH_KINDS)}")
+    return {"query": q, "results": search_index.search(q, kinds=kinds, limit=limit)}
+
+
+@router.get("/analytics/head-to-head")
+async def analytics_head_to_head(
+    opponent: str,
+    seasons: Optional[int] = Query(None, ge=1, description="Only the last N seasons"),
+    gender: Optional[str] = None,
+):
+    store = _analytics()
+    await store.ensure_loaded()
+    return store.head_to_head(opponent, seasons=seasons, gender=gender)
+
+
+@router.get("/analytics/doubles-pairings")
+async def analytics_doubles_pairings(
+    gender: Optional[str] = None,
+    line_no: Optional[int] = None,
+    season: Optional[int] = None,
+    seasons: Optional[int] = Query(None, ge=1),
+):
+    store = _analytics()
+    await store.ensure_loaded()
+    return store.doubles_pairings(gender=gender, line_no=line_no, season=season, seasons=seasons)
+
+
+@router.get("/analytics/three-set")
+async def analytics_three_set(
+    gender: Optional[str] = None,
+    season: Optional[int] = None,
+    seasons: Optional[int] = Query(None, ge=1),
+):
+    store = _analytics()
+    await store.ensure_loaded()
+    return store.three_set_record(gender=gender, season=season, seasons=seasons)
+
+
+@router.get("/analytics/players/{name}")
+async def analytics_player(
+    name: str,
+    gender: Optional[str] = None,
+    season: Optional[int] = None,
+    seasons: Optional[int] = Query(None, ge=1),
+):
+    store = _analytics()
+    await store.ensure_loaded()
+    return store.player_record(name, gender=gender, season=season, seasons=seasons)
+
+
+@router.get("/matches/{match_id}/snapshot")
+async def get_match_snapshot(match_id: int, request: Request):
+    # whole box score (match, lines, momentum, comment counts) in one response
+    snap = await _snapshot_response(request, match_id, "snapshot")
+    if snap is None:
+        raise HTTPException(status_code=404, detail="No snapshot for this match (not completed yet?)")
+    return snap
+
+
+@router.post("/schedule/{match_id}/snapshot")
+async def regenerate_match_snapshot(match_id: int, user=Depends(admin_required)):
+    if not await _refresh_snapshot(match_id):
+        raise HTTPException(status_code=409, detail="Match is not completed")
+    _invalidate_match(match_id, schedule=True)
+    return {"message": f"Snapshot for match {match_id} regenerated"}
 
 
 
@@ -1086,7 +1875,7 @@ from pydantic import BaseModel
 class CommentPayload(BaseModel):
     text: str
 
-@app.post("/scores/{score_id}/comments")
+@router.post("/scores/{score_id}/comments")
 async def post_comment(
     score_id: int,
     payload: CommentPayload,
@@ -1097,15 +1886,43 @@ async def post_comment(
     if not text:
         raise HTTPException(status_code=400, detail="Comment cannot be empty")
 
+    line = projection.line(current_program(), score_id)
+    if line is not None:
+        match_id = line["match_id"]
+    else:
+        match_id = await database.fetch_val(
+            select(scores_tbl.c.match_id).where(scores_tbl.c.id == score_id, _mine(scores_tbl))
+        )
+    if match_id is None:
+        raise HTTPException(status_code=404, detail="Score not found")
+
     ts = datetime.utcnow()
 
+    if comment_buffer.enabled:
+        # acknowledged now, written with the rest of the burst (comment_buffer.py)
+        try:
+            return await comment_buffer.add(current_program(), score_id, match_id, current_user, text, ts)
+        except BufferFull:
+            raise HTTPException(
+                status_code=503, detail="Too many comments right now, try again", headers={"Retry-After": "1"}
+            )
+
     query = comments.insert().values(
         user_id=current_user["id"],
         score_id=score_id,
         text=text,
         timestamp=ts,
+        program=current_program(),
     )
     comment_id = await database.execute(query)
+    search_index.add_comment({"id": comment_id, "score_id": score_id, "text": text}, match_id)
+    projection.add_comment(score_id, {
+        "id": comment_id,
+        "text": text,
+        "timestamp": ts,
+        "user_first_name": current_user.get("first_name"),
+        "user_role": current_user.get("role"),
+    })
 
     return {
         "id": comment_id,
@@ -1117,8 +1934,13 @@ async def post_comment(
     }
 
 
-@app.get("/scores/{score_id}/comments")
+@router.get("/scores/{score_id}/comments")
 async def get_comments(score_id: int):
+    # plus what's still waiting in this instance's write buffer
+    pending = comment_buffer.pending(current_program(), score_id)
+    thread = projection.line_comments(current_program(), score_id)
+    if thread is not None:
+        return thread + pending if pending else thread
     query = (
         sa.select(
             comments.c.id,
@@ -1128,7 +1950,7 @@ async def get_comments(score_id: int):
             users.c.role.label("user_role"),
         )
         .join(users, comments.c.user_id == users.c.id)
-        .where(comments.c.score_id == score_id)
+        .where(comments.c.score_id == score_id, _mine(comments))
         .order_by(comments.c.timestamp.asc())
     )
 
@@ -1142,122 +1964,437 @@ async def get_comments(score_id: int):
             "timestamp": row["timestamp"],
         }
         for row in rows
-    ]
+    ] + pending
 
 class MomentumPayload(BaseModel):
     winner: str  # "team" or "opponent"
 
-@app.post("/scores/{score_id}/momentum")
-async def add_momentum(
-    score_id: int,
-    payload: MomentumPayload,
-):
+MOMENTUM_RETRIES = 5
+
+async def _add_momentum(score_id: int, payload: MomentumPayload):
     # Get current score
     score_row = await database.fetch_one(
-        select(scores_tbl).where(scores_tbl.c.id == score_id)
+        select(scores_tbl.c.sets).where(scores_tbl.c.id == score_id, _mine(scores_tbl))
     )
     if not score_row:
         raise HTTPException(status_code=404, detail="Score not found")
 
-    # Get current sets and calculate games per set
-    sets = _coerce_sets(score_row["sets"])
-    games_per_set = [team + opp for team, opp in sets]
-    total_games = sum(games_per_set)
-    
-    # Calculate which set we're in based on total games
-    current_set_index = 0
-    games_before_current_set = 0
-    cumulative = 0
-    for i, set_games in enumerate(games_per_set):
-        if cumulative + set_games >= total_games:
-            current_set_index = i
-            games_before_current_set = cumulative
-            break
-        cumulative += set_games
-
-    # Get last momentum entry
-    last_momentum = await database.fetch_one(
-        select(momentum)
-        .where(momentum.c.score_id == score_id)
-        .order_by(momentum.c.game_number.desc())
-    )
+    # the whole series lives in one packed row; extend it and write it back,
+    # unless another append landed in between (then extend the new one)
+    for _ in range(MOMENTUM_RETRIES):
+        existing = (await load_series([score_id])).get(score_id)
+        values = existing["values"] if existing else array("b")
+        set_starts = existing["set_starts"] if existing else array("H")
+        times = existing["times"] if existing else array("I")
 
-    if last_momentum:
-        last_game_number = last_momentum["game_number"]
-        last_set_games = 0
-        for i, set_games in enumerate(games_per_set):
-            if sum(games_per_set[:i+1]) >= last_game_number:
-                last_set_games = sum(games_per_set[:i])
-                break
-        
-        # Check if we moved to a new set - reset momentum to 0
-        if games_before_current_set > last_set_games:
-            cumulative_momentum = 0
-        else:
-            cumulative_momentum = last_momentum["team_momentum"] - last_momentum["opp_momentum"]
-    else:
-        last_game_number = 0
-        cumulative_momentum = 0
-        
-        # Insert starting point (0,0)
-        query = momentum.insert().values(
-            score_id=score_id,
-            game_number=0,
-            team_momentum=0,
-            opp_momentum=0,
-            timestamp=datetime.utcnow(),
-        )
-        await database.execute(query)
-
-    # Add momentum for each new game
-    for game_num in range(last_game_number + 1, total_games + 1):
-        # Each new game: if team wins +1, if opponent wins -1
-        if payload.winner == "team":
-            cumulative_momentum += 1
-            team_mom = cumulative_momentum if cumulative_momentum > 0 else 0
-            opp_mom = 0
-        else:
-            cumulative_momentum -= 1
-            team_mom = 0
-            opp_mom = abs(cumulative_momentum) if cumulative_momentum < 0 else 0
-
-        query = momentum.insert().values(
-            score_id=score_id,
-            game_number=game_num,
-            team_momentum=team_mom,
-            opp_momentum=opp_mom,
-            timestamp=datetime.utcnow(),
+        games_added, cumulative_momentum = extend_series(
+            values, set_starts, _coerce_sets(score_row["sets"]), payload.winner, times
         )
-        await database.execute(query)
+        if existing and not games_added:
+            break  # nothing new (a repeat tap, or another append already covered it)
+        if await save_series(score_id, values, set_starts, existing["version"] if existing else None, times):
+            break
+    else:
+        raise HTTPException(status_code=409, detail="Momentum changed concurrently, try again")
 
     return {
-        "games_added": total_games - last_game_number,
-        "current_game": total_games,
+        "games_added": games_added,
+        "current_game": len(values) - 1,
         "cumulative_momentum": cumulative_momentum,
     }
 
-@app.delete("/scores/{score_id}/momentum")
+@router.post("/scores/{score_id}/momentum")
+async def add_momentum(
+    score_id: int,
+    payload: MomentumPayload,
+):
+    return await _add_momentum(score_id, payload)
+
+@router.delete("/scores/{score_id}/momentum")
 async def clear_momentum(score_id: int):
-    await database.execute(
-        momentum.delete().where(momentum.c.score_id == score_id)
-    )
+    owned = await database.fetch_val(select(scores_tbl.c.id).where(scores_tbl.c.id == score_id, _mine(scores_tbl)))
+    if owned is None:
+        raise HTTPException(status_code=404, detail="Score not found")
+    await clear_series(score_id)
     return {"message": "Momentum cleared"}
 
-@app.get("/scores/{score_id}/momentum")
+@router.get("/scores/{score_id}/momentum")
 async def get_momentum(score_id: int):
-    query = (
-        select(momentum)
-        .where(momentum.c.score_id == score_id)
-        .order_by(momentum.c.game_number.asc())
+    packed = (await load_series([score_id], program=current_program())).get(score_id)
+    if not packed:
+        return []
+    return series_to_rows(packed["values"], packed["updated_at"], packed["times"])
+
+# ----- offline sync -----
+# Admin.js queues score taps while courtside Wi-Fi is down and replays them
+# here in order. Every mutation carries a client-generated idempotency key, so
+# replaying a batch (or part of one) after a dropped response never applies
+# anything twice.
+
+MAX_SYNC_MUTATIONS = int(os.getenv("MAX_SYNC_MUTATIONS", "200"))
+# how long keys are remembered (purged by the scheduler)
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_KEY_TTL_HOURS", "72"))
+
+# idempotency_keys.status while the claiming transaction is still applying it
+SYNC_PENDING = "pending"
+
+class SyncMutation(BaseModel):
+    key: str = Field(..., min_length=1, max_length=128)
+    op: Literal["update", "start", "complete", "momentum", "point"]
+    score_id: int
+    payload: dict = {}
+    client_ts: Optional[datetime] = None
+
+class SyncBatch(BaseModel):
+    mutations: List[SyncMutation] = Field(..., min_length=1, max_length=MAX_SYNC_MUTATIONS)
+
+_SYNC_OPS = {
+    "update": (UpdateScore, _update_score),
+    "start": (StartScorePayload, _start_score),
+    "complete": (CompleteScorePayload, _complete_score),
+    "momentum": (MomentumPayload, _add_momentum),
+    "point": (PointPayload, _score_point),
+}
+
+@router.post("/scores/sync")
+async def sync_scores(batch: SyncBatch):
+    """Apply queued score mutations in order, in one transaction.
+
+    Per mutation the result is "applied", "rejected" (404/409/422 from the
+    normal endpoint; the rest of the batch still applies) or "duplicate" (key
+    seen before; the original result is returned). Any other error rolls the
+    whole batch back, so the client can simply resend it.
+    """
+    program = current_program()
+    now = datetime.utcnow()
+    results = []
+    written = set()  # score ids whose row changed
+    finished = {}  # key -> (status, result JSON) for the keys this batch claimed
+    async with database.transaction():
+        # claim every key before applying anything: a key another request holds
+        # (or already finished) loses the insert, and once that request commits
+        # its stored result is what this one answers with
+        claims = {}
+        for m in batch.mutations:
+            claims.setdefault(m.key, dict(
+                program=program, key=m.key, op=m.op, score_id=m.score_id, status=SYNC_PENDING, result="{}",
+                client_ts=m.client_ts, created_at=now,
+            ))
+        await database.execute(
+            insert_if_absent(idempotency_keys, idempotency_keys.c.program, idempotency_keys.c.key)
+            .values(list(claims.values()))
+        )
+        seen = {}
+        for r in await database.fetch_all(
+            select(idempotency_keys.c.key, idempotency_keys.c.status, idempotency_keys.c.result)
+            .where(idempotency_keys.c.program == program, idempotency_keys.c.key.in_(claims))
+        ):
+            if r["status"] != SYNC_PENDING:
+                seen[r["key"]] = json.loads(r["result"])
+
+        for m in batch.mutations:
+            if m.key in seen:
+                results.append({**seen[m.key], "status": "duplicate"})
+                continue
+
+            model, apply = _SYNC_OPS[m.op]
+            entry = {"key": m.key, "op": m.op, "score_id": m.score_id}
+            try:
+                out = await apply(m.score_id, model.model_validate(m.payload))
+            except HTTPException as e:
+                entry.update(status="rejected", status_code=e.status_code, error=e.detail)
+            except ValidationError as e:
+                entry.update(status="rejected", status_code=422,
+                             error=[{"loc": err["loc"], "msg": err["msg"]} for err in e.errors()])
+            else:
+                entry["status"] = "applied"
+                if m.op == "momentum":
+                    entry["momentum"] = out
+                else:
+                    if m.op == "point":
+                        entry["event"] = out[1]
+                    written.add(m.score_id)
+
+            finished[m.key] = (entry["status"], dump_json(entry).decode("utf-8"))
+            seen[m.key] = entry
+            results.append(entry)
+
+        if finished:
+            key = idempotency_keys.c.key
+            await database.execute(
+                idempotency_keys.update()
+                .where(idempotency_keys.c.program == program, key.in_(finished))
+                .values(
+                    status=sa.case({k: v[0] for k, v in finished.items()}, value=key),
+                    result=sa.case({k: v[1] for k, v in finished.items()}, value=key),
+                )
+            )
+
+    rows = await database.fetch_all(
+        select(scores_tbl)
+        .where(scores_tbl.c.id.in_({m.score_id for m in batch.mutations}), _mine(scores_tbl))
+        .order_by(scores_tbl.c.line_no.asc(), scores_tbl.c.id.asc())
+    )
+    await _after_score_writes([row for row in rows if row["id"] in written])
+    return {"results": results, "scores": [_score_row_to_dict(r) for r in rows]}
+
+
+@router.get("/scores/match/{match_id}/momentum")
+async def get_match_momentum(match_id: int):
+    # every line's series in one query, packed form:
+    # values[i] = cumulative momentum after game i (>0 team, <0 opponent)
+    rows = await database.fetch_all(
+        sa.select(
+            scores_tbl.c.id,
+            scores_tbl.c.line_no,
+            scores_tbl.c.match_type,
+            momentum_series.c.data,
+            momentum_series.c.set_starts,
+            momentum_series.c.updated_at,
+        )
+        .select_from(scores_tbl.outerjoin(momentum_series, momentum_series.c.score_id == scores_tbl.c.id))
+        .where(scores_tbl.c.match_id == match_id, _mine(scores_tbl))
+        .order_by(scores_tbl.c.line_no.asc(), scores_tbl.c.id.asc())
     )
-    rows = await database.fetch_all(query)
     return [
         {
-            "game_number": row["game_number"],
-            "team_momentum": row["team_momentum"],
-            "opp_momentum": row["opp_momentum"],
-            "timestamp": row["timestamp"],
+            "score_id": r["id"],
+            "line_no": r["line_no"],
+            "match_type": r["match_type"],
+            "values": unpack_values(r["data"]).tolist() if r["data"] is not None else [],
+            "set_starts": unpack_starts(r["set_starts"]).tolist() if r["set_starts"] is not None else [],
+            "updated_at": r["updated_at"],
         }
-        for row in rows
+        for r in rows
     ]
 
+
+# ----- batched reads (see batch.py) -----
+
+class BatchItem(BaseModel):
+    id: Optional[str] = Field(None, max_length=64)
+    path: str = Field(..., min_length=1, max_length=512)
+    fields: Optional[List[str]] = Field(None, max_length=100)
+
+class BatchRequest(BaseModel):
+    requests: List[BatchItem] = Field(..., min_length=1, max_length=BATCH_MAX_REQUESTS)
+
+@router.post("/batch")
+async def batch_reads(body: BatchRequest, request: Request):
+    """Run several GETs concurrently; per sub-request status and body, in order."""
+    return {"responses": await run_batch(request, router.routes, body.requests)}
+
+
+# ----- global change feed (see changes.py) -----
+
+@router.get("/changes")
+async def list_changes(
+    since: int = Query(0, ge=0),
+    wait: float = Query(0, ge=0, le=CHANGES_MAX_WAIT),
+    limit: int = Query(CHANGES_PAGE_SIZE, ge=1, le=CHANGES_PAGE_SIZE),
+):
+    return await change_stream.wait(current_program(), since, limit, wait)
+
+
+# ----- changes from other instances (Postgres LISTEN/NOTIFY, see notify.py) -----
+
+@change_feed.subscribe
+async def apply_remote_change(message: dict, remote: bool):
+    # another instance wrote: drop what this one holds for that match
+    if not remote:
+        return
+    if message["op"] == "RESYNC":
+        response_cache.clear()
+        await snapshot_store.load_ids()
+        await projection.load()
+        return
+    table, row_id, match_id = message["table"], message["id"], message["match_id"]
+    if table == "match_snapshots":
+        await snapshot_store.reload(match_id)
+        return
+    with program_context(message["program"]):
+        _invalidate_match(match_id, schedule=table == "matches")
+        if message["op"] == "DELETE":
+            if table == "matches":
+                search_index.remove("match", match_id)
+                _analytics().drop_match(match_id)
+                projection.drop_match(match_id)
+                _forget_win_probability(match_id=match_id)
+            else:
+                search_index.remove("line", row_id)
+                projection.drop_line(row_id)
+                _forget_win_probability(score_id=row_id)
+            return
+        if table == "scores":
+            row = await database.fetch_one(select(scores_tbl).where(scores_tbl.c.id == row_id))
+            if row:
+                search_index.add_line(row)
+                projection.apply_lines([row])
+        else:
+            row = await database.fetch_one(matches.select().where(matches.c.id == match_id))
+            await projection.apply_match(row)
+            if row:
+                search_index.add_match(row)
+                if str(row["status"] or "").lower() == "completed":
+                    await _analytics().refresh_match(match_id)
+                    _forget_win_probability(match_id=match_id)
+                elif "analytics" in sys.modules:
+                    # reopened there: its snapshot row is gone too (match_snapshots above)
+                    _analytics().drop_match(match_id)
+
+
+# ----- background jobs (see scheduler.py) -----
+# minutes before a scheduled start to warm caches / precompute for it
+PREWARM_MINUTES = int(os.getenv("PREWARM_MINUTES", "30"))
+# a "scheduled" match this many minutes past its start gets flag="overdue"
+OVERDUE_GRACE_MINUTES = int(os.getenv("OVERDUE_GRACE_MINUTES", "15"))
+
+@scheduler.every(60, lease=False)  # caches are per process, so every worker warms its own
+async def prewarm_upcoming():
+    now = datetime.utcnow()
+    rows = await database.fetch_all(
+        select(matches.c.program, matches.c.gender)
+        .where(func.lower(matches.c.status) == "scheduled")
+        .where(matches.c.date.between(now, now + timedelta(minutes=PREWARM_MINUTES)))
+        .distinct()
+    )
+    if not rows:
+        return
+    # live scoring needs the probability tables, the dashboard needs history
+    wp = _winprob()
+    for fmt in wp.FORMATS.values():
+        wp.tables(fmt)
+    await _analytics().ensure_loaded()
+    for r in rows:
+        with program_context(r["program"]):
+            for gender in (None, r["gender"]):
+                await cached_entry(_schedule_key(None, gender), ["schedule"], lambda g=gender: _schedule_rows(None, g))
+                await cached_entry(_players_key(gender), ["players"], lambda g=gender: _player_rows(g))
+
+@scheduler.every(60)
+async def flag_overdue_matches():
+    cutoff = datetime.utcnow() - timedelta(minutes=OVERDUE_GRACE_MINUTES)
+    rows = await database.fetch_all(
+        select(matches.c.id, matches.c.program)
+        .where(func.lower(matches.c.status) == "scheduled")
+        .where(matches.c.date < cutoff)
+        .where(matches.c.flag.is_(None))
+    )
+    if not rows:
+        return
+    await database.execute(
+        matches.update().where(matches.c.id.in_([r["id"] for r in rows])).values(flag="overdue", version=matches.c.version + 1)
+    )
+    for r in rows:
+        with program_context(r["program"]):
+            _invalidate_match(r["id"], schedule=True)
+    await projection.refresh_matches([r["id"] for r in rows])
+    logger.info("Flagged %d overdue match(es): %s", len(rows), [r["id"] for r in rows])
+
+@scheduler.every(600)
+async def snapshot_completed_matches():
+    # completed through a path that didn't snapshot (e.g. PUT status, old data)
+    rows = await database.fetch_all(
+        select(matches.c.id, matches.c.program)
+        .where(func.lower(matches.c.status) == "completed")
+        .where(~matches.c.id.in_(select(match_snapshots.c.match_id)))
+        .limit(50)
+    )
+    for r in rows:
+        with program_context(r["program"]):
+            await _refresh_snapshot(r["id"])
+
+@scheduler.every(300)
+async def checkpoint_sqlite_wal():
+    if IS_SQLITE:
+        await database.fetch_one("PRAGMA wal_checkpoint(TRUNCATE)")
+
+@scheduler.every(3600)
+async def purge_idempotency_keys():
+    cutoff = datetime.utcnow() - timedelta(hours=IDEMPOTENCY_KEY_TTL_HOURS)
+    await database.execute(idempotency_keys.delete().where(idempotency_keys.c.created_at < cutoff))
+
+@scheduler.every(3600)
+async def purge_change_log():
+    await change_stream.purge()
+
+@scheduler.every(PROJECTION_CHECK_SECONDS, lease=False)  # each process checks its own copy
+async def check_projection():
+    repaired = await projection.check()
+    if repaired:
+        logger.info("Projection: reloaded %d match(es) that differed from the database", repaired)
+
+@scheduler.every(60, lease=False)
+async def expire_response_cache():
+    response_cache.expire()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # engine creation + schema check happen here, once, not on import
+    await run_in_threadpool(init_schema)
+    await run_in_threadpool(archives.load)
+    await database.connect()
+    await snapshot_store.load_ids()
+    await projection.load()
+    await search_index.rebuild()
+    packed = await backfill_legacy_momentum(_coerce_sets)
+    if packed:
+        logger.info("Packed legacy momentum rows for %d line(s)", packed)
+    built = await rebuild_records_if_empty()
+    if built:
+        logger.info("Built %d team record(s)", built)
+    app.state.ready = True
+    scheduler.start()
+    change_feed.start()
+    comment_buffer.start()
+    try:
+        yield
+    finally:
+        app.state.ready = False
+        await comment_buffer.stop()
+        await change_feed.stop()
+        await scheduler.stop()
+        await database.disconnect()
+
+
+def create_app() -> FastAPI:
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(levelname)s %(name)s: %(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    app = FastAPI(lifespan=lifespan)
+    app.state.ready = False
+
+    # which program (tenant) the request is for; 404s unknown programs
+    app.add_middleware(ProgramMiddleware)
+
+    # rate limits + load shedding; inside CORS so rejections still get CORS headers
+    app.add_middleware(AdmissionMiddleware, is_admin=_is_admin_token)
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=[
+            "http://localhost:3000",  # Local React development server
+            "http://127.0.0.1:3000",  # Alternative localhost
+            "https://saint-leo-live-scores.onrender.com",
+            "https://saint-leo-live-score.onrender.com",
+        ],
+        allow_credentials=True,  # Correct argument name
+        allow_methods=["*"],  # Allow all HTTP methods
+        allow_headers=["*"],  # Allow all headers
+        expose_headers=["X-Query-Count", "X-Query-Time-Ms"],
+    )
+
+    # gzip/br for read endpoints that aren't served from the response cache
+    app.add_middleware(CompressionMiddleware)
+
+    # per-request query counts/timings, slow-query log, N+1 warnings
+    app.add_middleware(QueryStatsMiddleware)
+
+    app.include_router(router)
+    return app
+
+
+app = create_app()
@@ -0,0 +1,39 @@
+# metrics.py
+# Tiny in-process metrics registry, exposed as JSON on GET /metrics.
+#
+#   metrics.inc("admission.rate_limited", route="/scores/{id}/comments")
+#   metrics.gauge("response_cache.entries", lambda: len(response_cache))
+from collections import defaultdict
+from typing import Callable, Dict
+
+
+def _key(name: str, labels: dict) -> str:
+    if not labels:
+        return name
+    inner = ",".join(f"{k}={labels[k]}" for k in sorted(labels))
+    return f"{name}{{{inner}}}"
+
+
+class Metrics:
+    def __init__(self):
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.gauges: Dict[str, Callable[[], float]] = {}
+
+    def inc(self, name: str, n: int = 1, **labels):
+        self.counters[_key(name, labels)] += n
+
+    def gauge(self, name: str, fn: Callable[[], float]):
+        """Register a callable sampled every time metrics are read."""
+        self.gauges[name] = fn
+
+    def snapshot(self) -> dict:
+        gauges = {}
+        for name, fn in self.gauges.items():
+            try:
+                gauges[name] = fn()
+            except Exception as e:  # a broken gauge shouldn't break /metrics
+                gauges[name] = f"error: {e}"
+        return {"counters": dict(self.counters), "gauges": gauges}
+
+
+metrics = Metrics()
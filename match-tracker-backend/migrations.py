@@ -0,0 +1,200 @@
+# migrations.py
+# metadata.create_all() only creates missing *tables*. Databases created
+# before a column or index was added to models.py need it added in place;
+# upgrade() does that, additively and idempotently, at startup. An index whose
+# uniqueness changed is dropped and recreated in one transaction.
+#
+# Only nullable columns or columns with a server_default can be added this
+# way (SQLite and Postgres both need a value for existing rows).
+from sqlalchemy import inspect, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.schema import CreateColumn
+
+
+def ensure_columns(engine, metadata):
+    insp = inspect(engine)
+    existing_tables = set(insp.get_table_names())
+    added = []
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            have = {c["name"] for c in insp.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in have:
+                    continue
+                if not column.nullable and column.server_default is None:
+                    raise RuntimeError(
+                        f"Can't add NOT NULL column {table.name}.{column.name} without a server_default"
+                    )
+                ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+                added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def ensure_indexes(engine, metadata):
+    """Create missing indexes, and rebuild ones whose uniqueness models.py changed
+    (users.email went from unique to unique per program)."""
+    insp = inspect(engine)
+    existing_tables = set(insp.get_table_names())
+    created = []
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        have = {ix["name"]: bool(ix["unique"]) for ix in insp.get_indexes(table.name)}
+        # loosen first, so a (program, email) index never coexists with a global one
+        for index in sorted(table.indexes, key=lambda ix: bool(ix.unique)):
+            if index.name in have and have[index.name] == bool(index.unique):
+                continue
+            with engine.begin() as conn:
+                if index.name in have:
+                    index.drop(bind=conn)
+                index.create(bind=conn)
+            created.append(index.name)
+    return created
+
+
+def ensure_jsonb(engine, metadata):
+    """Postgres: convert json columns that models.py now declares as JSONB."""
+    if engine.dialect.name != "postgresql":
+        return []
+    insp = inspect(engine)
+    existing_tables = set(insp.get_table_names())
+    converted = []
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            have = {c["name"]: c["type"] for c in insp.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in have or isinstance(have[column.name], JSONB):
+                    continue
+                if isinstance(column.type.dialect_impl(engine.dialect), JSONB):
+                    conn.execute(text(
+                        f"ALTER TABLE {table.name} ALTER COLUMN {column.name} TYPE jsonb USING {column.name}::jsonb"
+                    ))
+                    converted.append(f"{table.name}.{column.name}")
+    return converted
+
+
+# table -> (id column, match id column) in the change notifications
+NOTIFY_TABLES = {
+    "matches": ("id", "id"),
+    "scores": ("id", "match_id"),
+    "match_snapshots": ("match_id", "match_id"),
+}
+
+
+def ensure_notify_triggers(engine, channel):
+    """Postgres: NOTIFY `channel` after every insert/update/delete on NOTIFY_TABLES.
+
+    Payload: {"table", "op", "id", "match_id", "program", "origin"}, where
+    origin is the writer's application_name. Sent on commit, never for a
+    rolled-back write. Idempotent (replaces the function and triggers).
+    """
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE OR REPLACE FUNCTION notify_match_change() RETURNS trigger AS $$
+            DECLARE r jsonb;
+            BEGIN
+                IF TG_OP = 'DELETE' THEN r := to_jsonb(OLD); ELSE r := to_jsonb(NEW); END IF;
+                PERFORM pg_notify(TG_ARGV[0], json_build_object(
+                    'table', TG_TABLE_NAME,
+                    'op', TG_OP,
+                    'id', (r ->> TG_ARGV[1])::int,
+                    'match_id', (r ->> TG_ARGV[2])::int,
+                    'program', r ->> 'program',
+                    'origin', current_setting('application_name')
+                )::text);
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+        """))
+        for table, (id_col, match_col) in NOTIFY_TABLES.items():
+            trigger = f"{table}_notify_change"
+            conn.execute(text(f"DROP TRIGGER IF EXISTS {trigger} ON {table}"))
+            conn.execute(text(
+                f"CREATE TRIGGER {trigger} AFTER INSERT OR UPDATE OR DELETE ON {table} "
+                f"FOR EACH ROW EXECUTE FUNCTION notify_match_change('{channel}', '{id_col}', '{match_col}')"
+            ))
+
+
+# table -> (entity, entity id, match id, program, version) as SQL over the
+# written row, {row} being NEW or OLD. Lines' children look their match and
+# program up on the line, which is deleted after them.
+_LINE = "(SELECT {col} FROM scores WHERE id = {row}.score_id)"
+CHANGE_LOG_TABLES = {
+    "matches": ("match", "{row}.id", "{row}.id", "{row}.program", "{row}.version"),
+    "scores": ("score", "{row}.id", "{row}.match_id", "{row}.program", "{row}.version"),
+    "players": ("player", "{row}.id", "NULL", "{row}.program", "NULL"),
+    "comments": ("comment", "{row}.id", _LINE.replace("{col}", "match_id"), "{row}.program", "NULL"),
+    "momentum_series": (
+        "momentum", "{row}.score_id", _LINE.replace("{col}", "match_id"), _LINE.replace("{col}", "program"),
+        "{row}.version",
+    ),
+}
+
+
+def _change_log_insert(table, row, op, now):
+    # op and now are SQL expressions
+    entity, entity_id, match_id, program, version = (
+        part.replace("{row}", row) for part in CHANGE_LOG_TABLES[table]
+    )
+    return (
+        "INSERT INTO change_log (program, entity, entity_id, match_id, op, version, created_at) "
+        f"VALUES ({program}, '{entity}', {entity_id}, {match_id}, {op}, {version}, {now})"
+    )
+
+
+def ensure_change_log_triggers(engine):
+    """Append a change_log row for every insert/update/delete on CHANGE_LOG_TABLES.
+
+    The row is written by the same transaction as the change, so the log
+    holds exactly the committed writes. Row-level only: an UPDATE that
+    matches nothing logs nothing. On Postgres writers run concurrently, so
+    seq order is not commit order; changes.py only hands out seqs once every
+    transaction that could still commit a lower one has finished. (SQLite
+    has one writer.) Idempotent (replaces the triggers).
+    """
+    with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            now = "(now() AT TIME ZONE 'utc')"
+            for table in CHANGE_LOG_TABLES:
+                conn.execute(text(f"""
+                    CREATE OR REPLACE FUNCTION {table}_log_change() RETURNS trigger AS $$
+                    BEGIN
+                        IF TG_OP = 'DELETE' THEN
+                            {_change_log_insert(table, "OLD", "lower(TG_OP)", now)};
+                        ELSE
+                            {_change_log_insert(table, "NEW", "lower(TG_OP)", now)};
+                        END IF;
+                        RETURN NULL;
+                    END
+                    $$ LANGUAGE plpgsql
+                """))
+                # {table}_change_lock: the statement-level lock trigger of old versions
+                for trigger in (f"{table}_change_lock", f"{table}_change_log"):
+                    conn.execute(text(f"DROP TRIGGER IF EXISTS {trigger} ON {table}"))
+                conn.execute(text(
+                    f"CREATE TRIGGER {table}_change_log AFTER INSERT OR UPDATE OR DELETE ON {table} "
+                    f"FOR EACH ROW EXECUTE FUNCTION {table}_log_change()"
+                ))
+            conn.execute(text("DROP FUNCTION IF EXISTS change_log_lock()"))
+        else:
+            for table in CHANGE_LOG_TABLES:
+                for op, row in (("insert", "NEW"), ("update", "NEW"), ("delete", "OLD")):
+                    trigger = f"{table}_change_log_{op}"
+                    conn.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+                    conn.execute(text(
+                        f"CREATE TRIGGER {trigger} AFTER {op.upper()} ON {table} BEGIN "
+                        f"{_change_log_insert(table, row, repr(op), 'CURRENT_TIMESTAMP')}; END"
+                    ))
+
+
+def upgrade(engine, metadata):
+    added = ensure_columns(engine, metadata)
+    created = ensure_indexes(engine, metadata)
+    converted = ensure_jsonb(engine, metadata)
+    if added or created or converted:
+        print(f"Schema upgrade: added columns {added or '-'}, indexes {created or '-'}, jsonb {converted or '-'}")
@@ -1,36 +1,53 @@
 from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, JSON,ForeignKey
-from sqlalchemy import create_engine
-from databases import Database
+from sqlalchemy.dialects.postgresql import JSONB
 from typing import Optional
 from pydantic import BaseModel
 from typing import List
 import sqlalchemy as sa
-DATABASE_URL = "sqlite:///./matches.db"
-
-database = Database(DATABASE_URL)
-engine = create_engine(DATABASE_URL)
+from tenancy import DEFAULT_PROGRAM
+# Engines and the async `database` live in db_setup.py; this module only
+# describes tables so importing it stays cheap.
 metadata = sa.MetaData()
 
 
+# JSON everywhere, stored as binary JSONB on Postgres (indexable, no re-parse per read)
+JSONType = JSON().with_variant(JSONB(), "postgresql")
+
+
+def version_column():
+    # bumped on every write; stale writers get a 409 (If-Match / "version")
+    return Column("version", Integer, nullable=False, server_default="1")
+
+
+def program_column():
+    # tenant key (see tenancy.py); leads the composite indexes at the bottom
+    return Column("program", String, nullable=False, default=DEFAULT_PROGRAM, server_default=DEFAULT_PROGRAM)
+
+
 matches = Table(
     "matches",
     metadata,
     Column("id", Integer, primary_key=True),
+    program_column(),
     Column("gender", String, nullable=False),
     Column("date", DateTime, nullable=False),
     Column("opponent", String, nullable=False),
     Column("location", String, nullable=True),
     Column("status", String, default="scheduled"),
-    Column("team_score", JSON, nullable=True),
-    Column("box_score", JSON, nullable=True),
+    Column("team_score", JSONType, nullable=True),
+    Column("box_score", JSONType, nullable=True),
     Column("match_number", Integer, nullable=False),  # Add match_number column
     Column("winner", String, nullable=True),  # Add winner column
+    Column("flag", String, nullable=True),  # set by the scheduler, e.g. "overdue"
+    Column("conference", Integer, nullable=True),  # 1/0; NULL: decided by opponent (records.CONFERENCE_OPPONENTS)
+    version_column(),
 )
 
 players = Table(
     "players",
     metadata,
     Column("id", Integer, primary_key=True),
+    program_column(),
     Column("name", String, nullable=False),
     Column("gender", String, nullable=False),
     Column("year", String),
@@ -74,6 +91,7 @@ scores = Table(
     "scores",
     metadata,
     Column("id", Integer, primary_key=True),
+    program_column(),
     Column("match_id", Integer, ForeignKey("matches.id"), nullable=False),  # FK to matches table
     Column("match_type", String, nullable=True),
     Column("line_no", Integer, nullable=False, default=1),
@@ -82,13 +100,13 @@ scores = Table(
     Column("player2", String, nullable=True),
     Column("opponent1", String, nullable=True),  # Ensure this column exists
     Column("opponent2", String, nullable=True),
-    Column("sets", JSON, nullable=True),       # JSON to store sets data
+    Column("sets", JSONType, nullable=True),       # JSON to store sets data
     Column("current_game", Integer, nullable=True),
+    Column("points", JSONType, nullable=True),  # [team, opp] in the current game/tiebreak (scoring.py)
     Column("started", Integer, nullable=False, default=0),  # Use Integer for boolean (0 = False, 1 = True)
     Column("current_serve", String, nullable=True),  # 0 for player1, 1 for player2
     Column("winner", String),
-    
-    
+    version_column(),
 )
 scores_tbl = scores
 class UpdateScore(BaseModel):
@@ -110,7 +128,8 @@ users = sa.Table(
     "users",
     metadata,
     sa.Column("id", sa.Integer, primary_key=True),
-    sa.Column("email", sa.String, nullable=False, unique=True, index=True),
+    program_column(),
+    sa.Column("email", sa.String, nullable=False, index=True),  # unique per program, see below
     sa.Column("password_hash", sa.String, nullable=False),
     sa.Column("first_name", sa.String, nullable=False),
     sa.Column("last_name", sa.String, nullable=False),
@@ -122,6 +141,7 @@ comments = Table(
     "comments",
     metadata,
     Column("id", Integer, primary_key=True),
+    program_column(),
     Column("user_id", Integer, ForeignKey("users.id"), nullable=True),  # Allow NULL for anonymous comments
     Column("score_id", Integer, ForeignKey("scores.id"), nullable=False),
     Column("text", String, nullable=False),
@@ -140,3 +160,110 @@ momentum = Table(
     Column("timestamp", DateTime, nullable=False),
     extend_existing=True,
 )
+
+# Frozen, pre-serialized copy of a completed match (match row, lines,
+# momentum series, comment counts). Written by complete_match, rewritten
+# only when an admin edits the match afterwards.
+match_snapshots = Table(
+    "match_snapshots",
+    metadata,
+    Column("match_id", Integer, ForeignKey("matches.id"), primary_key=True),
+    Column("version", Integer, nullable=False, default=1),
+    Column("body", sa.Text, nullable=False),  # JSON text
+    Column("created_at", DateTime, nullable=False),
+)
+
+# One row per line: the whole momentum series packed into a blob.
+#   data       -> array('b'), cumulative momentum after each game (index = game number)
+#   set_starts -> array('H', little-endian), game numbers where a new set reset momentum
+#   times      -> array('I', little-endian), when each game was recorded (Unix
+#                 seconds, UTC; 0 = unknown). NULL for series packed before it existed
+# Replaces the row-per-game `momentum` table, which is only read to backfill.
+momentum_series = Table(
+    "momentum_series",
+    metadata,
+    Column("score_id", Integer, ForeignKey("scores.id"), primary_key=True),
+    Column("data", sa.LargeBinary, nullable=False),
+    Column("set_starts", sa.LargeBinary, nullable=False),
+    Column("times", sa.LargeBinary, nullable=True),
+    Column("updated_at", DateTime, nullable=False),  # last append
+    version_column(),  # compare-and-swap for concurrent appends (momentum_store.save_series)
+)
+
+# One row per background job (see scheduler.py): whoever holds an unexpired
+# lease is the only worker running that job.
+job_leases = Table(
+    "job_leases",
+    metadata,
+    Column("name", String, primary_key=True),
+    Column("owner", String, nullable=False),
+    Column("expires_at", DateTime, nullable=False),
+)
+
+# Client-supplied keys for POST /scores/sync: a mutation whose key is already
+# here was applied (or rejected) before and is answered from `result` instead.
+idempotency_keys = Table(
+    "idempotency_keys",
+    metadata,
+    Column("program", String, primary_key=True),
+    Column("key", String, primary_key=True),
+    Column("op", String, nullable=False),
+    Column("score_id", Integer, nullable=True),
+    Column("status", String, nullable=False),  # "applied" | "rejected" | "pending" (claimed, not yet committed)
+    Column("result", sa.Text, nullable=False),  # JSON of the original response entry
+    Column("client_ts", DateTime, nullable=True),
+    Column("created_at", DateTime, nullable=False, index=True),
+)
+
+# Global change feed (see changes.py): one row per written row of matches,
+# scores, players, comments and momentum_series, appended by triggers
+# (migrations.ensure_change_log_triggers) in the writing transaction.
+# seq is the global, monotonic cursor clients pass back as ?since=.
+change_log = Table(
+    "change_log",
+    metadata,
+    Column("seq", Integer, primary_key=True),
+    Column("program", String, nullable=True),
+    Column("entity", String, nullable=False),  # match | score | player | comment | momentum
+    Column("entity_id", Integer, nullable=False),
+    Column("match_id", Integer, nullable=True),
+    Column("op", String, nullable=False),  # insert | update | delete
+    Column("version", Integer, nullable=True),  # row version after the write (matches, scores)
+    Column("created_at", DateTime, nullable=False, index=True),
+    sqlite_autoincrement=True,  # never reuse a seq, even after purging the newest rows
+)
+
+# Season records (see records.py): one row per program, season and gender,
+# rewritten in the same transaction as the match result that changes it.
+# streak > 0 is the current winning streak, < 0 the losing one.
+team_records = Table(
+    "team_records",
+    metadata,
+    Column("program", String, primary_key=True),
+    Column("season", Integer, primary_key=True),  # spring year (archive.current_season)
+    Column("gender", String, primary_key=True),
+    Column("wins", Integer, nullable=False, default=0),
+    Column("losses", Integer, nullable=False, default=0),
+    Column("home_wins", Integer, nullable=False, default=0),
+    Column("home_losses", Integer, nullable=False, default=0),
+    Column("away_wins", Integer, nullable=False, default=0),
+    Column("away_losses", Integer, nullable=False, default=0),
+    Column("neutral_wins", Integer, nullable=False, default=0),
+    Column("neutral_losses", Integer, nullable=False, default=0),
+    Column("conference_wins", Integer, nullable=False, default=0),
+    Column("conference_losses", Integer, nullable=False, default=0),
+    Column("streak", Integer, nullable=False, default=0),
+    Column("last_match_id", Integer, nullable=True),
+    Column("last_date", DateTime, nullable=True),
+    Column("updated_at", DateTime, nullable=False),
+)
+
+# Per-program access paths: every list/lookup filters on program first, so one
+# program's rows never have to be scanned to answer another program's query.
+sa.Index("ix_matches_program_date", matches.c.program, matches.c.date)
+sa.Index("ix_matches_program_status", matches.c.program, matches.c.status)
+sa.Index("ix_players_program_gender_name", players.c.program, players.c.gender, players.c.name)
+sa.Index("ix_scores_program_match_line", scores.c.program, scores.c.match_id, scores.c.line_no)
+sa.Index("ix_users_program_email", users.c.program, users.c.email, unique=True)
+sa.Index("ix_comments_program_score_ts", comments.c.program, comments.c.score_id, comments.c.timestamp)
+sa.Index("ix_change_log_program_seq", change_log.c.program, change_log.c.seq)
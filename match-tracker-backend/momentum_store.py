@@ -0,0 +1,269 @@
+# momentum_store.py
+# Packed momentum series, one row per line (see models.momentum_series).
+#
+# A series is the cumulative momentum after every game: +1 for each game the
+# team wins, -1 for each the opponent wins, reset to 0 when a new set starts.
+# The API still exposes it as team_momentum / opp_momentum pairs.
+#
+# Per-game timestamps are packed alongside (times, 4 bytes a game). Series
+# written before that column existed have none for their older games: those
+# come back with "timestamp": null, except the last one, which gets the row's
+# updated_at.
+#
+# Writes are compare-and-swap on the row's version (save_series), so two
+# concurrent appends to one line can't lose a game.
+import sys
+from array import array
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from db_setup import database, insert_if_absent, supports_returning
+from models import momentum, momentum_series, scores
+
+
+def pack_values(values: Iterable[int]) -> bytes:
+    return array("b", (max(-127, min(127, v)) for v in values)).tobytes()
+
+
+def unpack_values(blob: bytes) -> array:
+    out = array("b")
+    out.frombytes(blob or b"")
+    return out
+
+
+def pack_starts(starts: Iterable[int]) -> bytes:
+    arr = array("H", starts)
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def unpack_starts(blob: bytes) -> array:
+    arr = array("H")
+    arr.frombytes(blob or b"")
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr
+
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def pack_times(times: Iterable[int]) -> bytes:
+    arr = array("I", times)
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def unpack_times(blob: Optional[bytes]) -> array:
+    arr = array("I")
+    arr.frombytes(blob or b"")
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr
+
+
+def to_seconds(ts: Optional[datetime]) -> int:
+    """Naive UTC datetime -> what `times` stores (0 for None)."""
+    return max(0, int((ts - EPOCH).total_seconds())) if ts else 0
+
+
+def series_to_rows(values, updated_at=None, times=None) -> List[dict]:
+    """Legacy GET /scores/{id}/momentum shape, one dict per game.
+
+    Games without a recorded time get None, except the last, which falls back
+    to the series' updated_at.
+    """
+    times = times or ()
+    last = len(values) - 1
+    rows = []
+    for i, v in enumerate(values):
+        t = times[i] if i < len(times) else 0
+        rows.append({
+            "game_number": i,
+            "team_momentum": v if v > 0 else 0,
+            "opp_momentum": -v if v < 0 else 0,
+            "timestamp": EPOCH + timedelta(seconds=t) if t else (updated_at if i == last else None),
+        })
+    return rows
+
+
+def extend_series(
+    values: array, set_starts: array, sets, winner: str, times: Optional[array] = None, now: Optional[datetime] = None,
+) -> Tuple[int, int]:
+    """Append one value per game played since the last append (same rules the
+    old row-per-game code used), and to `times` when given, `now` for each new
+    game. Mutates the arrays; returns (games_added, cumulative)."""
+    had = len(values)
+    games_per_set = [team + opp for team, opp in sets]
+    total_games = sum(games_per_set)
+
+    # which set are we in, and how many games came before it
+    games_before_current_set = 0
+    cumulative = 0
+    for set_games in games_per_set:
+        if cumulative + set_games >= total_games:
+            games_before_current_set = cumulative
+            break
+        cumulative += set_games
+
+    if values:
+        last_game_number = len(values) - 1
+        last_set_games = 0
+        for i in range(len(games_per_set)):
+            if sum(games_per_set[: i + 1]) >= last_game_number:
+                last_set_games = sum(games_per_set[:i])
+                break
+        if games_before_current_set > last_set_games:
+            # moved to a new set - momentum starts again from 0
+            cumulative = 0
+            set_starts.append(last_game_number + 1)
+        else:
+            cumulative = values[-1]
+    else:
+        last_game_number = 0
+        cumulative = 0
+        values.append(0)  # starting point
+
+    step = 1 if winner == "team" else -1
+    for _ in range(last_game_number + 1, total_games + 1):
+        cumulative = max(-127, min(127, cumulative + step))
+        values.append(cumulative)
+
+    if times is not None:
+        stamp = to_seconds(now or datetime.utcnow())
+        times.extend([0] * max(0, had - len(times)))  # games from before times were kept
+        times.extend([stamp] * (len(values) - len(times)))
+
+    return max(0, total_games - last_game_number), cumulative
+
+
+async def load_series(score_ids: Iterable[int], program: Optional[str] = None) -> Dict[int, dict]:
+    """{score_id: {"values", "set_starts", "times", "updated_at", "version"}} for every id that has a series.
+
+    With `program`, only lines belonging to that program are returned.
+    """
+    ids = list(score_ids)
+    if not ids:
+        return {}
+    q = select(momentum_series).where(momentum_series.c.score_id.in_(ids))
+    if program is not None:
+        q = q.join(scores, scores.c.id == momentum_series.c.score_id).where(scores.c.program == program)
+    rows = await database.fetch_all(q)
+    return {
+        r["score_id"]: {
+            "values": unpack_values(r["data"]),
+            "set_starts": unpack_starts(r["set_starts"]),
+            "times": unpack_times(r["times"]),
+            "updated_at": r["updated_at"],
+            "version": r["version"],
+        }
+        for r in rows
+    }
+
+
+async def save_series(
+    score_id: int, values: array, set_starts: array, version: Optional[int], times: Optional[array] = None,
+) -> bool:
+    """Write a line's series if nobody else did since it was loaded.
+
+    `version` is the one load_series returned (None: there was no row). False
+    means another writer got in first; reload and extend again. `times` is
+    left as it was when not given.
+    """
+    payload = dict(data=pack_values(values), set_starts=pack_starts(set_starts), updated_at=datetime.utcnow())
+    if times is not None:
+        payload["times"] = pack_times(times)
+    new_version = 1 if version is None else version + 1
+    if version is None:
+        stmt = insert_if_absent(momentum_series, momentum_series.c.score_id).values(
+            score_id=score_id, version=new_version, **payload
+        )
+    else:
+        stmt = (
+            momentum_series.update()
+            .where(momentum_series.c.score_id == score_id, momentum_series.c.version == version)
+            .values(version=new_version, **payload)
+        )
+    if supports_returning():
+        return await database.fetch_val(stmt.returning(momentum_series.c.score_id)) is not None
+    await database.execute(stmt)
+    # no RETURNING: it's ours if the row now holds exactly what we wrote
+    row = await database.fetch_one(
+        select(momentum_series.c.data, momentum_series.c.version).where(momentum_series.c.score_id == score_id)
+    )
+    return row is not None and row["version"] == new_version and bytes(row["data"]) == payload["data"]
+
+
+async def clear_series(score_id: int):
+    await database.execute(momentum_series.delete().where(momentum_series.c.score_id == score_id))
+    await database.execute(momentum.delete().where(momentum.c.score_id == score_id))
+
+
+def legacy_set_starts(values, sets) -> array:
+    """Where the row-per-game code reset momentum for a new set.
+
+    It reset on the first append after the score moved into a new set, so
+    with a tap per game that's the game after each finished set, and the
+    value there is +-1. A jump of more than one game is a reset wherever it
+    is (taps were skipped across a set boundary).
+    """
+    games_per_set = [team + opp for team, opp in sets]
+    starts = set()
+    played = 0
+    for games in games_per_set[:-1]:
+        played += games
+        if played + 1 < len(values) and abs(values[played + 1]) == 1:
+            starts.add(played + 1)
+    for i in range(1, len(values)):
+        if abs(values[i] - values[i - 1]) != 1:
+            starts.add(i)
+    return array("H", sorted(starts))
+
+
+async def backfill_legacy_momentum(coerce_sets):
+    """Pack any lines that only have row-per-game momentum (run once at startup).
+
+    `coerce_sets` turns a stored scores.sets value into [(team, opp), ...].
+    """
+    missing = await database.fetch_all(
+        select(momentum.c.score_id)
+        .where(~momentum.c.score_id.in_(select(momentum_series.c.score_id)))
+        .distinct()
+    )
+    ids = [r["score_id"] for r in missing]
+    if not ids:
+        return 0
+    rows = await database.fetch_all(
+        select(momentum)
+        .where(momentum.c.score_id.in_(ids))
+        .order_by(momentum.c.score_id.asc(), momentum.c.game_number.asc())
+    )
+    by_score: Dict[int, list] = {}
+    for r in rows:
+        by_score.setdefault(r["score_id"], []).append(r)
+    sets = {
+        r["id"]: coerce_sets(r["sets"])
+        for r in await database.fetch_all(select(scores.c.id, scores.c.sets).where(scores.c.id.in_(ids)))
+    }
+
+    now = datetime.utcnow()
+    packed = []
+    for score_id, items in by_score.items():
+        values = array("b")
+        times = array("I")
+        for r in items:
+            values.append(max(-127, min(127, (r["team_momentum"] or 0) - (r["opp_momentum"] or 0))))
+            times.append(to_seconds(r["timestamp"]))
+        packed.append({
+            "score_id": score_id,
+            "data": values.tobytes(),
+            "set_starts": pack_starts(legacy_set_starts(values, sets.get(score_id, []))),
+            "times": pack_times(times),
+            "updated_at": items[-1]["timestamp"] or now,
+        })
+    await database.execute_many(momentum_series.insert(), packed)
+    return len(packed)
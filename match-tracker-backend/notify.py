@@ -0,0 +1,109 @@
+# notify.py
+# Cross-instance change feed over Postgres LISTEN/NOTIFY.
+#
+# Triggers on matches/scores/match_snapshots (migrations.ensure_notify_triggers)
+# NOTIFY every committed write. Each app instance LISTENs on one dedicated
+# asyncpg connection and hands the messages to the subscribed handlers, so
+# in-memory state (response cache, snapshots, search index) follows writes
+# made by other instances without polling. On SQLite (one process) there is
+# nothing to listen to and the feed stays idle.
+#
+# Handlers get (message, remote): remote is False for this instance's own
+# writes, which it has already applied. After a reconnect they get
+# {"op": "RESYNC"} since notifications sent while disconnected are lost.
+import asyncio
+import json
+import os
+from typing import Awaitable, Callable, List, Optional
+
+from db_setup import INSTANCE_ID, IS_POSTGRES, NOTIFY_CHANNEL, RAW_DATABASE_URL
+from metrics import metrics
+
+NOTIFY_ENABLED = os.getenv("NOTIFY_ENABLED", "1").strip().lower() not in ("0", "false", "no", "off")
+NOTIFY_RECONNECT_SECONDS = float(os.getenv("NOTIFY_RECONNECT_SECONDS", "2"))
+
+Handler = Callable[[dict, bool], Awaitable[None]]
+
+
+class ChangeFeed:
+    def __init__(self, channel: str = NOTIFY_CHANNEL):
+        self.channel = channel
+        self._handlers: List[Handler] = []
+        self._task: Optional[asyncio.Task] = None
+        self._pending = set()  # dispatch tasks, kept referenced until done
+        self.connected = False
+        self.received = 0
+
+    def subscribe(self, fn: Handler):
+        """Decorator: call `fn(message, remote)` for every change."""
+        self._handlers.append(fn)
+        return fn
+
+    def start(self):
+        if not (IS_POSTGRES and NOTIFY_ENABLED) or self._task:
+            return
+        self._task = asyncio.get_running_loop().create_task(self._listen(), name="notify:listen")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await asyncio.gather(*self._pending, return_exceptions=True)
+
+    async def _listen(self):
+        import asyncpg  # Postgres only
+
+        dsn = RAW_DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://", 1)
+        first = True
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(dsn, server_settings={"application_name": f"{INSTANCE_ID}:listen"})
+                lost = asyncio.Event()
+                conn.add_termination_listener(lambda _conn: lost.set())
+                await conn.add_listener(self.channel, self._on_notify)
+                self.connected = True
+                if not first:
+                    self._dispatch({"op": "RESYNC"}, remote=True)
+                first = False
+                await lost.wait()
+                print("Change feed connection lost; reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                metrics.inc("notify.errors")
+                print(f"Change feed listener failed: {e!r}")
+            finally:
+                self.connected = False
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+            await asyncio.sleep(NOTIFY_RECONNECT_SECONDS)
+
+    def _on_notify(self, _conn, _pid, _channel, payload: str):
+        self.received += 1
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            return
+        self._dispatch(message, remote=message.get("origin") != INSTANCE_ID)
+
+    def _dispatch(self, message: dict, remote: bool):
+        for handler in self._handlers:
+            task = asyncio.get_running_loop().create_task(self._run(handler, message, remote))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+
+    async def _run(self, handler: Handler, message: dict, remote: bool):
+        try:
+            await handler(message, remote)
+        except Exception as e:
+            metrics.inc("notify.errors")
+            print(f"Change handler {handler.__name__} failed: {e!r}")
+
+    def status(self) -> dict:
+        return {"enabled": IS_POSTGRES and NOTIFY_ENABLED, "connected": self.connected, "received": self.received}
+
+
+change_feed = ChangeFeed()
+metrics.gauge("notify.feed", change_feed.status)
@@ -0,0 +1,332 @@
+# projection.py
+# In-memory read model of the live working set: every live match plus the
+# matches dated within PROJECTION_PAST_HOURS / PROJECTION_AHEAD_HOURS of now,
+# their lines, and those lines' comments.
+#
+# Loaded at startup and kept current in place: the write endpoints hand their
+# committed rows to apply_match / apply_lines / add_comment (no extra
+# queries), other instances' writes arrive through notify.py, and check()
+# reconciles against the database on a timer. Reads of anything in the working
+# set (match rows, lines, comments, live lists) then never touch the database.
+#
+# matches and scores rows carry `version`, so an older copy never replaces a
+# newer one: late, repeated or out-of-order applies are harmless. Callers get
+# None for anything outside the working set and read the database instead.
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+import sqlalchemy as sa
+from sqlalchemy import func, or_, select
+
+from db_setup import database
+from metrics import metrics
+from models import comments, matches, scores, users
+
+PROJECTION_ENABLED = os.getenv("PROJECTION_ENABLED", "1").strip().lower() not in ("0", "false", "no", "off")
+PROJECTION_PAST_HOURS = float(os.getenv("PROJECTION_PAST_HOURS", "24"))
+PROJECTION_AHEAD_HOURS = float(os.getenv("PROJECTION_AHEAD_HOURS", "24"))
+# how often check() compares the projection with the database
+PROJECTION_CHECK_SECONDS = float(os.getenv("PROJECTION_CHECK_SECONDS", "30"))
+
+
+def _key(value) -> str:
+    return str(value or "").lower()
+
+
+def _newer(old: Optional[dict], row) -> bool:
+    return old is None or (row["version"] or 0) >= (old["version"] or 0)
+
+
+def _comment_query():
+    # same shape (and inner join) as GET /scores/{id}/comments
+    return (
+        sa.select(
+            comments.c.id,
+            comments.c.score_id,
+            comments.c.text,
+            comments.c.timestamp,
+            users.c.first_name.label("user_first_name"),
+            users.c.role.label("user_role"),
+        )
+        .join(users, comments.c.user_id == users.c.id)
+        .order_by(comments.c.timestamp.asc(), comments.c.id.asc())
+    )
+
+
+class LiveProjection:
+    def __init__(self):
+        self.matches: Dict[int, dict] = {}
+        self.lines: Dict[int, Dict[int, dict]] = {}  # match id -> line id -> row
+        self.comments: Dict[int, List[dict]] = {}  # line id -> comments, oldest first
+        self._line_match: Dict[int, int] = {}  # line id -> match id
+        self._by_status: Dict[tuple, set] = defaultdict(set)  # (program, status) -> match ids
+        self._by_gender: Dict[tuple, set] = defaultdict(set)  # (program, gender) -> match ids
+        self.loaded = False
+        self.repairs = 0
+        self.checked_at: Optional[datetime] = None
+
+    # ----- working set -----
+
+    def _window(self):
+        now = datetime.utcnow()
+        return now - timedelta(hours=PROJECTION_PAST_HOURS), now + timedelta(hours=PROJECTION_AHEAD_HOURS)
+
+    def _in_window(self):
+        low, high = self._window()
+        return or_(func.lower(matches.c.status) == "live", matches.c.date.between(low, high))
+
+    def _qualifies(self, row) -> bool:
+        low, high = self._window()
+        return _key(row["status"]) == "live" or (row["date"] is not None and low <= row["date"] <= high)
+
+    # ----- loading -----
+
+    async def load(self):
+        """(Re)build everything from the database."""
+        if not PROJECTION_ENABLED:
+            return
+        rows = await database.fetch_all(matches.select().where(self._in_window()))
+        lines, threads = await self._fetch_lines([r["id"] for r in rows])
+        # swap in one go: readers never see a half-built projection
+        self.matches, self.lines, self.comments, self._line_match = {}, {}, {}, {}
+        self._by_status.clear()
+        self._by_gender.clear()
+        for row in rows:
+            self._put_match(dict(row))
+        for row in lines:
+            self._put_line(dict(row))
+        self.comments.update(threads)
+        self.loaded = True
+
+    async def _fetch_lines(self, match_ids: List[int]):
+        if not match_ids:
+            return [], {}
+        rows = await database.fetch_all(select(scores).where(scores.c.match_id.in_(match_ids)))
+        return rows, await self._fetch_threads([r["id"] for r in rows])
+
+    async def _fetch_threads(self, line_ids: List[int]) -> Dict[int, List[dict]]:
+        threads = {line_id: [] for line_id in line_ids}
+        if line_ids:
+            for row in await database.fetch_all(_comment_query().where(comments.c.score_id.in_(line_ids))):
+                row = dict(row)
+                threads[row.pop("score_id")].append(row)
+        return threads
+
+    async def _load_lines(self, match_ids: List[int]):
+        """Replace the lines and comments of these tracked matches."""
+        rows, threads = await self._fetch_lines(match_ids)
+        fresh = defaultdict(dict)
+        for row in rows:
+            fresh[row["match_id"]][row["id"]] = dict(row)
+        for match_id in match_ids:
+            if match_id not in self.matches:  # dropped while we were reading
+                continue
+            old = self.lines.pop(match_id, {})
+            for line_id in old.keys() - fresh[match_id].keys():
+                self._line_match.pop(line_id, None)
+                self.comments.pop(line_id, None)
+            self.lines[match_id] = {}
+            for line_id, row in fresh[match_id].items():
+                # a write applied while we were reading may be newer than what we read
+                self._put_line(row if _newer(old.get(line_id), row) else old[line_id])
+                self.comments[line_id] = threads[line_id]
+
+    async def _load_comments(self, line_ids: List[int]):
+        threads = await self._fetch_threads(line_ids)
+        for line_id, thread in threads.items():
+            if line_id in self._line_match:
+                self.comments[line_id] = thread
+
+    async def refresh_matches(self, match_ids: Iterable[int]):
+        """Re-read these matches (and their lines) from the database."""
+        if not (PROJECTION_ENABLED and self.loaded):
+            return
+        match_ids = list(match_ids)
+        if not match_ids:
+            return
+        rows = {r["id"]: r for r in await database.fetch_all(matches.select().where(matches.c.id.in_(match_ids)))}
+        for match_id in match_ids:
+            row = rows.get(match_id)
+            if row is None or not self._qualifies(row):
+                self.drop_match(match_id)
+            else:
+                self._put_match(dict(row))
+        await self._load_lines([m for m in match_ids if m in self.matches])
+
+    # ----- applying writes -----
+
+    def _put_match(self, row: dict):
+        old = self.matches.get(row["id"])
+        if old is not None:
+            self._by_status[(old["program"], _key(old["status"]))].discard(old["id"])
+            self._by_gender[(old["program"], _key(old["gender"]))].discard(old["id"])
+        self.matches[row["id"]] = row
+        self.lines.setdefault(row["id"], {})
+        self._by_status[(row["program"], _key(row["status"]))].add(row["id"])
+        self._by_gender[(row["program"], _key(row["gender"]))].add(row["id"])
+
+    def _put_line(self, row: dict):
+        self.lines[row["match_id"]][row["id"]] = row
+        self._line_match[row["id"]] = row["match_id"]
+        self.comments.setdefault(row["id"], [])
+
+    async def apply_match(self, row, lines=None):
+        """A committed match row. A match that just entered the working set gets
+        its lines loaded, unless the caller has them all (`lines`, e.g. a start)."""
+        if not (PROJECTION_ENABLED and self.loaded) or row is None:
+            return
+        if not self._qualifies(row):
+            self.drop_match(row["id"])
+            return
+        tracked = row["id"] in self.matches
+        if _newer(self.matches.get(row["id"]), row):
+            self._put_match(dict(row))
+        if lines is not None:
+            self.apply_lines(lines)
+        elif not tracked:
+            await self._load_lines([row["id"]])
+
+    def apply_lines(self, rows):
+        """Committed score rows; lines of untracked matches are ignored."""
+        if not (PROJECTION_ENABLED and self.loaded):
+            return
+        for row in rows:
+            lines = self.lines.get(row["match_id"])
+            if lines is not None and _newer(lines.get(row["id"]), row):
+                self._put_line(dict(row))
+
+    def add_comment(self, score_id: int, comment: dict):
+        thread = self.comments.get(score_id)
+        if thread is not None:
+            thread.append(comment)
+
+    def drop_match(self, match_id: int):
+        row = self.matches.pop(match_id, None)
+        if row is not None:
+            self._by_status[(row["program"], _key(row["status"]))].discard(match_id)
+            self._by_gender[(row["program"], _key(row["gender"]))].discard(match_id)
+        for line_id in self.lines.pop(match_id, {}):
+            self._line_match.pop(line_id, None)
+            self.comments.pop(line_id, None)
+
+    def drop_line(self, line_id: int):
+        match_id = self._line_match.pop(line_id, None)
+        if match_id is not None:
+            self.lines.get(match_id, {}).pop(line_id, None)
+        self.comments.pop(line_id, None)
+
+    # ----- reads (None = not in the working set, ask the database) -----
+
+    def match(self, program: str, match_id: int) -> Optional[dict]:
+        row = self.matches.get(match_id)
+        return row if row is not None and row["program"] == program else None
+
+    def match_lines(self, program: str, match_id: int) -> Optional[List[dict]]:
+        if self.match(program, match_id) is None:
+            return None
+        return sorted(self.lines[match_id].values(), key=lambda r: (r["line_no"], r["id"]))
+
+    def line(self, program: str, line_id: int) -> Optional[dict]:
+        match_id = self._line_match.get(line_id)
+        if match_id is None or self.match(program, match_id) is None:
+            return None
+        return self.lines[match_id].get(line_id)
+
+    def line_comments(self, program: str, line_id: int) -> Optional[List[dict]]:
+        match_id = self._line_match.get(line_id)
+        if match_id is None or self.match(program, match_id) is None:
+            return None
+        return self.comments.get(line_id, [])
+
+    def live_matches(self, program: str, gender: Optional[str] = None) -> Optional[List[dict]]:
+        """Every live match (all of them are tracked), newest first."""
+        if not (PROJECTION_ENABLED and self.loaded):
+            return None
+        ids = self._by_status.get((program, "live"), set())
+        if gender:
+            ids = ids & self._by_gender.get((program, _key(gender)), set())
+        return sorted((self.matches[i] for i in ids), key=lambda r: r["date"], reverse=True)
+
+    def next_upcoming(self, program: str, now: datetime) -> Optional[dict]:
+        """Earliest not-completed match from now on, if it falls inside the window."""
+        if not (PROJECTION_ENABLED and self.loaded):
+            return None
+        candidates = [
+            r for r in self.matches.values()
+            if r["program"] == program and _key(r["status"]) != "completed" and r["date"] >= now
+        ]
+        return min(candidates, key=lambda r: r["date"], default=None)
+
+    # ----- consistency -----
+
+    async def check(self) -> int:
+        """Compare versions with the database and reload whatever differs.
+
+        Catches anything the write paths and the change feed missed (writes
+        from outside the app, lost notifications, matches moving in or out of
+        the window). Returns the number of matches repaired.
+        """
+        if not (PROJECTION_ENABLED and self.loaded):
+            return 0
+        db_matches = {
+            r["id"]: r["version"]
+            for r in await database.fetch_all(select(matches.c.id, matches.c.version).where(self._in_window()))
+        }
+        stale = {m for m, v in db_matches.items() if (self.matches.get(m) or {}).get("version") != v}
+        stale |= set(self.matches) - set(db_matches)
+
+        tracked = [m for m in db_matches if m not in stale]
+        if tracked:
+            db_lines = await database.fetch_all(
+                select(scores.c.id, scores.c.match_id, scores.c.version).where(scores.c.match_id.in_(tracked))
+            )
+            seen = defaultdict(dict)
+            for r in db_lines:
+                seen[r["match_id"]][r["id"]] = r["version"]
+            for m in tracked:
+                mine = {i: r["version"] for i, r in self.lines.get(m, {}).items()}
+                if mine != seen.get(m, {}):
+                    stale.add(m)
+
+            line_ids = [i for m in tracked if m not in stale for i in self.lines.get(m, {})]
+            if line_ids:
+                counts = await database.fetch_all(
+                    _comment_query().with_only_columns(comments.c.score_id, func.count(), func.max(comments.c.id))
+                    .where(comments.c.score_id.in_(line_ids))
+                    .group_by(comments.c.score_id)
+                    .order_by(None)
+                )
+                db_threads = {r[0]: (r[1], r[2]) for r in counts}
+                drifted = [i for i in line_ids if db_threads.get(i, (0, None)) != self._thread_key(i)]
+                if drifted:
+                    metrics.inc("projection.repairs", len(drifted), kind="comments")
+                    await self._load_comments(drifted)
+
+        if stale:
+            self.repairs += len(stale)
+            metrics.inc("projection.repairs", len(stale), kind="matches")
+            await self.refresh_matches(stale)
+        self.checked_at = datetime.utcnow()
+        return len(stale)
+
+    def _thread_key(self, line_id: int):
+        # (count, newest id), as the check query computes it
+        thread = self.comments.get(line_id, [])
+        return len(thread), max((c["id"] for c in thread), default=None)
+
+    def status(self) -> dict:
+        return {
+            "enabled": PROJECTION_ENABLED,
+            "loaded": self.loaded,
+            "matches": len(self.matches),
+            "lines": len(self._line_match),
+            "comments": sum(len(c) for c in self.comments.values()),
+            "repairs": self.repairs,
+            "checked_at": self.checked_at,
+        }
+
+
+projection = LiveProjection()
+metrics.gauge("projection", projection.status)
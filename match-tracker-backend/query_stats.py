@@ -0,0 +1,189 @@
+# query_stats.py
+# Per-request SQL accounting: query counts, durations, slow-query log and a
+# simple N+1 detector. Both the async `databases` client and the sync
+# SQLAlchemy engine (used by the auth dependencies) report into the same
+# per-request counter.
+import os
+import time
+import contextvars
+import weakref
+from collections import Counter
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+# statements slower than this are printed (milliseconds)
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+# the same statement shape repeated this many times in one request looks like N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+# adds X-Query-Count / X-Query-Time-Ms response headers
+DEBUG = os.getenv("DEBUG", "").strip().lower() in ("1", "true", "yes", "on")
+# optional global budget per request (0 = off); mostly useful in test runs
+DEFAULT_QUERY_BUDGET = int(os.getenv("QUERY_BUDGET", "0"))
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.statements = Counter()
+
+    def record(self, sql: str, elapsed_ms: float):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.statements[sql] += 1
+
+    def repeated(self, threshold: int = N_PLUS_ONE_THRESHOLD):
+        return [(sql, n) for sql, n in self.statements.items() if n >= threshold]
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar("query_stats", default=None)
+# SQL text of the statement the `databases` backend just compiled (see
+# _capture_compiled); saves compiling every statement a second time for stats
+_driver_sql: contextvars.ContextVar = contextvars.ContextVar("query_stats_sql", default=None)
+_budgets: list = []
+_instrumented_engines = weakref.WeakSet()
+
+
+def current_stats():
+    return _current.get()
+
+
+def _sql_text(query) -> str:
+    if isinstance(query, str):
+        return " ".join(query.split())
+    try:
+        return " ".join(str(query).split())
+    except Exception:
+        return type(query).__name__
+
+
+def record_query(query, elapsed_ms: float):
+    stats = _current.get()
+    if stats is None and elapsed_ms < SLOW_QUERY_MS:
+        return
+    sql = _sql_text(query)
+    if stats is not None:
+        stats.record(sql, elapsed_ms)
+    if elapsed_ms >= SLOW_QUERY_MS:
+        print(f"SLOW QUERY ({elapsed_ms:.1f} ms): {sql}")
+
+
+def _timed(fn):
+    async def wrapper(query, *args, **kwargs):
+        token = _driver_sql.set(None)
+        start = time.perf_counter()
+        try:
+            return await fn(query, *args, **kwargs)
+        finally:
+            # str(query) only if the backend didn't compile it (it always does today)
+            record_query(_driver_sql.get() or query, (time.perf_counter() - start) * 1000)
+            _driver_sql.reset(token)
+
+    wrapper.__name__ = fn.__name__
+    wrapper.__wrapped__ = fn
+    return wrapper
+
+
+def _capture_compiled(conn_cls):
+    """Have the backend connection class hand us the SQL string it compiles anyway."""
+    if getattr(conn_cls, "_query_stats_capture", False):
+        return
+    compile_ = conn_cls._compile
+
+    def _compile(self, query):
+        out = compile_(self, query)
+        _driver_sql.set(out[0])
+        return out
+
+    conn_cls._compile = _compile
+    conn_cls._query_stats_capture = True
+
+
+def instrument_database(db):
+    """Wrap the `databases.Database` query methods so they report timings."""
+    if getattr(db, "_query_stats_instrumented", False):
+        return db
+    # building a backend connection object does no I/O
+    conn_cls = type(db._backend.connection())
+    if hasattr(conn_cls, "_compile"):
+        _capture_compiled(conn_cls)
+    for name in ("execute", "execute_many", "fetch_all", "fetch_one", "fetch_val"):
+        setattr(db, name, _timed(getattr(db, name)))
+    db._query_stats_instrumented = True
+    return db
+
+
+def instrument_engine(engine):
+    """Hook cursor execution on a sync SQLAlchemy engine."""
+    if engine in _instrumented_engines:
+        return engine
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["query_start"].pop()
+        record_query(statement, (time.perf_counter() - start) * 1000)
+
+    _instrumented_engines.add(engine)
+    return engine
+
+
+@contextmanager
+def query_budget(max_queries: int):
+    """Test helper: any request handled inside the block that runs more than
+    `max_queries` statements raises QueryBudgetExceeded.
+
+        with query_budget(2):
+            client.put("/scores/1", json={...})
+    """
+    _budgets.append(max_queries)
+    try:
+        yield
+    finally:
+        _budgets.pop()
+
+
+class QueryStatsMiddleware:
+    """Pure ASGI middleware that opens a QueryStats scope per HTTP request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = _current.set(stats)
+
+        async def send_wrapper(message):
+            if DEBUG and message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-query-count", str(stats.count).encode()))
+                headers.append((b"x-query-time-ms", f"{stats.total_ms:.2f}".encode()))
+                message["headers"] = headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+
+        route = getattr(scope.get("route"), "path", scope.get("path"))
+        for sql, n in stats.repeated():
+            print(f"POSSIBLE N+1 on {scope.get('method')} {route}: {n}x {sql}")
+
+        budget = _budgets[-1] if _budgets else (DEFAULT_QUERY_BUDGET or None)
+        if budget is not None and stats.count > budget:
+            raise QueryBudgetExceeded(
+                f"{scope.get('method')} {route} ran {stats.count} queries (budget {budget})"
+            )
@@ -0,0 +1,262 @@
+# records.py
+# Season W-L, home/away/neutral splits, conference record and current streak
+# per program, season and gender, kept in team_records.
+#
+# Nothing used to store these: every header that wanted "12-4 (SSC 6-1), W3"
+# had to scan the season's matches and make sense of winner strings written
+# over the years as "team", "1", "0", "opponent"... Now every write that can
+# change a result (completing a match, re-completing it with another winner,
+# reopening it, creating or deleting a completed match) calls refresh_record()
+# in its own transaction, which recounts that one season/gender from its
+# ~30 matches and rewrites the one row. Reads are a primary-key lookup.
+#
+#   python records.py rebuild     # recount every season, archived ones included
+#   python records.py show        # print the table
+#
+# Archived seasons (archive.py) are read-only, so their rows only change on a
+# rebuild. The app also rebuilds at startup when the table is empty.
+import argparse
+import asyncio
+import json
+import os
+import sys
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import func, select
+
+from archive import archives, current_season, season_bounds
+from db_setup import INTEGRITY_ERRORS, database
+from models import matches, team_records
+
+TEAM_WINNERS = {"1", "team", "home", "w", "win", "won"}
+OPP_WINNERS = {"0", "2", "opponent", "away", "l", "loss", "lost"}
+
+# a match counts toward the conference record when its `conference` column is
+# 1, or, left NULL, when the opponent is one of these (Sunshine State Conference)
+CONFERENCE_OPPONENTS = {
+    name.strip().lower()
+    for name in os.getenv(
+        "CONFERENCE_OPPONENTS",
+        "Barry,Eckerd,Embry-Riddle,Florida Southern,Florida Tech,Lynn,Nova Southeastern,Palm Beach Atlantic,"
+        "Rollins,Tampa",
+    ).split(",")
+    if name.strip()
+}
+# locations that mean a home match ("Home", "Saint Leo, FL", ...)
+HOME_LOCATIONS = {
+    name.strip().lower() for name in os.getenv("HOME_LOCATIONS", "home,saint leo,st. leo,st leo").split(",") if name.strip()
+}
+
+SPLITS = ("home", "away", "neutral")
+
+
+def normalize_winner(value) -> Optional[str]:
+    """Any winner encoding the app has stored -> "team" | "opponent" | None."""
+    w = str(value or "").strip().lower()
+    if w in TEAM_WINNERS:
+        return "team"
+    if w in OPP_WINNERS:
+        return "opponent"
+    return None
+
+
+def match_outcome(row) -> Optional[str]:
+    """Who won a completed match: its winner, else its team_score; None if neither says."""
+    outcome = normalize_winner(row["winner"])
+    if outcome is not None:
+        return outcome
+    score = row["team_score"]
+    if isinstance(score, str):
+        try:
+            score = json.loads(score)
+        except ValueError:
+            score = None
+    if isinstance(score, dict):
+        team, opp = score.get("team") or 0, score.get("opponent") or 0
+        if team != opp:
+            return "team" if team > opp else "opponent"
+    return None
+
+
+def split_of(location) -> str:
+    where = str(location or "").strip().lower()
+    if "neutral" in where:
+        return "neutral"
+    if any(home in where for home in HOME_LOCATIONS):
+        return "home"
+    return "away"
+
+
+def is_conference(row) -> bool:
+    if row["conference"] is not None:
+        return bool(row["conference"])
+    return str(row["opponent"] or "").strip().lower() in CONFERENCE_OPPONENTS
+
+
+def _empty(program: str, season: int, gender: str) -> dict:
+    record = {"program": program, "season": season, "gender": gender, "wins": 0, "losses": 0,
+              "conference_wins": 0, "conference_losses": 0, "streak": 0,
+              "last_match_id": None, "last_date": None}
+    for split in SPLITS:
+        record[f"{split}_wins"] = record[f"{split}_losses"] = 0
+    return record
+
+
+def tally(program: str, season: int, gender: str, rows: Iterable) -> dict:
+    """One team_records row from a season's completed matches (any order)."""
+    record = _empty(program, season, gender)
+    for row in sorted(rows, key=lambda r: (r["date"], r["id"])):
+        outcome = match_outcome(row)
+        if outcome is None:
+            continue
+        suffix = "wins" if outcome == "team" else "losses"
+        record[suffix] += 1
+        record[f"{split_of(row['location'])}_{suffix}"] += 1
+        if is_conference(row):
+            record[f"conference_{suffix}"] += 1
+        step = 1 if outcome == "team" else -1
+        record["streak"] = record["streak"] + step if record["streak"] * step > 0 else step
+        record["last_match_id"], record["last_date"] = row["id"], row["date"]
+    return record
+
+
+def _columns(t=matches):
+    return (t.c.id, t.c.program, t.c.gender, t.c.date, t.c.location, t.c.opponent,
+            t.c.conference, t.c.winner, t.c.team_score)
+
+
+def _completed(t):
+    return func.lower(t.c.status) == "completed"
+
+
+async def refresh_record(row):
+    """Recount the season/gender of match `row` (program, gender, date). Call inside the writing transaction."""
+    if row is None or row["date"] is None:
+        return
+    season = current_season(row["date"])
+    if season in archives.files:
+        return  # frozen; see the header
+    program, gender = row["program"], str(row["gender"] or "").strip().lower()
+    key = [team_records.c.program == program, team_records.c.season == season, team_records.c.gender == gender]
+    now = datetime.utcnow()
+    # touch the row first: takes its lock, so two results landing in the same
+    # season recount one after the other (and, on SQLite, writes before reading)
+    await database.execute(team_records.update().where(*key).values(updated_at=now))
+    start, end = season_bounds(season)
+    rows = await database.fetch_all(
+        select(*_columns())
+        .where(matches.c.program == program, func.lower(matches.c.gender) == gender)
+        .where(matches.c.date >= start, matches.c.date < end, _completed(matches))
+    )
+    record = tally(program, season, gender, rows)
+    if await database.fetch_val(select(func.count()).select_from(team_records).where(*key)):
+        await database.execute(team_records.update().where(*key).values(**record, updated_at=now))
+    else:
+        await database.execute(team_records.insert().values(**record, updated_at=now))
+
+
+async def rebuild(program: Optional[str] = None) -> int:
+    """Recount every season from scratch (hot and archived). Returns the number of rows written."""
+    def query(t):
+        q = select(*_columns(t["matches"])).where(_completed(t["matches"]))
+        return q.where(t["matches"].c.program == program) if program else q
+
+    groups: Dict[tuple, list] = {}
+    for row in await archives.fetch_all_seasons(query):
+        if row["date"] is None:
+            continue
+        key = (row["program"], current_season(row["date"]), str(row["gender"] or "").strip().lower())
+        groups.setdefault(key, []).append(row)
+
+    records = [tally(*key, rows) for key, rows in groups.items()]
+    now = datetime.utcnow()
+    async with database.transaction():
+        clear = team_records.delete()
+        if program:
+            clear = clear.where(team_records.c.program == program)
+        await database.execute(clear)
+        if records:
+            await database.execute(team_records.insert().values([{**r, "updated_at": now} for r in records]))
+    return len(records)
+
+
+async def rebuild_if_empty() -> int:
+    """Startup backfill for databases created before team_records existed."""
+    if await database.fetch_val(select(func.count()).select_from(team_records)):
+        return 0
+    try:
+        return await rebuild()
+    except INTEGRITY_ERRORS:
+        return 0  # another instance starting alongside built them first
+
+
+def view(row) -> dict:
+    out = {
+        "season": row["season"],
+        "gender": row["gender"],
+        "overall": {"wins": row["wins"], "losses": row["losses"]},
+        "conference": {"wins": row["conference_wins"], "losses": row["conference_losses"]},
+        "streak": _streak_label(row["streak"]),
+        "last_match_id": row["last_match_id"],
+        "last_date": row["last_date"],
+    }
+    for split in SPLITS:
+        out[split] = {"wins": row[f"{split}_wins"], "losses": row[f"{split}_losses"]}
+    return out
+
+
+def _streak_label(streak: int) -> Optional[str]:
+    if not streak:
+        return None
+    return f"{'W' if streak > 0 else 'L'}{abs(streak)}"
+
+
+async def fetch_records(program: str, season: Optional[int] = None, gender: Optional[str] = None) -> list:
+    """One season's records (default: the program's latest season with a result)."""
+    mine = team_records.c.program == program
+    if season is None:
+        season = select(func.max(team_records.c.season)).where(mine).scalar_subquery()
+    q = select(team_records).where(mine, team_records.c.season == season)
+    if gender:
+        q = q.where(team_records.c.gender == gender.strip().lower())
+    return [view(r) for r in await database.fetch_all(q.order_by(team_records.c.gender.asc()))]
+
+
+# ----- CLI -----
+
+async def _run(args):
+    await database.connect()
+    try:
+        if args.command == "rebuild":
+            n = await rebuild(args.program)
+            print(f"Rebuilt {n} team record(s)")
+        else:
+            for r in await database.fetch_all(
+                select(team_records).order_by(team_records.c.program, team_records.c.season, team_records.c.gender)
+            ):
+                v = view(r)
+                print(f"{r['program']} {r['season']} {r['gender']}: {r['wins']}-{r['losses']}"
+                      f" (conf {r['conference_wins']}-{r['conference_losses']},"
+                      f" home {r['home_wins']}-{r['home_losses']}, away {r['away_wins']}-{r['away_losses']})"
+                      f" {v['streak'] or ''}")
+    finally:
+        await database.disconnect()
+
+
+def _main(argv=None):
+    parser = argparse.ArgumentParser(description="Materialized team season records.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rb = sub.add_parser("rebuild", help="recount every season from the matches (archives included)")
+    rb.add_argument("--program", help="only this program")
+    sub.add_parser("show", help="print the records")
+    args = parser.parse_args(argv)
+
+    from db_setup import init_schema
+    init_schema()
+    archives.load()
+    asyncio.run(_run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(_main())
@@ -0,0 +1,423 @@
+# replay.py
+# Re-drive completed matches through the live endpoints, faster than real
+# time, to load-test the live paths between seasons.
+#
+#   python replay.py 42                              # replay match 42 once, real time
+#   python replay.py 42 57 --copies 5 --speed 50     # ten matches at once, 50x
+#   python replay.py 42 --base-url http://localhost:8000 --email a@b.c --password ...
+#
+# For every source match it reads the recorded history over the API (final
+# line scores, each line's momentum series, comment timestamps), creates a new
+# match "<opponent> (replay)" dated now, starts it with the same lineup and
+# then plays it back on a schedule:
+#   * doubles lines first, then singles, one game every GAME_MINUTES
+#     (--game-minutes) of match time; each game is PUT /scores/{id} with the
+#     sets so far plus POST /scores/{id}/momentum, the order of games within a
+#     set coming from the momentum series when it agrees with the final score
+#   * lines are started and completed, and the match completed, like the
+#     admin page does it
+#   * comments are re-posted at their original offset into the match (needs
+#     --email/--password; skipped otherwise)
+# Score history isn't stored write by write, so game times are evenly spaced.
+#
+# A viewer per replayed match polls GET /scores/match/{id} (and the comment
+# threads it is waiting on) every --poll-ms and records when each write
+# becomes visible. The report gives write latency per endpoint, write-to-
+# visible latency and how far behind schedule the driver ran (if that grows,
+# the client, not the server, is the bottleneck). Replayed matches are deleted
+# afterwards unless --keep.
+#
+# Stdlib only (urllib in a thread pool), like benchmarks.py. Point the server
+# at a scratch database, and run it with RATE_LIMIT_ENABLED=0 or expect 429s.
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+GAME_MINUTES = 4.5
+DOUBLES_GAME_MINUTES = 3.5
+
+
+class Api:
+    def __init__(self, base_url: str, program: Optional[str] = None, timeout: float = 30):
+        self.base_url = base_url.rstrip("/")
+        self.headers = {"Content-Type": "application/json"}
+        if program:
+            self.headers["X-Program"] = program
+        self.timeout = timeout
+        self.latency: Dict[str, List[float]] = defaultdict(list)  # "POST /scores/{id}/momentum" -> ms
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+
+    def _call(self, method: str, path: str, body=None, form=None, headers=None) -> Tuple[int, object]:
+        headers = {**self.headers, **(headers or {})}
+        data = None
+        if form is not None:
+            data = urllib.parse.urlencode(form).encode()
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        elif body is not None:
+            data = json.dumps(body).encode()
+        req = urllib.request.Request(self.base_url + path, data=data, method=method, headers=headers)
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                status, raw = resp.status, resp.read()
+        except urllib.error.HTTPError as e:
+            status, raw = e.code, e.read()
+        try:
+            return status, json.loads(raw) if raw else None
+        except ValueError:
+            return status, raw.decode("utf-8", "replace")
+
+    async def call(self, method: str, path: str, route: Optional[str] = None, **kwargs):
+        start = time.perf_counter()
+        status, data = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: self._call(method, path, **kwargs)
+        )
+        key = f"{method} {route or path}"
+        self.latency[key].append((time.perf_counter() - start) * 1000)
+        self.statuses[key][status] += 1
+        return status, data
+
+    async def ok(self, method: str, path: str, route: Optional[str] = None, **kwargs):
+        status, data = await self.call(method, path, route, **kwargs)
+        if status >= 400:
+            raise RuntimeError(f"{method} {path} -> {status}: {data}")
+        return data
+
+
+# ----- recorded history -> schedule -----
+
+def _side(winner) -> Optional[str]:
+    w = str(winner or "").strip().lower()
+    if w in ("1", "team"):
+        return "team"
+    if w in ("0", "2", "opponent"):
+        return "opponent"
+    return None
+
+
+def _pairs(sets) -> List[Tuple[int, int]]:
+    out = []
+    for s in sets or []:
+        if isinstance(s, dict):
+            out.append((int(s.get("team") or 0), int(s.get("opp") or 0)))
+        else:
+            out.append((int(s[0] or 0), int(s[1] or 0)))
+    return out
+
+
+def _interleave(team: int, opp: int) -> List[str]:
+    """An order for a set's games; the set's winner takes the last one."""
+    if not team + opp:
+        return []
+    last = "team" if team >= opp else "opponent"
+    left = {"team": team - (last == "team"), "opponent": opp - (last == "opponent")}
+    total = dict(left)
+    order = []
+    while left["team"] + left["opponent"]:
+        # whichever side is furthest behind its share of the games so far
+        side = max(left, key=lambda s: left[s] / total[s] if total[s] else -1)
+        left[side] -= 1
+        order.append(side)
+    return order + [last]
+
+
+def game_order(sets, values, set_starts) -> List[List[str]]:
+    """Per set, who won each game: from the momentum series where it matches the score."""
+    starts = set(set_starts or [])
+    by_momentum = [
+        "team" if values[i] > (0 if i in starts else values[i - 1]) else "opponent"
+        for i in range(1, len(values or []))
+    ]
+    out, k = [], 0
+    for team, opp in _pairs(sets):
+        n = team + opp
+        if not n:
+            continue
+        chunk = by_momentum[k:k + n]
+        k += n
+        ok = len(chunk) == n and chunk.count("team") == team
+        out.append(chunk if ok else _interleave(team, opp))
+    return out
+
+
+def _parse_ts(value) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+async def load_history(api: Api, match_id: int) -> dict:
+    match = await api.ok("GET", f"/matches/{match_id}", "/matches/{id}")
+    if str(match.get("status") or "").lower() != "completed":
+        raise SystemExit(f"Match {match_id} isn't completed")
+    lines = match.get("scores") or await api.ok("GET", f"/scores/match/{match_id}", "/scores/match/{id}")
+    momentum = {
+        m["score_id"]: m
+        for m in await api.ok("GET", f"/scores/match/{match_id}/momentum", "/scores/match/{id}/momentum")
+    }
+    threads = {}
+    for line in lines:
+        threads[line["id"]] = await api.ok("GET", f"/scores/{line['id']}/comments", "/scores/{id}/comments")
+    return {"match": match, "lines": lines, "momentum": momentum, "comments": threads}
+
+
+def build_schedule(history: dict, game_minutes: float, doubles_game_minutes: float) -> Tuple[list, float]:
+    """[(seconds into the match, kind, line key, payload)], sorted, and the match length."""
+    events = []
+    doubles_end = 0.0
+    lines = sorted(history["lines"], key=lambda l: (l["match_type"] != "doubles", l["line_no"]))
+    for line in lines:
+        key = (line["match_type"], line["line_no"])
+        m = history["momentum"].get(line["id"]) or {}
+        sets = game_order(line.get("sets"), m.get("values"), m.get("set_starts"))
+        doubles = line["match_type"] == "doubles"
+        per_game = (doubles_game_minutes if doubles else game_minutes) * 60
+        t = 0.0 if doubles else doubles_end
+        events.append((t, "start", key, None))
+        score = []
+        for set_games in sets:
+            score.append([0, 0])
+            for side in set_games:
+                t += per_game
+                score[-1][0 if side == "team" else 1] += 1
+                padded = [list(s) for s in score] + [[0, 0]] * max(0, 3 - len(score))
+                events.append((t, "game", key, {"sets": padded, "winner": side}))
+        if _side(line.get("winner")):
+            events.append((t + 1, "complete", key, _side(line.get("winner"))))
+        if doubles:
+            doubles_end = max(doubles_end, t + 1)
+    length = max([e[0] for e in events] + [1.0])
+
+    # comments at their offset into the match (squeezed in if they ran long)
+    start = _parse_ts(history["match"].get("date"))
+    posted = [
+        (_parse_ts(c.get("timestamp")), (l["match_type"], l["line_no"]), c.get("text") or "")
+        for l in history["lines"] for c in history["comments"].get(l["id"], [])
+    ]
+    posted = [p for p in posted if p[0] is not None]
+    if posted:
+        first, last = min(p[0] for p in posted), max(p[0] for p in posted)
+        if start is None or first < start or last - start > length:
+            start, scale = first, (length / (last - first) if last > first else 0.0)
+        else:
+            scale = 1.0
+        events.extend(((ts - start) * scale, "comment", key, text) for ts, key, text in posted)
+
+    events.append((length + 1, "finish", None, history["match"].get("winner")))
+    events.sort(key=lambda e: e[0])
+    return events, length + 1
+
+
+def _lineup(lines) -> dict:
+    lineup = {"doubles": [], "singles": []}
+    for l in lines:
+        if l["match_type"] == "doubles":
+            lineup["doubles"].append({k: l.get(k) for k in ("line_no", "player1", "player2", "opponent1", "opponent2")})
+        else:
+            lineup["singles"].append({k: l.get(k) for k in ("line_no", "player1", "opponent1")})
+    return lineup
+
+
+# ----- replay -----
+
+class Viewer:
+    """Polls a replayed match like a fan's browser; times when writes show up."""
+
+    def __init__(self, api: Api, match_id: int, poll_ms: float, report: "Report"):
+        self.api, self.match_id, self.poll = api, match_id, poll_ms / 1000
+        self.report = report
+        self.waiting: List[Tuple[int, int, float]] = []  # (line id, version, written at)
+        self.comments: List[Tuple[int, str, float]] = []  # (line id, text, written at)
+        self.done = False
+
+    async def run(self):
+        while not (self.done and not self.waiting and not self.comments):
+            status, rows = await self.api.call("GET", f"/scores/match/{self.match_id}", "/scores/match/{id}")
+            now = time.perf_counter()
+            if status == 200:
+                versions = {r["id"]: r.get("version") or 0 for r in rows}
+                still = []
+                for line_id, version, at in self.waiting:
+                    if versions.get(line_id, 0) >= version:
+                        self.report.visible.append((now - at) * 1000)
+                    else:
+                        still.append((line_id, version, at))
+                self.waiting = still
+            for line_id in {c[0] for c in self.comments}:
+                status, thread = await self.api.call("GET", f"/scores/{line_id}/comments", "/scores/{id}/comments")
+                now = time.perf_counter()
+                texts = [c.get("text") for c in thread] if status == 200 else []
+                still = []
+                for c in self.comments:
+                    if c[0] == line_id and c[1] in texts:
+                        texts.remove(c[1])
+                        self.report.comment_visible.append((now - c[2]) * 1000)
+                    else:
+                        still.append(c)
+                self.comments = still
+            await asyncio.sleep(self.poll)
+
+
+class Report:
+    def __init__(self):
+        self.visible: List[float] = []
+        self.comment_visible: List[float] = []
+        self.behind: List[float] = []
+        self.errors: List[str] = []
+
+
+async def replay_one(api: Api, history: dict, args, report: Report, token: Optional[str]):
+    src = history["match"]
+    events, length = build_schedule(history, args.game_minutes, args.doubles_game_minutes)
+    created = await api.ok("POST", "/schedule", body={
+        "date": datetime.now(timezone.utc).replace(tzinfo=None).isoformat(timespec="seconds"),
+        "gender": src.get("gender") or "men",
+        "opponent": f"{src.get('opponent')} (replay)",
+        "location": src.get("location") or "Replay",
+        "match_number": src.get("match_number") or 1,
+    })
+    match_id = created["id"]
+    started = await api.ok("POST", f"/schedule/{match_id}/start", "/schedule/{id}/start", body=_lineup(history["lines"]))
+    lines = {(l["match_type"], l["line_no"]): l for l in started["scores"]}
+
+    viewer = Viewer(api, match_id, args.poll_ms, report)
+    watch = asyncio.create_task(viewer.run())
+    auth = {"Authorization": f"Bearer {token}"} if token else None
+    loop = asyncio.get_running_loop()
+    t0 = loop.time()
+    try:
+        for offset, kind, key, payload in events:
+            due = t0 + offset / args.speed
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                report.behind.append(-delay * 1000)
+            line = lines.get(key) if key else None
+            try:
+                await _apply(api, kind, match_id, line, payload, viewer, auth)
+            except Exception as e:
+                report.errors.append(str(e))
+    finally:
+        viewer.done = True
+        try:
+            await asyncio.wait_for(watch, timeout=10)
+        except asyncio.TimeoutError:
+            watch.cancel()
+            report.errors.append(f"match {match_id}: {len(viewer.waiting)} writes never became visible")
+        if not args.keep:
+            await api.call("DELETE", f"/schedule/{match_id}", "/schedule/{id}")
+    return match_id, length
+
+
+async def _apply(api: Api, kind: str, match_id: int, line: Optional[dict], payload, viewer: Viewer, auth):
+    if kind == "finish":
+        await api.ok("POST", f"/schedule/{match_id}/complete", "/schedule/{id}/complete",
+                     body={"winner": payload or "team"})
+        return
+    if line is None:
+        return
+    sid = line["id"]
+    if kind == "start":
+        names = {k: line.get(k) for k in ("player1", "player2", "opponent1", "opponent2") if line.get(k)}
+        out = await api.ok("POST", f"/scores/{sid}/start", "/scores/{id}/start", body={**names, "current_serve": "0"})
+    elif kind == "game":
+        out = await api.ok("PUT", f"/scores/{sid}", "/scores/{id}", body={"sets": payload["sets"]})
+        written = time.perf_counter()
+        viewer.waiting.append((sid, out["score"]["version"], written))
+        await api.ok("POST", f"/scores/{sid}/momentum", "/scores/{id}/momentum", body={"winner": payload["winner"]})
+        return
+    elif kind == "complete":
+        out = await api.ok("POST", f"/scores/{sid}/complete", "/scores/{id}/complete", body={"winner": payload})
+    elif kind == "comment":
+        if auth is None:
+            return
+        await api.ok("POST", f"/scores/{sid}/comments", "/scores/{id}/comments", body={"text": payload}, headers=auth)
+        viewer.comments.append((sid, payload, time.perf_counter()))
+        return
+    else:
+        return
+    viewer.waiting.append((sid, out["score"]["version"], time.perf_counter()))
+
+
+def _stats(values: List[float]) -> str:
+    if not values:
+        return "-"
+    if len(values) == 1:
+        return f"n={len(values)} p50={values[0]:.1f}"
+    q = statistics.quantiles(values, n=100, method="inclusive")
+    return f"n={len(values)} p50={q[49]:.1f} p95={q[94]:.1f} p99={q[98]:.1f} max={max(values):.1f}"
+
+
+def print_report(api: Api, report: Report, wall: float):
+    print(f"\nreplay finished in {wall:.1f} s")
+    print("write latency (ms)")
+    for key in sorted(api.latency):
+        if key.startswith("GET"):
+            continue
+        codes = ", ".join(f"{c}x{n}" for c, n in sorted(api.statuses[key].items()))
+        print(f"  {key:38s} {_stats(api.latency[key])}  [{codes}]")
+    print("viewer reads (ms)")
+    for key in sorted(k for k in api.latency if k.startswith("GET")):
+        print(f"  {key:38s} {_stats(api.latency[key])}")
+    print("write -> visible to a viewer (ms, includes up to one poll interval)")
+    print(f"  scores                                 {_stats(report.visible)}")
+    print(f"  comments                               {_stats(report.comment_visible)}")
+    print(f"driver behind schedule (ms)              {_stats(report.behind)}")
+    if report.errors:
+        print(f"{len(report.errors)} error(s); first: {report.errors[0]}")
+
+
+async def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay completed matches through the live endpoints.")
+    parser.add_argument("match_ids", nargs="+", type=int, help="completed matches to replay")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--program", help="X-Program for every request")
+    parser.add_argument("--speed", type=float, default=1.0, help="speed-up over real time (50 = 50x)")
+    parser.add_argument("--copies", type=int, default=1, help="concurrent replays of each match")
+    parser.add_argument("--game-minutes", type=float, default=GAME_MINUTES, help="match time per singles game")
+    parser.add_argument("--doubles-game-minutes", type=float, default=DOUBLES_GAME_MINUTES)
+    parser.add_argument("--poll-ms", type=float, default=100, help="viewer poll interval")
+    parser.add_argument("--email", help="account to re-post comments with")
+    parser.add_argument("--password")
+    parser.add_argument("--keep", action="store_true", help="don't delete the replayed matches")
+    parser.add_argument("--threads", type=int, default=64, help="HTTP worker threads")
+    args = parser.parse_args(argv)
+
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=args.threads))
+    api = Api(args.base_url, args.program)
+    token = None
+    if args.email:
+        login = await api.ok("POST", "/auth/login", form={"username": args.email, "password": args.password or ""})
+        token = login["access_token"]
+
+    histories = [await load_history(api, mid) for mid in args.match_ids]
+    api.latency.clear()
+    api.statuses.clear()
+    report = Report()
+    jobs = [h for h in histories for _ in range(args.copies)]
+    length = max(build_schedule(h, args.game_minutes, args.doubles_game_minutes)[1] for h in histories)
+    print(f"replaying {len(jobs)} match(es) at {args.speed:g}x: "
+          f"~{length / 60:.0f} min of match time in ~{length / args.speed:.0f} s")
+    start = time.perf_counter()
+    await asyncio.gather(*(replay_one(api, h, args, report, token) for h in jobs))
+    print_report(api, report, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
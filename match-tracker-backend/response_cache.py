@@ -0,0 +1,230 @@
+# response_cache.py
+# In-process cache of serialized JSON responses.
+#
+# An entry holds the JSON bytes for one version of a resource plus, lazily,
+# one compressed copy per content-encoding. Invalidating a tag drops every
+# entry built from that data, so the next read rebuilds (and recompresses)
+# exactly once.
+#
+# Each program (see tenancy.py) gets its own ResponseCache with its own LRU
+# budget, so a busy program's match day only ever evicts its own entries.
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+from compression import MIN_COMPRESS_BYTES, add_vary, compress, pick_encoding
+from metrics import metrics
+from singleflight import read_flights
+from tenancy import current_program
+
+# seconds an entry may be served; bounds staleness when several workers run
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+
+
+def dump_json(data) -> bytes:
+    # same bytes FastAPI's JSONResponse would produce
+    return json.dumps(
+        jsonable_encoder(data),
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+class CachedBody:
+    __slots__ = ("body", "etag", "created", "tags", "encoded")
+
+    def __init__(self, body: bytes, tags: Iterable[str] = ()):
+        self.body = body
+        self.etag = '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+        self.created = time.monotonic()
+        self.tags = tuple(tags)
+        self.encoded: Dict[str, bytes] = {}
+
+    def body_for(self, encoding: Optional[str]) -> bytes:
+        if encoding is None or len(self.body) < MIN_COMPRESS_BYTES:
+            return self.body
+        data = self.encoded.get(encoding)
+        if data is None:
+            data = self.encoded[encoding] = compress(self.body, encoding)
+        return data
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, ttl: float = RESPONSE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, CachedBody]" = OrderedDict()
+        self._tags: Dict[str, set] = {}
+        # bumped on every invalidate(tag); lets a build that raced a write
+        # notice it and skip storing stale data
+        self._generations: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[CachedBody]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if self.ttl and time.monotonic() - entry.created > self.ttl:
+            self._drop(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def generation(self, tags: Iterable[str]) -> tuple:
+        return tuple(self._generations.get(t, 0) for t in tags)
+
+    def put(self, key: str, body: bytes, tags: Iterable[str] = (), generation: Optional[tuple] = None) -> CachedBody:
+        tags = tuple(tags)
+        if generation is not None and generation != self.generation(tags):
+            # invalidated while we were building: serve it once, don't keep it
+            return CachedBody(body, tags)
+        self._drop(key)
+        entry = CachedBody(body, tags)
+        self._entries[key] = entry
+        for tag in entry.tags:
+            self._tags.setdefault(tag, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+        return entry
+
+    def invalidate(self, *tags: str):
+        for tag in tags:
+            self._generations[tag] = self._generations.get(tag, 0) + 1
+            for key in self._tags.pop(tag, ()):
+                self._drop(key)
+
+    def expire(self):
+        """Drop entries older than the TTL (called periodically)."""
+        if not self.ttl:
+            return
+        now = time.monotonic()
+        for key in [k for k, e in self._entries.items() if now - e.created > self.ttl]:
+            self._drop(key)
+
+    def clear(self):
+        self._entries.clear()
+        self._tags.clear()
+
+    def _drop(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry.tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ProgramCaches:
+    """ResponseCache per program; the cache methods act on the current request's program."""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, ttl: float = RESPONSE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._caches: Dict[str, ResponseCache] = {}
+
+    def for_program(self, program: Optional[str] = None) -> ResponseCache:
+        program = program or current_program()
+        cache = self._caches.get(program)
+        if cache is None:
+            cache = self._caches[program] = ResponseCache(self.max_entries, self.ttl)
+        return cache
+
+    def get(self, key: str) -> Optional[CachedBody]:
+        return self.for_program().get(key)
+
+    def put(self, key: str, body: bytes, tags: Iterable[str] = (), generation: Optional[tuple] = None) -> CachedBody:
+        return self.for_program().put(key, body, tags, generation)
+
+    def generation(self, tags: Iterable[str]) -> tuple:
+        return self.for_program().generation(tags)
+
+    def invalidate(self, *tags: str):
+        self.for_program().invalidate(*tags)
+
+    def expire(self):
+        for cache in self._caches.values():
+            cache.expire()
+
+    def clear(self):
+        for cache in self._caches.values():
+            cache.clear()
+
+    def stats(self) -> dict:
+        return {
+            program: {"entries": len(c), "hits": c.hits, "misses": c.misses}
+            for program, c in self._caches.items()
+        }
+
+    def __len__(self):
+        return sum(len(c) for c in self._caches.values())
+
+
+response_cache = ProgramCaches()
+metrics.gauge("response_cache.entries", lambda: len(response_cache))
+metrics.gauge("response_cache.programs", response_cache.stats)
+
+
+def cached_body_response(request: Request, entry: CachedBody, headers: Optional[dict] = None) -> Response:
+    """Serve a CachedBody, picking the compressed variant the client accepts."""
+    if request.headers.get("if-none-match") == entry.etag:
+        return Response(status_code=304, headers={"ETag": entry.etag, **(headers or {})})
+
+    encoding = pick_encoding(request.headers.get("accept-encoding"))
+    body = entry.body_for(encoding)
+    response = Response(content=body, media_type="application/json", headers=headers)
+    response.headers["ETag"] = entry.etag
+    if body is not entry.body:
+        response.headers["Content-Encoding"] = encoding
+    response.raw_headers = add_vary(response.raw_headers)
+    return response
+
+
+async def cached_entry(key: str, tags: Iterable[str], build, cacheable=None) -> CachedBody:
+    """The cached body for `key`, building it with `await build()` on a miss.
+
+    `cacheable(data)` can veto storing a result (e.g. a match that's still live);
+    vetoed results are still returned, just not kept.
+
+    Concurrent misses for the same key share one build (query + serialization).
+    The tag generation is part of the flight key, so a request that arrives
+    after a write never joins a build that started before it; so is the
+    program, so two programs never share a build.
+    """
+    entry = response_cache.get(key)
+    if entry is None:
+        tags = tuple(tags)
+        gen = response_cache.generation(tags)
+
+        async def build_entry():
+            data = await build()
+            body = dump_json(data)
+            if cacheable is not None and not cacheable(data):
+                return CachedBody(body, tags)
+            return response_cache.put(key, body, tags, generation=gen)
+
+        entry = await read_flights.do((current_program(), key, gen), build_entry)
+    return entry
+
+
+async def cached_json(request: Request, key: str, tags: Iterable[str], build, cacheable=None) -> Response:
+    """Serve `key` from the response cache (see cached_entry)."""
+    return cached_body_response(request, await cached_entry(key, tags, build, cacheable))
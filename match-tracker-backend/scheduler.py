@@ -0,0 +1,130 @@
+# scheduler.py
+# Periodic background jobs, run as asyncio tasks inside the app lifespan.
+#
+#   * every job sleeps `interval` +/- `jitter` between runs, so workers that
+#     started together don't hit the database in lockstep
+#   * jobs that touch shared state (the database) take a lease in
+#     `job_leases` first: only the worker holding an unexpired lease runs the
+#     job, the others skip that tick. Jobs that only touch this process's
+#     memory (cache expiry) run everywhere.
+#   * a failing run is logged and counted; the loop keeps going
+import asyncio
+import os
+import random
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, Optional
+
+from sqlalchemy import select
+
+from db_setup import database
+from metrics import metrics
+from models import job_leases
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1").strip().lower() not in ("0", "false", "no", "off")
+
+# identifies this worker in job_leases
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class Job:
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[[], Awaitable[None]],
+        interval: float,
+        jitter: float = 0.1,
+        lease: bool = True,
+    ):
+        self.name = name
+        self.fn = fn
+        self.interval = interval
+        self.jitter = jitter  # fraction of the interval
+        self.lease = lease
+        self.last_run: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def next_delay(self) -> float:
+        return max(0.0, self.interval * (1 + random.uniform(-self.jitter, self.jitter)))
+
+
+async def acquire_lease(name: str, ttl: float, owner: str = WORKER_ID) -> bool:
+    """Take (or renew) the lease for `name`. True if we hold it afterwards."""
+    now = datetime.utcnow()
+    expires = now + timedelta(seconds=ttl)
+    exists = await database.fetch_val(select(job_leases.c.name).where(job_leases.c.name == name))
+    if exists is None:
+        try:
+            await database.execute(job_leases.insert().values(name=name, owner=owner, expires_at=expires))
+            return True
+        except Exception:
+            pass  # another worker inserted it first (unique violation; type depends on the driver)
+    # take the lease over only if it's ours or has expired
+    await database.execute(
+        job_leases.update()
+        .where(job_leases.c.name == name)
+        .where((job_leases.c.owner == owner) | (job_leases.c.expires_at < now))
+        .values(owner=owner, expires_at=expires)
+    )
+    holder = await database.fetch_val(select(job_leases.c.owner).where(job_leases.c.name == name))
+    return holder == owner
+
+
+class Scheduler:
+    def __init__(self):
+        self.jobs: List[Job] = []
+        self._tasks: List[asyncio.Task] = []
+
+    def every(self, interval: float, name: Optional[str] = None, jitter: float = 0.1, lease: bool = True):
+        """Decorator: register `fn` to run every `interval` seconds."""
+        def register(fn):
+            self.jobs.append(Job(name or fn.__name__, fn, interval, jitter, lease))
+            return fn
+        return register
+
+    async def run_once(self, job: Job):
+        start = time.perf_counter()
+        try:
+            if job.lease and not await acquire_lease(job.name, ttl=job.interval * (1 + job.jitter) * 2):
+                metrics.inc("scheduler.skipped", job=job.name)
+                return
+            await job.fn()
+            job.last_error = None
+            metrics.inc("scheduler.runs", job=job.name)
+        except Exception as e:
+            job.last_error = repr(e)
+            metrics.inc("scheduler.errors", job=job.name)
+            print(f"Scheduled job {job.name} failed: {e!r}")
+        job.last_run = time.time()
+        metrics.inc("scheduler.ms", int((time.perf_counter() - start) * 1000), job=job.name)
+
+    async def _loop(self, job: Job):
+        # spread first runs out instead of firing everything at startup
+        await asyncio.sleep(random.uniform(0, job.interval * job.jitter))
+        while True:
+            await self.run_once(job)
+            await asyncio.sleep(job.next_delay())
+
+    def start(self):
+        if not SCHEDULER_ENABLED or self._tasks:
+            return
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._loop(job), name=f"job:{job.name}") for job in self.jobs]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def status(self) -> dict:
+        return {
+            job.name: {"interval": job.interval, "lease": job.lease, "last_run": job.last_run, "last_error": job.last_error}
+            for job in self.jobs
+        }
+
+
+scheduler = Scheduler()
+metrics.gauge("scheduler.jobs", scheduler.status)
@@ -0,0 +1,118 @@
+# scoring.py
+# Tennis scoring on the server: the scorer sends who won the point
+# (POST /scores/{id}/point) and the line's stored state moves forward here.
+#
+# Stored state, all on the scores row:
+#   sets          [[team, opp], ...] games per set; a 10-point match tiebreak
+#                 is stored as its points in the deciding "set" (winprob reads
+#                 it the same way), a set tiebreak as 7-6 once it's won
+#   points        [team, opp] in the current game or tiebreak
+#   current_serve "0" team serving the next point, "1" opponent
+#
+# Formats come from winprob.LineFormat (ad/no-ad, games per set, 7-point set
+# tiebreak at games-all, optional 10-point match tiebreak in place of the
+# final set), so an 8-game no-ad pro set for doubles is just games_per_set=8.
+# A transition looks at most sets_to_win * 2 - 1 sets, so each point is O(1).
+from typing import List, NamedTuple, Optional
+
+from winprob import LineFormat, is_match_tiebreak, set_pairs, team_serves_point
+
+
+class PointResult(NamedTuple):
+    sets: List[List[int]]
+    points: List[int]
+    team_serves: bool
+    event: str  # "point", "game", "set" or "line": the biggest unit the point won
+    winner: Optional[str] = None  # "team" / "opponent" once the line is over
+
+
+class LineOver(ValueError):
+    """The stored score already has a winner; nothing left to play."""
+
+
+def _set_winner(fmt: LineFormat, t: int, o: int, match_tiebreak: bool) -> Optional[str]:
+    if match_tiebreak:
+        return _tiebreak_winner(t, o, fmt.match_tiebreak_to)
+    G = fmt.games_per_set
+    if (t >= G and t - o >= 2) or (t == G + 1 and o == G):
+        return "team"
+    if (o >= G and o - t >= 2) or (o == G + 1 and t == G):
+        return "opponent"
+    return None
+
+
+def _game_winner(fmt: LineFormat, a: int, b: int) -> Optional[str]:
+    # no-ad: 40-40 is a deciding point, so the first to four points wins
+    need_margin = 1 if fmt.no_ad else 2
+    if a >= 4 and a - b >= need_margin:
+        return "team"
+    if b >= 4 and b - a >= need_margin:
+        return "opponent"
+    return None
+
+
+def _tiebreak_winner(a: int, b: int, target: int) -> Optional[str]:
+    if a >= target and a - b >= 2:
+        return "team"
+    if b >= target and b - a >= 2:
+        return "opponent"
+    return None
+
+
+def score_point(fmt: LineFormat, sets, points, team_serves: bool, team_won: bool) -> PointResult:
+    """The line's state after one point; raises LineOver if it was already decided."""
+    pairs = [list(p) for p in set_pairs(sets)]
+    sw = sl = 0
+    current = None
+    for idx, (t, o) in enumerate(pairs):
+        won = _set_winner(fmt, t, o, is_match_tiebreak(fmt, sw, sl))
+        if won is None:
+            current = idx
+            break
+        sw, sl = sw + (won == "team"), sl + (won == "opponent")
+        if sw >= fmt.sets_to_win or sl >= fmt.sets_to_win:
+            raise LineOver("line already has a winner")
+    if current is None:
+        pairs.append([0, 0])
+        current = len(pairs) - 1
+
+    t, o = pairs[current]
+    match_tiebreak = is_match_tiebreak(fmt, sw, sl)
+    if match_tiebreak:
+        a, b = t, o  # the deciding "set" holds the match tiebreak's points
+    else:
+        a, b = (int(points[0] or 0), int(points[1] or 0)) if points else (0, 0)
+    played = a + b
+    if team_won:
+        a += 1
+    else:
+        b += 1
+
+    G = fmt.games_per_set
+    if match_tiebreak or (t == G and o == G):
+        # tiebreak: first server takes one point, then two each
+        team_first = team_serves == team_serves_point(played, True)
+        target = fmt.match_tiebreak_to if match_tiebreak else fmt.tiebreak_to
+        won = _tiebreak_winner(a, b, target)
+        if match_tiebreak:
+            pairs[current] = [a, b]
+        if won is None:
+            next_team_serves = team_serves_point(played + 1, team_first)
+            return PointResult(pairs, [a, b], next_team_serves, "point")
+        if not match_tiebreak:
+            pairs[current] = [G + 1, G] if won == "team" else [G, G + 1]
+        # whoever received first in the tiebreak serves first in the next set
+        next_team_serves = not team_first
+    else:
+        won = _game_winner(fmt, a, b)
+        if won is None:
+            return PointResult(pairs, [a, b], team_serves, "point")
+        pairs[current] = [t + 1, o] if won == "team" else [t, o + 1]
+        next_team_serves = not team_serves
+        if _set_winner(fmt, *pairs[current], False) is None:
+            return PointResult(pairs, [0, 0], next_team_serves, "game")
+
+    sw, sl = sw + (won == "team"), sl + (won == "opponent")
+    if sw >= fmt.sets_to_win or sl >= fmt.sets_to_win:
+        return PointResult(pairs, [0, 0], next_team_serves, "line", won)
+    return PointResult(pairs, [0, 0], next_team_serves, "set")
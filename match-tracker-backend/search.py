@@ -0,0 +1,241 @@
+# search.py
+# In-memory trigram index for /search over players, matches (opponent and
+# location), line player names and comment text.
+#
+# Every document is split into padded word trigrams ("  ro", " ro", "rol",
+# ..., "ns ") and the index maps trigram -> doc keys. A query only touches the
+# postings for its own trigrams, so lookups don't grow with the size of the
+# archive the way a LIKE scan would. The index is rebuilt at startup and the
+# mutation endpoints keep it current with upsert()/remove(). Every doc belongs
+# to one program and a search only ever returns the caller's program's docs.
+import heapq
+import math
+import os
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import select
+
+from archive import archives
+from db_setup import database
+from metrics import metrics
+from models import players
+from tenancy import current_program
+
+DocKey = Tuple[str, int]  # ("player" | "match" | "line" | "comment", id)
+KINDS = ("player", "match", "line", "comment")
+
+# below this share of the query's trigrams a doc isn't a match
+MIN_COVERAGE = 0.5
+# recent result lists, dropped on any index change; a query that matches most
+# of the archive ("great", "match") is only ranked once between writes
+SEARCH_CACHE_ENTRIES = int(os.getenv("SEARCH_CACHE_ENTRIES", "256"))
+
+_NON_WORD = re.compile(r"[^\w]+")
+# rows created by POST /schedule/{id}/start before names are filled in
+_PLACEHOLDER = re.compile(r"^(singles|doubles) (player|opponent) \d+[ab]?$", re.I)
+
+
+def normalize(text) -> str:
+    return _NON_WORD.sub(" ", str(text or "").lower()).strip()
+
+
+def trigrams(text: str) -> Set[str]:
+    out = set()
+    for word in normalize(text).split():
+        padded = f"  {word} "
+        out.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return out
+
+
+class Doc:
+    __slots__ = ("kind", "id", "program", "title", "text", "padded", "grams", "fields")
+
+    def __init__(self, kind: str, id: int, program: str, title: str, text: str, fields: dict):
+        self.kind = kind
+        self.program = program
+        self.id = id
+        self.title = title
+        self.text = normalize(text)
+        self.padded = " " + self.text
+        self.grams = trigrams(text)
+        self.fields = fields
+
+
+class SearchIndex:
+    def __init__(self):
+        self._docs: Dict[DocKey, Doc] = {}
+        self._postings: Dict[str, Set[DocKey]] = {}
+        self._results: "OrderedDict[tuple, List[dict]]" = OrderedDict()
+
+    # ---------------------------------------------------------- maintenance
+
+    def upsert(self, kind: str, id: int, program: str, title: str, text: str, **fields):
+        key = (kind, id)
+        self.remove(kind, id)
+        self._results.clear()
+        if not normalize(text):
+            return
+        doc = self._docs[key] = Doc(kind, id, program, title, text, fields)
+        for g in doc.grams:
+            self._postings.setdefault(g, set()).add(key)
+
+    def remove(self, kind: str, id: int):
+        doc = self._docs.pop((kind, id), None)
+        if doc is None:
+            return
+        self._results.clear()
+        for g in doc.grams:
+            keys = self._postings.get(g)
+            if keys is not None:
+                keys.discard((kind, id))
+                if not keys:
+                    del self._postings[g]
+
+    def remove_where(self, **fields):
+        """Drop every doc whose fields match, e.g. remove_where(match_id=7) after a delete."""
+        doomed = [
+            k for k, d in self._docs.items()
+            if all(d.fields.get(f) == v for f, v in fields.items())
+        ]
+        for kind, id in doomed:
+            self.remove(kind, id)
+
+    def clear(self):
+        self._docs.clear()
+        self._postings.clear()
+        self._results.clear()
+
+    # row -> doc helpers, shared by rebuild() and the endpoints; `program`
+    # defaults to the current request's
+
+    def add_player(self, row, program: Optional[str] = None):
+        self.upsert("player", row["id"], program or current_program(), row["name"], row["name"],
+                    gender=row["gender"], year=row["year"])
+
+    def add_match(self, row, program: Optional[str] = None):
+        d = row["date"]
+        if isinstance(d, datetime):
+            # stored as naive UTC; same "...Z" shape as /schedule
+            d = d.replace(tzinfo=d.tzinfo or timezone.utc).astimezone(timezone.utc)
+            d = d.isoformat(timespec="seconds").replace("+00:00", "Z")
+        self.upsert(
+            "match", row["id"], program or current_program(), f"vs {row['opponent'].strip()}",
+            f"{row['opponent']} {row['location'] or ''}",
+            match_id=row["id"], gender=row["gender"], location=row["location"], date=d,
+        )
+
+    def add_line(self, row, program: Optional[str] = None):
+        names = [n for n in (row["player1"], row["player2"], row["opponent1"], row["opponent2"])
+                 if n and not _PLACEHOLDER.match(n.strip())]
+        if not names:
+            self.remove("line", row["id"])
+            return
+        ours = " / ".join(n for n in (row["player1"], row["player2"]) if n)
+        theirs = " / ".join(n for n in (row["opponent1"], row["opponent2"]) if n)
+        self.upsert(
+            "line", row["id"], program or current_program(), f"{ours} vs {theirs}", " ".join(names),
+            match_id=row["match_id"], line_no=row["line_no"], match_type=row["match_type"],
+        )
+
+    def add_comment(self, row, match_id: Optional[int] = None, program: Optional[str] = None):
+        text = row["text"]
+        self.upsert(
+            "comment", row["id"], program or current_program(), text[:80], text,
+            score_id=row["score_id"], match_id=match_id,
+        )
+
+    async def rebuild(self):
+        start = time.perf_counter()
+        self.clear()
+        for r in await database.fetch_all(
+            select(players.c.id, players.c.program, players.c.name, players.c.gender, players.c.year)
+        ):
+            self.add_player(r, r["program"])
+        # every season, archived ones included (archive.py)
+        for r in await archives.fetch_all_seasons(lambda t: select(
+            t["matches"].c.id, t["matches"].c.program, t["matches"].c.opponent, t["matches"].c.location,
+            t["matches"].c.date, t["matches"].c.gender,
+        )):
+            self.add_match(r, r["program"])
+        for r in await archives.fetch_all_seasons(lambda t: select(
+            t["scores"].c.id, t["scores"].c.program, t["scores"].c.match_id, t["scores"].c.line_no,
+            t["scores"].c.match_type, t["scores"].c.player1, t["scores"].c.player2,
+            t["scores"].c.opponent1, t["scores"].c.opponent2,
+        )):
+            self.add_line(r, r["program"])
+        for r in await archives.fetch_all_seasons(lambda t: (
+            select(t["comments"].c.id, t["comments"].c.program, t["comments"].c.score_id, t["comments"].c.text,
+                   t["scores"].c.match_id)
+            .select_from(t["comments"].join(t["scores"], t["comments"].c.score_id == t["scores"].c.id))
+        )):
+            self.add_comment(r, r["match_id"], r["program"])
+        metrics.inc("search.rebuilds")
+        print(f"Search index: {len(self._docs)} docs, {len(self._postings)} trigrams "
+              f"in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    # ---------------------------------------------------------- querying
+
+    def search(self, query: str, kinds: Optional[Iterable[str]] = None, limit: int = 20) -> List[dict]:
+        kinds = frozenset(kinds) if kinds else None
+        program = current_program()
+        cache_key = (program, normalize(query), kinds, limit)
+        hit = self._results.get(cache_key)
+        if hit is not None:
+            self._results.move_to_end(cache_key)
+            metrics.inc("search.cache_hits")
+            return hit
+        out = self._search(query, program, kinds, limit)
+        self._results[cache_key] = out
+        if len(self._results) > SEARCH_CACHE_ENTRIES:
+            self._results.popitem(last=False)
+        return out
+
+    def _search(self, query: str, program: str, kinds: Optional[frozenset], limit: int) -> List[dict]:
+        q_grams = trigrams(query)
+        if not q_grams:
+            return []
+        need = max(1, math.ceil(MIN_COVERAGE * len(q_grams)))
+
+        # A doc sharing >= `need` trigrams must contain at least one of the
+        # len(q) - need + 1 rarest ones, so only those postings seed candidates.
+        postings = sorted((self._postings.get(g, ()) for g in q_grams), key=len)
+        candidates = set()
+        for keys in postings[:len(q_grams) - need + 1]:
+            candidates.update(keys)
+
+        q_norm = normalize(query)
+        padded_q = " " + q_norm
+        results = []
+        for key in candidates:
+            if kinds is not None and key[0] not in kinds:
+                continue
+            doc = self._docs[key]
+            if doc.program != program:
+                continue
+            n = len(q_grams & doc.grams)
+            if n < need:
+                continue
+            # how much of the query we matched, nudged toward short, exact docs
+            score = 0.7 * n / len(q_grams) + 0.3 * n / (len(q_grams) + len(doc.grams) - n)
+            if q_norm in doc.text:
+                score += 0.5
+                if padded_q in doc.padded:  # starts at a word boundary
+                    score += 0.25
+            results.append((score, doc))
+
+        top = heapq.nsmallest(limit, results, key=lambda r: (-r[0], r[1].kind, r[1].id))
+        return [
+            {"type": doc.kind, "id": doc.id, "title": doc.title, "score": round(score, 3), **doc.fields}
+            for score, doc in top
+        ]
+
+    def __len__(self):
+        return len(self._docs)
+
+
+search_index = SearchIndex()
+metrics.gauge("search.docs", lambda: len(search_index))
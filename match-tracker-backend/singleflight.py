@@ -0,0 +1,41 @@
+# singleflight.py
+# Coalesce concurrent identical reads: the first caller for a key starts the
+# work, everyone who arrives while it's running awaits the same result.
+#
+# The work runs in its own task, so a waiter that disconnects (and gets
+# cancelled) never cancels the query the others are waiting on.
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from metrics import metrics
+
+
+class SingleFlight:
+    def __init__(self, name: str = "singleflight"):
+        self.name = name
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, key=key: self._done(key, t))
+            metrics.inc(f"{self.name}.leaders")
+        else:
+            metrics.inc(f"{self.name}.coalesced")
+        # shield: cancelling this waiter must not cancel the shared task
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved even if every waiter went away
+
+    def __len__(self):
+        return len(self._inflight)
+
+
+read_flights = SingleFlight("singleflight")
+metrics.gauge("singleflight.in_flight", lambda: len(read_flights))
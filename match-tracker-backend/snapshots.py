@@ -0,0 +1,132 @@
+# snapshots.py
+# Immutable snapshots of completed matches.
+#
+# A snapshot is built once (when the match completes) and stored as JSON
+# text in `match_snapshots`. Reads are served from memory as pre-encoded
+# bodies (see response_cache.CachedBody), so an archived box score costs no
+# queries at all after the first hit.
+import json
+import os
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import select
+
+from archive import archives
+from db_setup import database
+from models import match_snapshots, matches
+from response_cache import CachedBody, dump_json
+from tenancy import current_program
+
+# Snapshots do change at the same URL (an admin regenerates one, reopening a
+# match drops it), so clients keep them but revalidate every time: the ETag
+# makes that a 304 with no body.
+SNAPSHOT_CACHE_CONTROL = "public, no-cache"
+SNAPSHOT_MEMORY_ENTRIES = int(os.getenv("SNAPSHOT_MEMORY_ENTRIES", "256"))
+
+
+def _views(data: dict) -> Dict[str, CachedBody]:
+    """Pre-serialize every response shape we serve out of one snapshot."""
+    match = data["match"]
+    scores = data["scores"]
+    full = dict(match)
+    if scores:
+        full["scores"] = scores
+    return {
+        "snapshot": CachedBody(dump_json(data)),
+        "match": CachedBody(dump_json(match)),
+        "full": CachedBody(dump_json(full)),
+        "scores": CachedBody(dump_json(scores)),
+    }
+
+
+class SnapshotStore:
+    def __init__(self, max_entries: int = SNAPSHOT_MEMORY_ENTRIES):
+        self.max_entries = max_entries
+        self._ids: Dict[int, str] = {}  # match id -> program, for every snapshot row
+        self._memory: "OrderedDict[int, Dict[str, CachedBody]]" = OrderedDict()
+
+    async def load_ids(self):
+        rows = await database.fetch_all(
+            select(match_snapshots.c.match_id, matches.c.program)
+            .select_from(match_snapshots.join(matches, matches.c.id == match_snapshots.c.match_id))
+        )
+        self._ids = {r["match_id"]: r["program"] for r in rows}
+        self._ids.update(archives.snapshots)
+        self._memory.clear()
+
+    async def reload(self, match_id: int):
+        """Re-read one match's snapshot state (another instance wrote or deleted it)."""
+        row = await database.fetch_one(
+            select(matches.c.program)
+            .select_from(match_snapshots.join(matches, matches.c.id == match_snapshots.c.match_id))
+            .where(match_snapshots.c.match_id == match_id)
+        )
+        self._memory.pop(match_id, None)
+        if row:
+            self._ids[match_id] = row["program"]
+        else:
+            self._ids.pop(match_id, None)
+
+    def has(self, match_id: int) -> bool:
+        return match_id in self._ids
+
+    async def get(self, match_id: int) -> Optional[Dict[str, CachedBody]]:
+        """Views for a snapshotted match of the current program, or None (without a query)."""
+        if self._ids.get(match_id) != current_program():
+            return None
+        views = self._memory.get(match_id)
+        if views is not None:
+            self._memory.move_to_end(match_id)
+            return views
+        season = archives.season_of_match(match_id)
+        if season is None:
+            row = await database.fetch_one(
+                select(match_snapshots.c.body).where(match_snapshots.c.match_id == match_id)
+            )
+        else:
+            row = await archives.fetch_one(season, lambda t: (
+                select(t["match_snapshots"].c.body).where(t["match_snapshots"].c.match_id == match_id)
+            ))
+        if not row:
+            self._ids.pop(match_id, None)
+            return None
+        return self._remember(match_id, _views(json.loads(row["body"])))
+
+    async def save(self, match_id: int, data: dict):
+        body = dump_json(data).decode("utf-8")
+        now = datetime.utcnow()
+        async with database.transaction():
+            # write before reading: a SQLite (WAL) transaction that starts with a
+            # read can't take the write lock if another writer got in first, and
+            # fails with "database is locked" instead of waiting
+            await database.execute(
+                match_snapshots.update()
+                .where(match_snapshots.c.match_id == match_id)
+                .values(body=body, version=match_snapshots.c.version + 1, created_at=now)
+            )
+            existing = await database.fetch_val(
+                select(match_snapshots.c.match_id).where(match_snapshots.c.match_id == match_id)
+            )
+            if existing is None:
+                await database.execute(
+                    match_snapshots.insert().values(match_id=match_id, body=body, version=1, created_at=now)
+                )
+        self._ids[match_id] = data["match"].get("program") or current_program()
+        self._remember(match_id, _views(data))
+
+    async def delete(self, match_id: int):
+        await database.execute(match_snapshots.delete().where(match_snapshots.c.match_id == match_id))
+        self._ids.pop(match_id, None)
+        self._memory.pop(match_id, None)
+
+    def _remember(self, match_id, views):
+        self._memory[match_id] = views
+        self._memory.move_to_end(match_id)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+        return views
+
+
+snapshot_store = SnapshotStore()
@@ -0,0 +1,80 @@
+# tenancy.py
+# One deployment, several programs (men's/women's tennis, pickleball, partner
+# schools...). Every row in matches/players/scores/users/comments carries a
+# `program` slug and every request runs "inside" exactly one program:
+#
+#   X-Program: saint-leo-tennis      (header, what the frontends send)
+#   ?program=saint-leo-tennis        (query param, handy for links/curl)
+#   DEFAULT_PROGRAM                  (when neither is given)
+#
+# The slug lives in a contextvar for the duration of the request, so queries,
+# caches and indexes can scope themselves without threading it through every
+# call.
+import os
+import re
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from urllib.parse import parse_qs
+
+DEFAULT_PROGRAM = os.getenv("DEFAULT_PROGRAM", "saint-leo-tennis")
+# optional comma-separated allowlist; empty means any well-formed slug is accepted
+PROGRAMS = {p.strip() for p in os.getenv("PROGRAMS", "").split(",") if p.strip()}
+
+_SLUG = re.compile(r"^[a-z0-9][a-z0-9_-]{0,62}$")
+
+_program: ContextVar[str] = ContextVar("program", default=DEFAULT_PROGRAM)
+
+
+def current_program() -> str:
+    return _program.get()
+
+
+@contextmanager
+def program_context(program: str):
+    """Run a block as `program` (background jobs, scripts)."""
+    token = _program.set(program)
+    try:
+        yield
+    finally:
+        _program.reset(token)
+
+
+def resolve_program(scope) -> Optional[str]:
+    """Program slug for an ASGI request, DEFAULT_PROGRAM if unspecified, None if invalid."""
+    value = None
+    for k, v in scope.get("headers", []):
+        if k == b"x-program":
+            value = v.decode("latin-1")
+            break
+    if value is None and scope.get("query_string"):
+        values = parse_qs(scope["query_string"].decode("latin-1")).get("program")
+        value = values[0] if values else None
+    if value is None:
+        return DEFAULT_PROGRAM
+    value = value.strip().lower()
+    if not _SLUG.match(value) or (PROGRAMS and value not in PROGRAMS and value != DEFAULT_PROGRAM):
+        return None
+    return value
+
+
+class ProgramMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        program = resolve_program(scope)
+        if program is None:
+            body = b'{"detail":"Unknown program"}'
+            await send({
+                "type": "http.response.start",
+                "status": 404,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+        with program_context(program):
+            await self.app(scope, receive, send)
@@ -0,0 +1,47 @@
+# Tests run against a throwaway SQLite file unless TEST_DATABASE_URL points
+# somewhere else, e.g. the Postgres verification run:
+#
+#   TEST_DATABASE_URL=postgresql+asyncpg://postgres@127.0.0.1:5432/tennis_test python -m pytest
+#
+# The app reads its settings at import time, so they are set here, before any
+# test module imports main.
+import os
+import tempfile
+import uuid
+
+_tmp = tempfile.mkdtemp(prefix="match-tracker-tests-")
+os.environ["DATABASE_URL"] = os.getenv("TEST_DATABASE_URL") or f"sqlite:///{_tmp}/test.db"
+os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+os.environ.setdefault("SCHEDULER_ENABLED", "0")
+os.environ.setdefault("COMMENT_FLUSH_MS", "10")
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+
+    import main
+
+    with TestClient(main.app) as c:
+        yield c
+
+
+@pytest.fixture
+def new_match(client):
+    """Create a scheduled match against a unique opponent; returns its JSON."""
+    def create(**fields):
+        body = {
+            "date": "2026-03-01T13:00:00",
+            "gender": "men",
+            "opponent": f"Test {uuid.uuid4().hex[:8]}",
+            "location": "Home",
+            "match_number": 1,
+        }
+        body.update(fields)
+        r = client.post("/schedule", json=body)
+        assert r.status_code == 200, r.text
+        return r.json()
+
+    return create
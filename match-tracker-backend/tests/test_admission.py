@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+import admission
+from admission import (
+    RATE_LIMIT_WRITE_BURST, AdmissionMiddleware, ConcurrencyLimiter, RateLimiter, TokenBucket, classify, client_id,
+    route_key,
+)
+
+
+def test_route_key_replaces_numeric_segments():
+    assert route_key("/scores/12/comments") == "/scores/{id}/comments"
+    assert route_key("/schedule/3/") == "/schedule/{id}"
+    assert route_key("/") == "/"
+
+
+def test_classify():
+    assert classify("GET", "/schedule")[0] == "read"
+    assert classify("POST", "/batch")[0] == "read"
+    assert classify("POST", "/auth/login")[0] == "auth"
+    assert classify("POST", "/scores/{id}/comments")[0] == "comment"
+    # a scorer write is privileged only with an admin token
+    assert classify("PUT", "/scores/{id}", admin=True) is None
+    assert classify("PUT", "/scores/{id}")[0] == "write"
+    # an admin token doesn't make other writes privileged
+    assert classify("POST", "/scores/{id}/comments", admin=True)[0] == "comment"
+    assert classify("DELETE", "/nope/{id}", admin=True)[0] == "write"
+
+
+def test_token_bucket_refills_at_its_rate():
+    bucket = TokenBucket(rate=2.0, capacity=3)
+    now = bucket.updated
+    assert [bucket.take(now)[0] for _ in range(3)] == [True, True, True]
+    allowed, retry_after = bucket.take(now)
+    assert not allowed
+    assert retry_after == pytest.approx(0.5)
+    assert bucket.take(now + 0.5)[0]
+    # never holds more than its capacity
+    assert [bucket.take(now + 100)[0] for _ in range(4)] == [True, True, True, False]
+
+
+def test_rate_limiter_keys_per_client_and_route_and_forgets_the_oldest():
+    limiter = RateLimiter(max_keys=2)
+    assert limiter.check("a", "/x", 0.0, 1)[0]
+    assert not limiter.check("a", "/x", 0.0, 1)[0]
+    assert limiter.check("b", "/x", 0.0, 1)[0]
+    assert limiter.check("a", "/y", 0.0, 1)[0]
+    assert len(limiter) == 2
+    assert limiter.check("a", "/x", 0.0, 1)[0]  # evicted, so a fresh bucket
+
+
+def test_concurrency_limiter_keeps_reserved_slots_for_writes():
+    limiter = ConcurrencyLimiter(total=3, reserved=1)
+    assert limiter.try_acquire(public=True)
+    assert limiter.try_acquire(public=True)
+    assert not limiter.try_acquire(public=True)
+    assert limiter.try_acquire(public=False)
+    assert not limiter.try_acquire(public=False)
+    limiter.release(public=True)
+    assert limiter.in_flight == 2 and limiter.in_flight_public == 1
+
+
+def test_client_id_reads_forwarded_for_only_when_trusted(monkeypatch):
+    scope = {"client": ("10.0.0.1", 1234), "headers": [(b"x-forwarded-for", b"6.6.6.6, 1.2.3.4")]}
+    monkeypatch.setattr(admission, "TRUST_FORWARDED_FOR", False)
+    assert client_id(scope) == "10.0.0.1"
+    monkeypatch.setattr(admission, "TRUST_FORWARDED_FOR", True)
+    monkeypatch.setattr(admission, "FORWARDED_FOR_HOPS", 1)
+    assert client_id(scope) == "1.2.3.4"  # the hop the proxy appended, not the client's claim
+
+
+def _call(mw, method, path, token=None):
+    headers = [(b"authorization", f"Bearer {token}".encode())] if token else []
+    scope = {"type": "http", "method": method, "path": path, "headers": headers, "client": ("1.1.1.1", 1)}
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(mw(scope, receive, send))
+    return sent[0]["status"]
+
+
+def test_anonymous_writes_are_limited_per_row(monkeypatch):
+    monkeypatch.setattr(admission, "RATE_LIMIT_ENABLED", True)
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    mw = AdmissionMiddleware(app, is_admin=lambda token: token == "admin")
+    burst = int(RATE_LIMIT_WRITE_BURST)
+    assert [_call(mw, "PUT", "/scores/1") for _ in range(burst)] == [200] * burst
+    assert _call(mw, "PUT", "/scores/1") == 429
+    assert _call(mw, "PUT", "/scores/2") == 200  # another line, another bucket
+    assert _call(mw, "PUT", "/scores/1", token="admin") == 200
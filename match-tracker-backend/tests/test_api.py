@@ -0,0 +1,101 @@
+import pytest
+
+from db_setup import DB_RETURNING
+from query_stats import QueryBudgetExceeded, query_budget
+
+
+def _lines(client, match_id):
+    r = client.get(f"/scores/match/{match_id}")
+    assert r.status_code == 200
+    return r.json()
+
+
+def test_create_start_score_complete(client, new_match):
+    match = new_match()
+    r = client.post(f"/schedule/{match['id']}/start")
+    assert r.status_code == 200, r.text
+    lines = _lines(client, match["id"])
+    assert sorted(l["match_type"] for l in lines) == ["doubles"] * 3 + ["singles"] * 6
+
+    singles = next(l for l in lines if l["match_type"] == "singles")
+    r = client.post(f"/scores/{singles['id']}/start", json={"player1": "A. Player", "opponent1": "B. Rival"})
+    assert r.status_code == 200, r.text
+
+    events = []
+    for _ in range(2 * 6 * 4):  # 6-0 6-0, every point to us
+        r = client.post(f"/scores/{singles['id']}/point", json={"winner": "team"})
+        assert r.status_code == 200, r.text
+        events.append(r.json()["event"])
+    assert events.count("game") == 10
+    assert events.count("set") == 1
+    assert events[-1] == "line"
+    line = r.json()["score"]
+    assert line["status"] == "completed"
+    # lines start with three empty set slots; the unplayed one stays 0-0
+    assert line["sets"] == [{"team": 6, "opp": 0}, {"team": 6, "opp": 0}, {"team": 0, "opp": 0}]
+
+    r = client.post(f"/scores/{singles['id']}/point", json={"winner": "team"})
+    assert r.status_code == 409  # the line is over
+
+    for l in lines:
+        if l["id"] == singles["id"]:
+            continue
+        winner = "team" if l["match_type"] == "doubles" else "opponent"
+        r = client.post(f"/scores/{l['id']}/complete", json={"winner": winner})
+        assert r.status_code == 200, r.text
+
+    r = client.post(f"/schedule/{match['id']}/complete", json={"winner": "team"})
+    assert r.status_code == 200, r.text
+    done = client.get(f"/schedule/{match['id']}").json()
+    assert done["status"] == "completed"
+    # three doubles wins at half a point each, one singles win, five losses
+    assert done["team_score"] == {"team": 2.5, "opponent": 5}
+
+
+@pytest.mark.skipif(not DB_RETURNING, reason="DB_RETURNING=0 reads the row back after writing it")
+def test_score_writes_stay_within_query_budget(client, new_match):
+    match = new_match()
+    client.post(f"/schedule/{match['id']}/start")
+    line = _lines(client, match["id"])[0]
+    # one UPDATE ... RETURNING each: no re-SELECT of the row just written
+    with query_budget(1):
+        assert client.put(f"/scores/{line['id']}", json={"sets": [[1, 0]]}).status_code == 200
+        assert client.post(f"/scores/{line['id']}/point", json={"winner": "team"}).status_code == 200
+        assert client.post(f"/scores/{line['id']}/complete", json={"winner": "team"}).status_code == 200
+
+
+def test_schedule_list_is_not_n_plus_one(client, new_match):
+    for n in range(3):
+        client.post(f"/schedule/{new_match(match_number=n + 1)['id']}/start")
+    with query_budget(1):
+        r = client.get("/schedule")
+    assert r.status_code == 200
+    assert len(r.json()) >= 3
+
+
+def test_query_budget_fails_the_request_that_exceeds_it(client, new_match):
+    match = new_match()
+    with pytest.raises(QueryBudgetExceeded, match=r"ran \d+ queries \(budget 0\)"):
+        with query_budget(0):
+            client.post(f"/schedule/{match['id']}/start")
+
+
+def test_snapshot_is_revalidated_not_immutable(client, new_match):
+    match = new_match()
+    client.post(f"/schedule/{match['id']}/start")
+    lines = _lines(client, match["id"])
+    for l in lines:
+        client.post(f"/scores/{l['id']}/complete", json={"winner": "team"})
+    assert client.post(f"/schedule/{match['id']}/complete", json={"winner": "team"}).status_code == 200
+
+    r = client.get(f"/matches/{match['id']}/snapshot")
+    assert r.status_code == 200
+    assert r.headers["cache-control"] == "public, no-cache"
+    etag = r.headers["etag"]
+    assert client.get(f"/matches/{match['id']}/snapshot", headers={"If-None-Match": etag}).status_code == 304
+
+    # a correction to a finished line rewrites the snapshot behind the same URL
+    assert client.put(f"/scores/{lines[0]['id']}", json={"sets": [[8, 6]]}).status_code == 200
+    r = client.get(f"/matches/{match['id']}/snapshot", headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    assert r.headers["etag"] != etag
@@ -0,0 +1,23 @@
+from batch import _field_tree, select_fields
+
+
+def test_field_tree_nests_dotted_names():
+    assert _field_tree(["id", "scores.sets", "scores.id"]) == {"id": None, "scores": {"sets": None, "id": None}}
+
+
+def test_field_tree_whole_value_wins_over_narrower_selection():
+    assert _field_tree(["scores.sets", "scores"]) == {"scores": None}
+    assert _field_tree(["scores", "scores.sets"]) == {"scores": None}
+    assert _field_tree(["", "a..b"]) == {"a": {"b": None}}
+
+
+def test_select_fields_walks_dicts_and_lists():
+    data = {
+        "id": 1,
+        "status": "live",
+        "scores": [{"id": 10, "sets": [[6, 3]], "winner": None}, {"id": 11, "sets": [], "winner": "1"}],
+    }
+    tree = _field_tree(["id", "scores.id", "scores.sets", "missing"])
+    assert select_fields(data, tree) == {"id": 1, "scores": [{"id": 10, "sets": [[6, 3]]}, {"id": 11, "sets": []}]}
+    assert select_fields(data, None) is data
+    assert select_fields([1, 2], {"id": None}) == [1, 2]
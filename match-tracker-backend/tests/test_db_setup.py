@@ -0,0 +1,33 @@
+# Helpers that lean on `databases` behaviour; run on the app's event loop
+# (client.portal), where the database is connected.
+from sqlalchemy import select, update
+
+from db_setup import database, execute_rowcount, gather_on_connection
+from models import matches
+
+
+def test_execute_rowcount_counts_changed_rows(client, new_match):
+    a, b = new_match(), new_match()
+    both = update(matches).where(matches.c.id.in_([a["id"], b["id"]])).values(flag="x")
+    assert client.portal.call(execute_rowcount, both) == 2
+    one = update(matches).where(matches.c.id == a["id"]).values(flag="y")
+    assert client.portal.call(execute_rowcount, one) == 1
+    none = update(matches).where(matches.c.id == -1).values(flag="z")
+    assert client.portal.call(execute_rowcount, none) == 0
+
+
+def test_gather_on_connection_shares_one_connection(client, new_match):
+    match = new_match()
+
+    async def read(n):
+        conn = database.connection()
+        value = await database.fetch_val(select(matches.c.id).where(matches.c.id == match["id"]))
+        return n, id(conn), value
+
+    async def run():
+        return await gather_on_connection(*(read(n) for n in range(4)))
+
+    results = client.portal.call(run)
+    assert [n for n, _, _ in results] == [0, 1, 2, 3]
+    assert {value for _, _, value in results} == {match["id"]}
+    assert len({conn for _, conn, _ in results}) == 1
@@ -0,0 +1,62 @@
+from array import array
+from datetime import datetime
+
+from momentum_store import (
+    extend_series, legacy_set_starts, pack_starts, pack_times, pack_values, series_to_rows, to_seconds,
+    unpack_starts, unpack_times, unpack_values,
+)
+
+
+def test_pack_round_trips_and_clamps():
+    assert list(unpack_values(pack_values([0, 1, -2, 300, -300]))) == [0, 1, -2, 127, -127]
+    assert list(unpack_starts(pack_starts([5, 13]))) == [5, 13]
+    assert pack_starts([1]) == b"\x01\x00"  # little-endian on every platform
+    assert list(unpack_times(pack_times([0, 1767225600]))) == [0, 1767225600]
+    assert list(unpack_values(None)) == list(unpack_times(None)) == []
+
+
+def test_series_to_rows_splits_momentum_and_keeps_game_times():
+    t0 = datetime(2026, 3, 1, 13, 0)
+    t1 = datetime(2026, 3, 1, 13, 5)
+    rows = series_to_rows(array("b", [0, 1, -1]), datetime(2026, 3, 1, 14), array("I", [to_seconds(t0), 0, to_seconds(t1)]))
+    assert rows == [
+        {"game_number": 0, "team_momentum": 0, "opp_momentum": 0, "timestamp": t0},
+        {"game_number": 1, "team_momentum": 1, "opp_momentum": 0, "timestamp": None},
+        {"game_number": 2, "team_momentum": 0, "opp_momentum": 1, "timestamp": t1},
+    ]
+
+
+def test_series_to_rows_without_times_dates_only_the_last_game():
+    updated = datetime(2026, 3, 1, 14)
+    rows = series_to_rows(array("b", [0, 1, 2]), updated)
+    assert [r["timestamp"] for r in rows] == [None, None, updated]
+
+
+def test_extend_series_appends_games_and_resets_on_a_new_set():
+    values, starts, times = array("b"), array("H"), array("I")
+    now = datetime(2026, 3, 1, 13)
+    assert extend_series(values, starts, [[1, 0]], "team", times, now) == (1, 1)
+    assert extend_series(values, starts, [[2, 0]], "team", times, now) == (1, 2)
+    assert extend_series(values, starts, [[2, 1]], "opponent", times, now) == (1, 1)
+    assert list(values) == [0, 1, 2, 1]
+    # taps skipped to the next set: momentum restarts at the append, and every
+    # game added goes to the tapped winner
+    assert extend_series(values, starts, [[6, 4], [1, 0]], "team", times, now) == (8, 8)
+    assert list(starts) == [4]
+    assert len(times) == len(values)
+    assert set(times) == {to_seconds(now)}
+
+
+def test_extend_series_pads_times_for_series_packed_without_them():
+    values, times = array("b", [0, 1]), array("I")
+    extend_series(values, array("H"), [[2, 0]], "team", times, datetime(2026, 3, 1))
+    assert list(times) == [0, 0, to_seconds(datetime(2026, 3, 1))]
+
+
+def test_legacy_set_starts_come_from_the_sets():
+    # 2-2 first set ending level, the second set's first game taking it 0 -> 1:
+    # momentum moved by one game, only the sets say a set started there
+    assert list(legacy_set_starts([0, 1, 0, 1, 0, 1], [[2, 2], [1, 0]])) == [5]
+    # a jump of more than one game is a reset wherever it is
+    assert list(legacy_set_starts([0, 1, 2, -1], [])) == [3]
+    assert list(legacy_set_starts([0, 1, 2], [[2, 0]])) == []
@@ -0,0 +1,53 @@
+from datetime import datetime
+
+from records import match_outcome, normalize_winner, tally, view
+
+
+def row(id, day, winner=None, location="Home", opponent="Rollins", conference=None, team_score=None):
+    return {
+        "id": id, "date": datetime(2026, 2, day), "winner": winner, "location": location,
+        "opponent": opponent, "conference": conference, "team_score": team_score,
+    }
+
+
+def test_normalize_winner_accepts_every_stored_encoding():
+    for w in ("team", "1", "TEAM", " won "):
+        assert normalize_winner(w) == "team"
+    for w in ("opponent", "0", "2", "Lost"):
+        assert normalize_winner(w) == "opponent"
+    assert normalize_winner(None) is None
+    assert normalize_winner("tie") is None
+
+
+def test_match_outcome_falls_back_to_team_score():
+    assert match_outcome(row(1, 1, team_score={"team": 4, "opponent": 2})) == "team"
+    assert match_outcome(row(1, 1, team_score='{"team": 1.5, "opponent": 5}')) == "opponent"
+    assert match_outcome(row(1, 1, team_score={"team": 3, "opponent": 3})) is None
+
+
+def test_tally_counts_splits_conference_and_streak():
+    rows = [
+        row(1, 1, "team", location="Home", opponent="Rollins"),           # SSC
+        row(2, 3, "opponent", location="Tampa, FL", opponent="Tampa"),    # SSC, away
+        row(3, 5, "1", location="Neutral site", opponent="Valdosta St"),
+        row(4, 7, "team", location="Saint Leo, FL", opponent="Valdosta St", conference=1),
+        row(5, 9, None, team_score={"team": 5, "opponent": 2}, location="Away", opponent="Florida Gulf Coast"),
+    ]
+    record = tally("p", 2026, "men", reversed(rows))  # any order
+    assert (record["wins"], record["losses"]) == (4, 1)
+    assert (record["home_wins"], record["home_losses"]) == (2, 0)
+    assert (record["away_wins"], record["away_losses"]) == (1, 1)
+    assert (record["neutral_wins"], record["neutral_losses"]) == (1, 0)
+    assert (record["conference_wins"], record["conference_losses"]) == (2, 1)
+    assert record["streak"] == 3
+    assert record["last_match_id"] == 5
+    assert view(record)["streak"] == "W3"
+
+
+def test_streak_flips_on_a_loss_and_skips_unknown_results():
+    rows = [row(1, 1, "team"), row(2, 2, "team"), row(3, 3, "opponent"), row(4, 4, None), row(5, 5, "0")]
+    record = tally("p", 2026, "women", rows)
+    assert record["streak"] == -2
+    assert view(record)["streak"] == "L2"
+    assert record["last_match_id"] == 5
+    assert view(tally("p", 2026, "women", []))["streak"] is None
@@ -0,0 +1,110 @@
+import pytest
+
+from scoring import LineOver, score_point
+from winprob import DOUBLES, LineFormat
+
+SINGLES = LineFormat("singles", sets_to_win=2, games_per_set=6, no_ad=False, serve_prob=0.62)
+SINGLES_MTB = SINGLES._replace(final_set_match_tiebreak=True)
+
+
+def play(fmt, sets, points, team_serves, wins):
+    """Apply a sequence of points ("t"/"o"); returns the last PointResult."""
+    result = None
+    for w in wins:
+        result = score_point(fmt, sets, points, team_serves, w == "t")
+        sets, points, team_serves = result.sets, result.points, result.team_serves
+    return result
+
+
+def test_point_within_game():
+    r = score_point(SINGLES, [], [0, 0], True, True)
+    assert r.sets == [[0, 0]]
+    assert r.points == [1, 0]
+    assert r.event == "point"
+    assert r.team_serves is True
+
+
+def test_deuce_needs_two_clear_points_with_ad():
+    r = play(SINGLES, [[0, 0]], [3, 3], True, "t")
+    assert (r.points, r.event) == ([4, 3], "point")  # advantage
+    r = play(SINGLES, [[0, 0]], [4, 3], True, "o")
+    assert (r.points, r.event) == ([4, 4], "point")  # back to deuce
+    r = play(SINGLES, [[0, 0]], [4, 3], True, "t")
+    assert r.event == "game"
+    assert r.sets == [[1, 0]]
+    assert r.points == [0, 0]
+    assert r.team_serves is False  # serve changes every game
+
+
+def test_no_ad_deciding_point():
+    r = score_point(DOUBLES, [[0, 0]], [3, 3], True, False)
+    assert r.event == "game"
+    assert r.sets == [[0, 1]]
+
+
+def test_game_wins_set_and_next_set_starts():
+    r = play(SINGLES, [[5, 3]], [3, 0], True, "t")
+    assert r.event == "set"
+    assert r.sets == [[6, 3]]
+    r = score_point(SINGLES, r.sets, r.points, r.team_serves, True)
+    assert r.sets == [[6, 3], [0, 0]]
+    assert r.points == [1, 0]
+
+
+def test_set_tiebreak_serve_rotation_and_result():
+    sets = [[6, 6]]
+    # first server takes one point, then two each
+    r = score_point(SINGLES, sets, [0, 0], True, True)
+    assert (r.points, r.team_serves) == ([1, 0], False)
+    r = score_point(SINGLES, sets, r.points, r.team_serves, True)
+    assert (r.points, r.team_serves) == ([2, 0], False)
+    r = score_point(SINGLES, sets, r.points, r.team_serves, True)
+    assert (r.points, r.team_serves) == ([3, 0], True)
+
+    r = play(SINGLES, sets, [6, 5], False, "t")
+    assert r.event == "set"
+    assert r.sets == [[7, 6]]
+    # the opponent serving point 11 means it served the first one; whoever
+    # received first serves the next set
+    assert r.team_serves is True
+
+
+def test_tiebreak_goes_past_seven_by_two():
+    r = score_point(SINGLES, [[6, 6]], [6, 6], True, True)
+    assert r.event == "point"
+    assert r.points == [7, 6]
+    r = score_point(SINGLES, [[6, 6]], [7, 6], r.team_serves, True)
+    assert r.sets == [[7, 6]]
+
+
+def test_match_point_ends_line():
+    r = play(SINGLES, [[6, 3], [5, 2]], [3, 1], True, "t")
+    assert r.event == "line"
+    assert r.winner == "team"
+    assert r.sets == [[6, 3], [6, 2]]
+
+
+def test_doubles_pro_set_ends_line():
+    r = play(DOUBLES, [[7, 7]], [3, 3], True, "o")
+    assert (r.event, r.sets) == ("game", [[7, 8]])  # 8 games, but not two clear
+    r = play(DOUBLES, [[8, 8]], [6, 6], True, "oo")
+    assert r.event == "line"
+    assert r.winner == "opponent"
+    assert r.sets == [[8, 9]]
+
+
+def test_match_tiebreak_is_stored_in_the_deciding_set():
+    sets = [[6, 3], [3, 6], [9, 8]]
+    r = score_point(SINGLES_MTB, sets, [0, 0], True, True)
+    assert r.event == "line"
+    assert r.winner == "team"
+    assert r.sets[-1] == [10, 8]
+
+    r = score_point(SINGLES_MTB, [[6, 3], [3, 6]], [0, 0], True, False)
+    assert r.sets == [[6, 3], [3, 6], [0, 1]]
+    assert r.event == "point"
+
+
+def test_decided_line_raises():
+    with pytest.raises(LineOver):
+        score_point(SINGLES, [[6, 0], [6, 0]], [0, 0], True, True)
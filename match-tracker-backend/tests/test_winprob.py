@@ -0,0 +1,82 @@
+from math import comb
+
+import pytest
+
+from winprob import (
+    DOUBLES, LineFormat, LineState, batch_line_probs, game_prob, line_state, match_prob_from_sets, set_prob,
+    team_win_probability, tiebreak_prob,
+)
+
+SINGLES = LineFormat("singles", sets_to_win=2, games_per_set=6, no_ad=False, serve_prob=0.62)
+
+
+def test_game_prob_with_ad_matches_closed_form():
+    p, q = 0.6, 0.4
+    # win to 0/15/30, plus reach deuce and win from there
+    expected = p**4 * (1 + 4 * q + 10 * q**2) + 20 * p**3 * q**3 * p**2 / (p**2 + q**2)
+    assert game_prob(p, 0, 0, False) == pytest.approx(expected)
+    assert game_prob(0.5, 0, 0, False) == pytest.approx(0.5)
+
+
+def test_game_prob_no_ad_is_first_to_four():
+    p, q = 0.6, 0.4
+    expected = sum(comb(3 + k, k) * p**4 * q**k for k in range(4))
+    assert game_prob(p, 0, 0, True) == pytest.approx(expected)
+    assert game_prob(p, 3, 3, True) == pytest.approx(p)
+
+
+def test_game_prob_at_deuce_and_advantage():
+    p = 0.6
+    deuce = p * p / (p * p + (1 - p) ** 2)
+    assert game_prob(p, 3, 3, False) == pytest.approx(deuce)
+    assert game_prob(p, 4, 3, False) == pytest.approx(p + (1 - p) * deuce)
+    assert game_prob(p, 5, 3, False) == 1.0
+
+
+def test_tiebreak_prob_symmetry_and_ends():
+    assert tiebreak_prob(0.5, 0.5, 0, 0, True, 7) == pytest.approx(0.5)
+    assert tiebreak_prob(0.6, 0.4, 7, 5, True, 7) == 1.0
+    assert tiebreak_prob(0.6, 0.4, 5, 7, True, 7) == 0.0
+    # equal servers, so who serves first doesn't matter
+    assert tiebreak_prob(0.62, 0.38, 0, 0, True, 7) == pytest.approx(tiebreak_prob(0.62, 0.38, 0, 0, False, 7))
+
+
+def test_set_and_match_probabilities():
+    assert set_prob(SINGLES, 6, 3, True) == 1.0
+    assert set_prob(SINGLES, 3, 6, True) == 0.0
+    assert set_prob(SINGLES, 5, 2, True) > set_prob(SINGLES, 2, 5, True)
+    assert match_prob_from_sets(SINGLES, 2, 0) == 1.0
+    assert match_prob_from_sets(SINGLES, 0, 2) == 0.0
+    # evenly matched players (the model has no team edge by default)
+    assert match_prob_from_sets(SINGLES, 0, 0) == pytest.approx(0.5)
+    assert match_prob_from_sets(SINGLES, 1, 0) > 0.5
+
+
+def test_line_state_of_finished_and_live_lines():
+    assert line_state(SINGLES, [[6, 3], [6, 4]]) == 1.0
+    assert line_state(SINGLES, [{"team": 3, "opp": 6}, {"team": 4, "opp": 6}]) == 0.0
+    state = line_state(SINGLES, [[6, 3], [2, 1]], team_serves=False, points=[2, 3])
+    assert state == LineState(sw=1, sl=0, i=2, j=1, s=0, a=2, b=3)
+
+
+def test_batch_line_probs_agrees_with_the_recursion():
+    start = line_state(DOUBLES, [], team_serves=True)
+    (p,) = batch_line_probs(DOUBLES, [start])
+    assert p == pytest.approx(set_prob(DOUBLES, 0, 0, True))
+
+    ahead, behind = batch_line_probs(SINGLES, [
+        line_state(SINGLES, [[6, 3], [5, 2]], points=[3, 0]),
+        line_state(SINGLES, [[3, 6], [2, 5]], points=[0, 3]),
+    ])
+    assert 0.9 < ahead <= 1.0
+    assert 0.0 <= behind < 0.1
+
+
+def test_team_win_probability_counts_the_doubles_point():
+    assert team_win_probability([]) is None
+    lines = [("doubles", 1.0)] * 3 + [("singles", 1.0)] * 6
+    assert team_win_probability(lines) == 1.0
+    even = [("doubles", 0.5)] * 3 + [("singles", 0.5)] * 6
+    assert team_win_probability(even) == pytest.approx(0.5)
+    # won the doubles point, singles split 3-3: 4 of 7
+    assert team_win_probability([("doubles", 1.0)] * 3 + [("singles", 1.0)] * 3 + [("singles", 0.0)] * 3) == 1.0
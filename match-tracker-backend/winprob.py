@@ -0,0 +1,412 @@
+# winprob.py
+# Live win probability for each line and for the dual match.
+#
+# Markov model, point -> game -> set -> match:
+#   * the server wins each point with a fixed probability (per format), and
+#     TEAM_POINT_EDGE shifts every point toward (or away from) our side
+#   * games are ad or no-ad (deciding point at 40-40)
+#   * sets go to games_per_set with a 7-point tiebreak at games_per_set-all,
+#     so an 8-game pro set is just games_per_set=8
+#   * the final set can be replaced by a 10-point match tiebreak
+#
+# For every format we precompute, once, three tables indexed by the score at
+# the start of a game:
+#   W[sw, sl, i, j, s] = P(team wins the line | team wins the current game)
+#   L[sw, sl, i, j, s] = P(team wins the line | team loses the current game)
+#   KIND[sw, sl, i, j] = 0 normal game, 1 set tiebreak, 2 match tiebreak
+# plus game/tiebreak tables indexed by points. A line's probability is then
+#   gp * W + (1 - gp) * L
+# with gp = P(team wins the current game/tiebreak from the point score), all
+# evaluated with NumPy fancy indexing for every live line at once.
+#
+# s = 1 when the team serves the current game (for a tiebreak: served its
+# first point). sets/games are from the team's point of view.
+import os
+from functools import lru_cache
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+SERVE_POINT_WIN_PROB = float(os.getenv("SERVE_POINT_WIN_PROB", "0.62"))
+DOUBLES_SERVE_POINT_WIN_PROB = float(os.getenv("DOUBLES_SERVE_POINT_WIN_PROB", "0.64"))
+# > 0 if we expect our players to win more than their share of points
+TEAM_POINT_EDGE = float(os.getenv("TEAM_POINT_EDGE", "0.0"))
+# "full" (NCAA default) or "match_tiebreak" for a 10-point third set
+SINGLES_FINAL_SET = os.getenv("SINGLES_FINAL_SET", "full").strip().lower()
+
+
+class LineFormat(NamedTuple):
+    name: str
+    sets_to_win: int
+    games_per_set: int
+    no_ad: bool
+    serve_prob: float
+    tiebreak_to: int = 7
+    final_set_match_tiebreak: bool = False
+    match_tiebreak_to: int = 10
+
+
+SINGLES = LineFormat(
+    "singles", sets_to_win=2, games_per_set=6, no_ad=False, serve_prob=SERVE_POINT_WIN_PROB,
+    final_set_match_tiebreak=SINGLES_FINAL_SET == "match_tiebreak",
+)
+# one 8-game pro set, no-ad
+DOUBLES = LineFormat(
+    "doubles", sets_to_win=1, games_per_set=8, no_ad=True, serve_prob=DOUBLES_SERVE_POINT_WIN_PROB,
+)
+FORMATS = {"singles": SINGLES, "doubles": DOUBLES}
+
+NORMAL, TIEBREAK, MATCH_TIEBREAK = 0, 1, 2
+
+
+def format_for(match_type: Optional[str]) -> LineFormat:
+    return DOUBLES if str(match_type or "").strip().lower() == "doubles" else SINGLES
+
+
+def _point_probs(fmt: LineFormat) -> Tuple[float, float]:
+    """(P(team wins a point on its serve), P(team wins a point on the opponent's serve))."""
+    on_serve = min(0.99, max(0.01, fmt.serve_prob + TEAM_POINT_EDGE))
+    on_return = min(0.99, max(0.01, 1 - fmt.serve_prob + TEAM_POINT_EDGE))
+    return on_serve, on_return
+
+
+# ---------------------------------------------------------------- games
+
+@lru_cache(maxsize=None)
+def game_prob(p: float, a: int, b: int, no_ad: bool) -> float:
+    """P(server wins the game) from points (a server, b receiver); p = server's point prob."""
+    if no_ad:
+        if a >= 4:
+            return 1.0
+        if b >= 4:
+            return 0.0
+    else:
+        if a >= 3 and b >= 3:
+            deuce = p * p / (p * p + (1 - p) * (1 - p))
+            d = a - b
+            if d >= 2:
+                return 1.0
+            if d <= -2:
+                return 0.0
+            if d == 1:
+                return p + (1 - p) * deuce
+            if d == -1:
+                return p * deuce
+            return deuce
+        if a >= 4:
+            return 1.0
+        if b >= 4:
+            return 0.0
+    return p * game_prob(p, a + 1, b, no_ad) + (1 - p) * game_prob(p, a, b + 1, no_ad)
+
+
+def team_serves_point(n: int, team_first: bool) -> bool:
+    """Does the team serve point n (0-based) of a tiebreak? The first server
+    takes point 0, then two each. Shared with scoring.py."""
+    return (((n + 1) // 2) % 2 == 0) == team_first
+
+
+@lru_cache(maxsize=None)
+def tiebreak_prob(on_serve: float, on_return: float, a: int, b: int, team_first: bool, target: int) -> float:
+    """P(team wins a first-to-`target`, win-by-2 tiebreak) from points (a team, b opponent)."""
+    if a >= target and a - b >= 2:
+        return 1.0
+    if b >= target and b - a >= 2:
+        return 0.0
+    if a == b and a >= target - 1:
+        # every two points from here each side serves once, in either order
+        return on_serve * on_return / (1 - on_serve * (1 - on_return) - (1 - on_serve) * on_return)
+    p = on_serve if team_serves_point(a + b, team_first) else on_return
+    return (p * tiebreak_prob(on_serve, on_return, a + 1, b, team_first, target)
+            + (1 - p) * tiebreak_prob(on_serve, on_return, a, b + 1, team_first, target))
+
+
+# ---------------------------------------------------------------- sets / match
+
+@lru_cache(maxsize=None)
+def set_prob(fmt: LineFormat, i: int, j: int, team_serves: bool) -> float:
+    """P(team wins the set) from games (i, j) at the start of a game."""
+    G = fmt.games_per_set
+    if (i >= G and i - j >= 2) or (i == G + 1 and j == G):
+        return 1.0
+    if (j >= G and j - i >= 2) or (j == G + 1 and i == G):
+        return 0.0
+    on_serve, on_return = _point_probs(fmt)
+    if i == G and j == G:
+        return tiebreak_prob(on_serve, on_return, 0, 0, team_serves, fmt.tiebreak_to)
+    if team_serves:
+        g = game_prob(on_serve, 0, 0, fmt.no_ad)
+    else:
+        g = 1 - game_prob(1 - on_return, 0, 0, fmt.no_ad)
+    return (g * set_prob(fmt, i + 1, j, not team_serves)
+            + (1 - g) * set_prob(fmt, i, j + 1, not team_serves))
+
+
+def is_match_tiebreak(fmt: LineFormat, sw: int, sl: int) -> bool:
+    """Is the set after (sw, sl) sets a match tiebreak? Shared with scoring.py."""
+    return fmt.final_set_match_tiebreak and sw == sl == fmt.sets_to_win - 1
+
+
+@lru_cache(maxsize=None)
+def match_prob_from_sets(fmt: LineFormat, sw: int, sl: int) -> float:
+    """P(team wins the line) at the start of a new set (first server unknown)."""
+    if sw >= fmt.sets_to_win:
+        return 1.0
+    if sl >= fmt.sets_to_win:
+        return 0.0
+    on_serve, on_return = _point_probs(fmt)
+    if is_match_tiebreak(fmt, sw, sl):
+        return 0.5 * (tiebreak_prob(on_serve, on_return, 0, 0, True, fmt.match_tiebreak_to)
+                      + tiebreak_prob(on_serve, on_return, 0, 0, False, fmt.match_tiebreak_to))
+    x = 0.5 * (set_prob(fmt, 0, 0, True) + set_prob(fmt, 0, 0, False))
+    return x * match_prob_from_sets(fmt, sw + 1, sl) + (1 - x) * match_prob_from_sets(fmt, sw, sl + 1)
+
+
+class FormatTables(NamedTuple):
+    W: np.ndarray          # [sw, sl, i, j, s]
+    L: np.ndarray          # [sw, sl, i, j, s]
+    KIND: np.ndarray       # [sw, sl, i, j]
+    GAME_SERVE: np.ndarray  # [a, b] team serving: P(team holds) from points
+    GAME_RETURN: np.ndarray  # [a, b] opponent serving: P(team breaks) from points
+    TB: np.ndarray         # [a, b, s] set tiebreak from points
+    MTB: np.ndarray        # [a, b, s] match tiebreak from points
+
+
+@lru_cache(maxsize=None)
+def tables(fmt: LineFormat) -> FormatTables:
+    N, G = fmt.sets_to_win, fmt.games_per_set
+    W = np.zeros((N, N, G + 1, G + 1, 2))
+    L = np.zeros_like(W)
+    KIND = np.zeros((N, N, G + 1, G + 1), dtype=np.int8)
+
+    for sw in range(N):
+        for sl in range(N):
+            won_set = match_prob_from_sets(fmt, sw + 1, sl)
+            lost_set = match_prob_from_sets(fmt, sw, sl + 1)
+            if is_match_tiebreak(fmt, sw, sl):
+                KIND[sw, sl] = MATCH_TIEBREAK
+                W[sw, sl], L[sw, sl] = 1.0, 0.0
+                continue
+            for i in range(G + 1):
+                for j in range(G + 1):
+                    if i == G and j == G:
+                        KIND[sw, sl, i, j] = TIEBREAK
+                        W[sw, sl, i, j, :] = won_set
+                        L[sw, sl, i, j, :] = lost_set
+                        continue
+                    for s in (0, 1):
+                        nxt = not s
+                        sw_ = set_prob(fmt, i + 1, j, nxt)
+                        sl_ = set_prob(fmt, i, j + 1, nxt)
+                        W[sw, sl, i, j, s] = sw_ * won_set + (1 - sw_) * lost_set
+                        L[sw, sl, i, j, s] = sl_ * won_set + (1 - sl_) * lost_set
+
+    on_serve, on_return = _point_probs(fmt)
+    game_serve = np.array([[game_prob(on_serve, a, b, fmt.no_ad) for b in range(5)] for a in range(5)])
+    # opponent serving from (their b, our a): team wins with 1 - P(server holds)
+    game_return = np.array([[1 - game_prob(1 - on_return, b, a, fmt.no_ad) for b in range(5)] for a in range(5)])
+
+    def tb_table(target):
+        size = target + 2
+        out = np.zeros((size, size, 2))
+        for a in range(size):
+            for b in range(size):
+                for s in (0, 1):
+                    out[a, b, s] = tiebreak_prob(on_serve, on_return, a, b, bool(s), target)
+        return out
+
+    return FormatTables(W, L, KIND, game_serve, game_return,
+                        tb_table(fmt.tiebreak_to), tb_table(fmt.match_tiebreak_to))
+
+
+# ---------------------------------------------------------------- score state
+
+class LineState(NamedTuple):
+    sw: int = 0
+    sl: int = 0
+    i: int = 0
+    j: int = 0
+    s: int = 1
+    a: int = 0
+    b: int = 0
+
+
+def set_pairs(sets) -> List[Tuple[int, int]]:
+    """Stored sets ([[t, o], ...] or [{"team", "opp"}, ...]) as (team, opp) games."""
+    out = []
+    for item in sets or []:
+        if isinstance(item, dict):
+            out.append((int(item.get("team") or 0), int(item.get("opp") or 0)))
+        elif isinstance(item, (list, tuple)) and len(item) >= 2:
+            out.append((int(item[0] or 0), int(item[1] or 0)))
+    return out
+
+
+def line_state(fmt: LineFormat, sets, team_serves: bool = True, points=None):
+    """Turn stored sets (+ optional point score) into a LineState, or a final 1.0/0.0."""
+    G = fmt.games_per_set
+    sw = sl = 0
+    i = j = 0
+    for t, o in set_pairs(sets):
+        if is_match_tiebreak(fmt, sw, sl):
+            # the deciding "set" is stored as match-tiebreak points
+            if t >= fmt.match_tiebreak_to and t - o >= 2:
+                return 1.0
+            if o >= fmt.match_tiebreak_to and o - t >= 2:
+                return 0.0
+            points = (t, o)
+            break
+        if (t >= G and t - o >= 2) or (t == G + 1 and o == G):
+            sw += 1
+        elif (o >= G and o - t >= 2) or (o == G + 1 and t == G):
+            sl += 1
+        else:
+            i, j = min(t, G), min(o, G)
+            break
+        if sw >= fmt.sets_to_win:
+            return 1.0
+        if sl >= fmt.sets_to_win:
+            return 0.0
+    a, b = (int(points[0]), int(points[1])) if points else (0, 0)
+    if a + b and (is_match_tiebreak(fmt, sw, sl) or (i == G and j == G)):
+        # current_serve is whoever serves the next point; the tables want
+        # whoever served the tiebreak's first one
+        team_serves = team_serves == team_serves_point(a + b, True)
+    return LineState(sw, sl, i, j, 1 if team_serves else 0, a, b)
+
+
+# ---------------------------------------------------------------- batch evaluation
+
+def _clamp_game_points(a, b, no_ad):
+    if no_ad:
+        return np.minimum(a, 4), np.minimum(b, 4)
+    # past deuce only the difference matters (finished games aren't live states)
+    both = (a >= 3) & (b >= 3)
+    d = np.clip(a - b, -1, 1)
+    a2 = np.where(both, 3 + np.maximum(d, 0), np.minimum(a, 4))
+    b2 = np.where(both, 3 + np.maximum(-d, 0), np.minimum(b, 4))
+    return np.minimum(a2, 4), np.minimum(b2, 4)
+
+
+def _tiebreak_lookup(table, a, b, s, target):
+    # drop pairs of points off long tiebreaks; removing two each keeps the serve rotation
+    excess = np.maximum(np.minimum(a, b) - target, 0)
+    excess = excess + (excess % 2)
+    ra, rb = np.minimum(a - excess, target + 1), np.minimum(b - excess, target + 1)
+    won = (a >= target) & (a - b >= 2)
+    lost = (b >= target) & (b - a >= 2)
+    return np.where(won, 1.0, np.where(lost, 0.0, table[ra, rb, s]))
+
+
+def batch_line_probs(fmt: LineFormat, states: List[LineState]) -> np.ndarray:
+    """P(team wins) for many in-progress lines of one format, fully vectorized."""
+    if not states:
+        return np.zeros(0)
+    t = tables(fmt)
+    arr = np.asarray(states, dtype=np.int64)
+    sw, sl, i, j, s, a, b = (arr[:, k] for k in range(7))
+    kind = t.KIND[sw, sl, i, j]
+
+    ga, gb = _clamp_game_points(a, b, fmt.no_ad)
+    gp_normal = np.where(s == 1, t.GAME_SERVE[ga, gb], t.GAME_RETURN[ga, gb])
+    gp_tb = _tiebreak_lookup(t.TB, a, b, s, fmt.tiebreak_to)
+    gp_mtb = _tiebreak_lookup(t.MTB, a, b, s, fmt.match_tiebreak_to)
+
+    gp = np.select([kind == TIEBREAK, kind == MATCH_TIEBREAK], [gp_tb, gp_mtb], gp_normal)
+    return gp * t.W[sw, sl, i, j, s] + (1 - gp) * t.L[sw, sl, i, j, s]
+
+
+def team_win_probability(lines: Iterable[Tuple[str, float]]) -> Optional[float]:
+    """Dual match: doubles point (majority of doubles lines) + one point per singles line."""
+    doubles, singles = [], []
+    for match_type, p in lines:
+        (doubles if str(match_type or "").lower() == "doubles" else singles).append(float(p))
+    if not doubles and not singles:
+        return None
+
+    def at_least(probs, k):
+        dist = np.ones(1)
+        for p in probs:
+            dist = np.convolve(dist, [1 - p, p])
+        return float(dist[k:].sum()) if k < len(dist) else (1.0 if k <= 0 else 0.0)
+
+    doubles_point = at_least(doubles, len(doubles) // 2 + 1) if doubles else 0.5
+    total_points = 1 + len(singles)
+    need = total_points // 2 + 1
+    p = doubles_point * at_least(singles, need - 1) + (1 - doubles_point) * at_least(singles, need)
+    return round(p, 4)
+
+
+# ---------------------------------------------------------------- engine
+
+_TEAM_WINNERS = {"1", "team"}
+_OPP_WINNERS = {"0", "2", "opponent"}
+
+
+def _final_result(row) -> Optional[float]:
+    if str(row.get("status") or "").lower() != "completed":
+        return None
+    w = str(row.get("winner") or "").strip().lower()
+    if w in _TEAM_WINNERS:
+        return 1.0
+    if w in _OPP_WINNERS:
+        return 0.0
+    return None
+
+
+def _team_serves(row) -> bool:
+    # current_serve "0" / "team" / "player1" = our side serving
+    return str(row.get("current_serve") or "0").strip().lower() in ("0", "team", "player1")
+
+
+class WinProbabilityEngine:
+    """Annotates score rows with win_probability, recomputing a line only when its state changes."""
+
+    def __init__(self):
+        # line id -> (state key, probability, match id); pruned by forget()/forget_match()
+        self._lines: Dict[int, Tuple[tuple, float, Optional[int]]] = {}
+
+    def annotate(self, rows: List[dict]) -> Optional[float]:
+        pending: Dict[LineFormat, List[Tuple[dict, tuple, LineState]]] = {}
+        for row in rows:
+            fmt = format_for(row.get("match_type"))
+            points = row.get("points")
+            key = (fmt.name, row.get("status"), row.get("winner"), repr(row.get("sets")),
+                   row.get("current_serve"), repr(points))
+            cached = self._lines.get(row.get("id"))
+            if cached is not None and cached[0] == key:
+                row["win_probability"] = cached[1]
+                continue
+
+            final = _final_result(row)
+            if final is None:
+                final = line_state(fmt, row.get("sets"), _team_serves(row), points)
+            if isinstance(final, float):
+                # decided lines cost nothing to recompute; keep them out of the memo
+                row["win_probability"] = round(final, 4)
+            else:
+                pending.setdefault(fmt, []).append((row, key, final))
+
+        for fmt, items in pending.items():
+            probs = batch_line_probs(fmt, [state for _, _, state in items])
+            for (row, key, _), p in zip(items, probs):
+                self._remember(row, key, float(p))
+
+        return team_win_probability((r.get("match_type"), r["win_probability"]) for r in rows)
+
+    def _remember(self, row, key, p):
+        p = round(p, 4)
+        row["win_probability"] = p
+        if row.get("id") is not None:
+            self._lines[row["id"]] = (key, p, row.get("match_id"))
+
+    def forget(self, score_id: int):
+        self._lines.pop(score_id, None)
+
+    def forget_match(self, match_id: int):
+        """A finished or deleted match's lines aren't annotated live any more."""
+        for line_id in [k for k, v in self._lines.items() if v[2] == match_id]:
+            del self._lines[line_id]
+
+
+engine = WinProbabilityEngine()
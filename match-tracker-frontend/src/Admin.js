@@ -11,13 +11,19 @@ import { ScoreInput } from "./components/LiveScore"; // we added this component
 
 
 /* ---------------- utils ---------------- */
-const headers = {
-  "Content-Type": "application/json",
-};
+// the signed-in admin's token (AuthContext keeps it in localStorage): score and
+// match writes without one are rate limited like anonymous traffic
+function authHeaders() {
+  const token = localStorage.getItem("auth_token");
+  return {
+    "Content-Type": "application/json",
+    ...(token ? { Authorization: `Bearer ${token}` } : {}),
+  };
+}
 
 async function fetchJSON(url, opt = {}) {
   try {
-    const r = await fetch(url, { headers, ...opt });
+    const r = await fetch(url, { headers: authHeaders(), ...opt });
     if (!r.ok) return null;
     return await r.json();
   } catch {
@@ -35,7 +41,7 @@ async function patchJSON(url, data) {
 }
 async function del(url) {
   try {
-    const r = await fetch(url, { method: "DELETE", headers });
+    const r = await fetch(url, { method: "DELETE", headers: authHeaders() });
     return r.ok;
   } catch {
     return false;
@@ -575,9 +581,7 @@ async function startMatch(id) {
   try {
     const response = await fetch(`${API_BASE_URL}/schedule/${id}/start`, {
       method: "POST",
-      headers: {
-        "Content-Type": "application/json",
-      },
+      headers: authHeaders(),
       body: JSON.stringify(body),
     });
     const data = await response.json();
@@ -621,9 +625,7 @@ async function endMatch(matchId) {
   try {
     const res = await fetch(`${API_BASE_URL}/schedule/${matchId}/complete`, {
       method: "POST",
-      headers: {
-        "Content-Type": "application/json",
-      },
+      headers: authHeaders(),
       body: JSON.stringify({ winner: cleanWinner }),
     });
 
@@ -653,7 +655,7 @@ async function startScoreLine(scoreId, body) {
   try {
     const r = await fetch(`${API_BASE_URL}/scores/${scoreId}/start`, {
       method: "POST",
-      headers,
+      headers: authHeaders(),
       body: JSON.stringify(body),
     });
     if (!r.ok) throw new Error(await r.text());
@@ -726,7 +728,7 @@ const payload = {
     console.log("Normalized sets:", normalizedSets);
     const r = await fetch(`${API_BASE_URL}/scores/${row.id}`, {
       method: "PUT",
-      headers,
+      headers: authHeaders(),
       body: JSON.stringify(payload),
     });
     if (!r.ok) throw new Error(await r.text());
@@ -754,7 +756,7 @@ const payload = {
         try {
           const momentumRes = await fetch(`${API_BASE_URL}/scores/${row.id}/momentum`, {
             method: "POST",
-            headers,
+            headers: authHeaders(),
             body: JSON.stringify({ winner }),
           });
           
@@ -791,7 +793,7 @@ async function completeScoreLine(
   try {
     const r = await fetch(`${API_BASE_URL}/scores/${scoreId}/complete`, {
       method: "POST",
-      headers,
+      headers: authHeaders(),
       body: JSON.stringify({ winner }),
     });
     if (!r.ok) throw new Error(await r.text());